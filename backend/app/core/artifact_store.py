@@ -0,0 +1,269 @@
+import os
+import re
+import time
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Dict, Any, Optional, Sequence
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# このアプリが書き出すファイルの名前（UUID + 最適化・星座画像の接尾辞 + 拡張子）
+# UUIDを含まない名前は、同じディレクトリにある他のプログラムのファイルの可能性があるため対象にしない
+ARTIFACT_NAME_PATTERN = re.compile(
+    r"^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}"
+    r"(_optimized)?(_constellation)?\.[a-z0-9]{1,5}$"
+)
+
+@dataclass
+class Artifact:
+    """保存期限と容量の管理対象になっている生成物"""
+    path: str
+    size: int
+    expires_at: float
+    last_access: float
+
+class ArtifactStore:
+    """
+    生成した画像ファイルの保存期限（TTL）と合計バイト数の上限を管理する
+
+    生成した画像を登録し、期限を過ぎたものと、合計バイト数が上限を超えた場合に
+    最も長く参照されていないものを削除する。sweep() は定期的に呼び出す想定で、
+    期限切れの削除に加えて、管理ディレクトリにある未登録の星座画像（再起動前に生成したものなど）の登録と、
+    一時ディレクトリに残った古い一時ファイル（アップロード画像、_optimized、_constellation）の削除を行う。
+    Cloud Runではファイルシステムがメモリ上にあるため、削除しないとインスタンスのメモリを使い切る。
+    """
+
+    def __init__(self, max_bytes: int = 128 * 1024 * 1024, ttl_seconds: float = 86400,
+                 managed_dirs: Sequence[str] = (), temp_dirs: Sequence[str] = (),
+                 orphan_grace_seconds: float = 600, on_evict: Optional[Callable[[str], None]] = None):
+        """
+        Args:
+            max_bytes: 保持する生成物の合計バイト数の上限
+            ttl_seconds: 生成物の保存期限のデフォルト（秒）
+            managed_dirs: 生成物を保存するディレクトリ（未登録の星座画像は登録して管理する）
+            temp_dirs: 一時ファイルを書き出すディレクトリ（未登録の古い一時ファイルは削除する）。
+                他のプログラムと共有するディレクトリ（/tmp など）ではなく、このアプリ専用のディレクトリを指定する
+            orphan_grace_seconds: 未登録の一時ファイルを削除するまでの猶予（処理中のファイルを消さないため）
+            on_evict: 生成物を削除したときに名前を渡して呼び出す関数（インデックスからの削除など）
+        """
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.managed_dirs = list(managed_dirs)
+        self.temp_dirs = list(temp_dirs)
+        self.orphan_grace_seconds = orphan_grace_seconds
+        self.on_evict = on_evict
+        self._artifacts: "OrderedDict[str, Artifact]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._counts = {
+            "expired": 0,
+            "evicted": 0,
+            "orphans_removed": 0,
+            "orphan_bytes_removed": 0,
+            "sweeps": 0
+        }
+        self._last_sweep: Optional[float] = None
+
+    def add(self, name: str, path: str, ttl_seconds: Optional[float] = None,
+            now: Optional[float] = None) -> Optional[Artifact]:
+        """
+        生成物を登録し、合計バイト数が上限を超えた場合は古いものを削除する（登録した生成物は削除しない）
+
+        Args:
+            name: 生成物の名前（/api/images/{name} の name）
+            path: 生成物の保存場所
+            ttl_seconds: この生成物の保存期限（秒、Noneの場合はデフォルト）
+            now: 現在時刻（テスト用）
+
+        Returns:
+            登録した生成物、ファイルが存在しない場合はNone
+        """
+        now = time.time() if now is None else now
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return None
+        ttl = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        artifact = Artifact(path=path, size=size, expires_at=now + ttl, last_access=now)
+        with self._lock:
+            previous = self._artifacts.pop(name, None)
+            if previous is not None:
+                self._bytes -= previous.size
+            self._artifacts[name] = artifact
+            self._bytes += size
+        self._enforce_budget(keep=name)
+        return artifact
+
+    def touch(self, name: str, now: Optional[float] = None) -> bool:
+        """
+        生成物が参照されたことを記録する（容量超過時に削除される順番が後になる）
+
+        Args:
+            name: 生成物の名前
+            now: 現在時刻（テスト用）
+
+        Returns:
+            登録されている場合はTrue
+        """
+        with self._lock:
+            artifact = self._artifacts.get(name)
+            if artifact is None:
+                return False
+            artifact.last_access = time.time() if now is None else now
+            self._artifacts.move_to_end(name)
+            return True
+
+    def _remove(self, names: Sequence[str], reason: str) -> None:
+        """登録を削除してからファイルを削除する（ファイルの削除はロックの外で行う）"""
+        removed = []
+        with self._lock:
+            for name in names:
+                artifact = self._artifacts.pop(name, None)
+                if artifact is not None:
+                    self._bytes -= artifact.size
+                    self._counts[reason] += 1
+                    removed.append((name, artifact))
+        for name, artifact in removed:
+            if self.on_evict is not None:
+                self.on_evict(name)
+            try:
+                os.remove(artifact.path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning(f"生成物の削除に失敗しました: {artifact.path} ({e})")
+        if removed:
+            logger.info(f"生成物を{len(removed)}個削除しました（理由: {reason}）")
+
+    def _enforce_budget(self, keep: Optional[str] = None) -> None:
+        """
+        合計バイト数が上限を超えている間、最も長く参照されていないものから削除する
+
+        1個で上限を超える生成物は、登録した直後には削除しない（レスポンスで返すパスが使えなくなるため）。
+        その場合は他の生成物がすべて削除され、その生成物自体は次の sweep() で削除される。
+
+        Args:
+            keep: 削除しない生成物の名前（登録した直後の生成物）
+        """
+        with self._lock:
+            over = self._bytes - self.max_bytes
+            victims = []
+            for name, artifact in self._artifacts.items():
+                if over <= 0:
+                    break
+                if name == keep:
+                    continue
+                victims.append(name)
+                over -= artifact.size
+        self._remove(victims, "evicted")
+
+    def _adopt_untracked(self) -> None:
+        """管理ディレクトリにある未登録の星座画像を、更新時刻を生成時刻として登録する"""
+        with self._lock:
+            tracked = {artifact.path for artifact in self._artifacts.values()}
+        candidates = []
+        for directory in self.managed_dirs:
+            try:
+                entries = list(os.scandir(directory))
+            except OSError:
+                continue
+            for entry in entries:
+                if entry.path in tracked or "_constellation" not in entry.name:
+                    continue
+                if not ARTIFACT_NAME_PATTERN.match(entry.name) or not entry.is_file():
+                    continue
+                try:
+                    candidates.append((entry.stat().st_mtime, entry))
+                except OSError:
+                    continue
+        # 新しいものから順に先頭へ入れ、古いものほど先に削除されるようにする
+        candidates.sort(key=lambda candidate: candidate[0], reverse=True)
+        for mtime, entry in candidates:
+            artifact = Artifact(
+                path=entry.path, size=entry.stat().st_size,
+                expires_at=mtime + self.ttl_seconds, last_access=mtime
+            )
+            with self._lock:
+                if entry.name in self._artifacts:
+                    continue
+                self._artifacts[entry.name] = artifact
+                self._artifacts.move_to_end(entry.name, last=False)
+                self._bytes += artifact.size
+        if candidates:
+            logger.info(f"未登録の星座画像を{len(candidates)}個登録しました")
+
+    def _remove_orphans(self, now: float) -> None:
+        """一時ディレクトリにある、登録されていない古い一時ファイルを削除する"""
+        with self._lock:
+            tracked = {artifact.path for artifact in self._artifacts.values()}
+        removed, removed_bytes = 0, 0
+        for directory in self.temp_dirs:
+            try:
+                entries = list(os.scandir(directory))
+            except OSError:
+                continue
+            for entry in entries:
+                if entry.path in tracked or not ARTIFACT_NAME_PATTERN.match(entry.name):
+                    continue
+                try:
+                    if not entry.is_file(follow_symlinks=False):
+                        continue
+                    stat = entry.stat(follow_symlinks=False)
+                    if now - stat.st_mtime < self.orphan_grace_seconds:
+                        continue
+                    os.remove(entry.path)
+                except FileNotFoundError:
+                    continue
+                except OSError as e:
+                    logger.warning(f"一時ファイルの削除に失敗しました: {entry.path} ({e})")
+                    continue
+                removed += 1
+                removed_bytes += stat.st_size
+        with self._lock:
+            self._counts["orphans_removed"] += removed
+            self._counts["orphan_bytes_removed"] += removed_bytes
+        if removed:
+            logger.info(f"残っていた一時ファイルを{removed}個削除しました: {removed_bytes} バイト")
+
+    def sweep(self, now: Optional[float] = None) -> Dict[str, Any]:
+        """
+        期限切れの生成物と残っている一時ファイルを削除し、合計バイト数を上限以下にする
+
+        Args:
+            now: 現在時刻（テスト用）
+
+        Returns:
+            削除後の使用状況（stats() と同じ）
+        """
+        now = time.time() if now is None else now
+        self._adopt_untracked()
+        with self._lock:
+            expired = [name for name, artifact in self._artifacts.items() if artifact.expires_at <= now]
+        self._remove(expired, "expired")
+        self._remove_orphans(now)
+        self._enforce_budget()
+        with self._lock:
+            self._counts["sweeps"] += 1
+            self._last_sweep = now
+        return self.stats()
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        生成物の保存領域の使用状況を返す
+
+        Returns:
+            生成物の数、合計バイト数と上限、使用率、削除した数、最後に掃除した時刻を含む辞書
+        """
+        with self._lock:
+            return {
+                "artifacts": len(self._artifacts),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "occupancy": self._bytes / self.max_bytes if self.max_bytes else 0.0,
+                "ttl_seconds": self.ttl_seconds,
+                **self._counts,
+                "last_sweep": self._last_sweep
+            }
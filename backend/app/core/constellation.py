@@ -3,12 +3,296 @@ import numpy as np
 from typing import List, Tuple, Dict, Any, Optional
 import logging
 import random
+import io
 from PIL import Image, ImageDraw
 
+from app.core.image_processing import load_pillow_plugins
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def draw_constellation_lines(image_path: str, points: List[List[Tuple[int, int]]], output_path: Optional[str] = None) -> Dict[str, Any]:
+LINE_TOPOLOGIES = ("mst", "nearest")
+
+# 星座画像の出力フォーマット（PILの保存形式, MIMEタイプ, 拡張子）
+OUTPUT_FORMATS = {
+    "jpeg": ("JPEG", "image/jpeg", ".jpg"),
+    "webp": ("WEBP", "image/webp", ".webp"),
+    "avif": ("AVIF", "image/avif", ".avif")
+}
+
+# 画質の段階ごとのフォーマット別の品質（low はモバイル回線向け）
+QUALITY_TIERS = {
+    "low": {"jpeg": 60, "webp": 55, "avif": 45},
+    "standard": {"jpeg": 80, "webp": 75, "avif": 60},
+    "high": {"jpeg": 95, "webp": 90, "avif": 80}
+}
+
+def _pairwise_distances(coords: np.ndarray) -> np.ndarray:
+    """
+    点群の距離行列を計算する
+    
+    Args:
+        coords: 座標の配列（k x 2）
+        
+    Returns:
+        距離行列（k x k）
+    """
+    diff = coords[:, None, :] - coords[None, :, :]
+    return np.sqrt((diff ** 2).sum(axis=-1))
+
+def _nearest_neighbor_edges(distances: np.ndarray) -> List[Tuple[int, int]]:
+    """
+    最初の点から、直前に繋いだ点に最も近い未接続の点を順に繋いでいく（従来の一筆書き）
+    距離が同じ場合は元の並びで先の点を選ぶ
+    
+    Args:
+        distances: 距離行列
+        
+    Returns:
+        繋いだ点のインデックスの組のリスト
+    """
+    count = len(distances)
+    connected = np.zeros(count, dtype=bool)
+    connected[0] = True
+    last = 0
+    edges = []
+    for _ in range(count - 1):
+        row = np.where(connected, np.inf, distances[last])
+        closest = int(np.argmin(row))
+        edges.append((last, closest))
+        connected[closest] = True
+        last = closest
+    return edges
+
+def _minimum_spanning_edges(distances: np.ndarray, extra_edges: int = 0) -> List[Tuple[int, int]]:
+    """
+    最小全域木（Prim法）で点を繋ぐ
+    extra_edges を指定した場合は、木に含まれない辺のうち短いものを追加して閉路を作る
+    
+    Args:
+        distances: 距離行列
+        extra_edges: 最小全域木に追加する辺の数
+        
+    Returns:
+        繋いだ点のインデックスの組のリスト（木の辺は追加した順）
+    """
+    count = len(distances)
+    in_tree = np.zeros(count, dtype=bool)
+    in_tree[0] = True
+    best = distances[0].copy()
+    parent = np.zeros(count, dtype=np.int64)
+    edges = []
+    for _ in range(count - 1):
+        candidates = np.where(in_tree, np.inf, best)
+        child = int(np.argmin(candidates))
+        edges.append((int(parent[child]), child))
+        in_tree[child] = True
+        closer = distances[child] < best
+        best[closer] = distances[child][closer]
+        parent[closer] = child
+    
+    if extra_edges > 0:
+        used = np.zeros((count, count), dtype=bool)
+        for i, j in edges:
+            used[i, j] = used[j, i] = True
+        rows, cols = np.triu_indices(count, k=1)
+        unused = ~used[rows, cols]
+        rows, cols = rows[unused], cols[unused]
+        order = np.argsort(distances[rows, cols], kind="stable")[:extra_edges]
+        edges.extend((int(rows[k]), int(cols[k])) for k in order)
+    
+    return edges
+
+def compute_constellation_edges(cluster_points: List[Tuple[int, int]], topology: str = "mst",
+                                extra_edges: int = 0) -> List[Tuple[int, int]]:
+    """
+    星座の点をどの順に繋ぐかを計算する
+    
+    Args:
+        cluster_points: 1つの星座の座標リスト
+        topology: 星座ラインの繋ぎ方
+            "mst": 最小全域木（デフォルト）
+            "nearest": 直前の点に最も近い点を順に繋ぐ従来の一筆書き
+        extra_edges: "mst"の場合に追加する短い辺の数
+        
+    Returns:
+        繋ぐ点のインデックスの組のリスト
+    """
+    if topology not in LINE_TOPOLOGIES:
+        raise ValueError(f"未対応の星座ラインの繋ぎ方です: {topology}")
+    if len(cluster_points) < 2:
+        return []
+    
+    distances = _pairwise_distances(np.asarray(cluster_points, dtype=np.float64))
+    if topology == "nearest":
+        return _nearest_neighbor_edges(distances)
+    return _minimum_spanning_edges(distances, extra_edges)
+
+def build_constellation_data(points: List[List[Tuple[int, int]]], topology: str = "mst",
+                             extra_edges: int = 0) -> Dict[str, Any]:
+    """
+    星座を構成する星とラインの座標を計算する（描画は行わない）
+    
+    Args:
+        points: 星座の点群（クラスタごとの座標リスト）
+        topology: 星座ラインの繋ぎ方（compute_constellation_edgesを参照）
+        extra_edges: "mst"の場合に追加する短い辺の数
+        
+    Returns:
+        星（stars）と星座ライン（lines）の情報
+    """
+    if not points or all(len(cluster) < 3 for cluster in points):
+        logger.warning("有効な星座の点が提供されていません。デフォルトの点を使用します。")
+        points = [
+            [(100, 100), (200, 150), (300, 200), (400, 250), (500, 300)]
+        ]
+    
+    constellation_data = {
+        "stars": [],
+        "lines": []
+    }
+    
+    for cluster_points in points:
+        if len(cluster_points) < 3:
+            continue
+        
+        for x, y in cluster_points:
+            constellation_data["stars"].append({"x": x, "y": y})
+        
+        for i, j in compute_constellation_edges(cluster_points, topology, extra_edges):
+            start, end = cluster_points[i], cluster_points[j]
+            constellation_data["lines"].append({
+                "start": {"x": start[0], "y": start[1]},
+                "end": {"x": end[0], "y": end[1]}
+            })
+    
+    return constellation_data
+
+def _draw_constellation(image: Image.Image, points: List[List[Tuple[int, int]]],
+                        topology: str = "mst", extra_edges: int = 0) -> Dict[str, Any]:
+    """
+    画像に星座のラインと星を描画する
+    全ての星座のラインを先に計算し、ライン、星の順に1回ずつ描画する
+    
+    Args:
+        image: 描画先の画像（RGBモード）
+        points: 星座の点群（クラスタごとの座標リスト）
+        topology: 星座ラインの繋ぎ方（compute_constellation_edgesを参照）
+        extra_edges: "mst"の場合に追加する短い辺の数
+        
+    Returns:
+        描画した星と星座ラインの情報
+    """
+    constellation_data = build_constellation_data(points, topology, extra_edges)
+    
+    draw = ImageDraw.Draw(image)
+    for line in constellation_data["lines"]:
+        start, end = line["start"], line["end"]
+        draw.line([(start["x"], start["y"]), (end["x"], end["y"])], fill=(255, 215, 0), width=2)
+    for star in constellation_data["stars"]:
+        x, y = star["x"], star["y"]
+        draw.ellipse([(x-3, y-3), (x+3, y+3)], fill=(255, 255, 255))
+    
+    return constellation_data
+
+def render_constellation_svg(constellation_data: Dict[str, Any], width: int, height: int) -> str:
+    """
+    星座のラインと星を、元画像に重ねて表示するための透過SVGにする
+    ラスター画像への描画（_draw_constellation）と同じ色・太さで描き、
+    viewBoxを星の座標系（width x height）に合わせるため、表示サイズに合わせて拡大・縮小できる
+    
+    Args:
+        constellation_data: 星（stars）と星座ライン（lines）の情報
+        width: 星の座標系の幅
+        height: 星の座標系の高さ
+        
+    Returns:
+        SVGの文字列
+    """
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {width} {height}" '
+        f'width="{width}" height="{height}" preserveAspectRatio="none">',
+        '<g stroke="rgb(255,215,0)" stroke-width="2" stroke-linecap="round">'
+    ]
+    for line in constellation_data["lines"]:
+        start, end = line["start"], line["end"]
+        parts.append(f'<line x1="{start["x"]}" y1="{start["y"]}" x2="{end["x"]}" y2="{end["y"]}"/>')
+    parts.append('</g>')
+    parts.append('<g fill="rgb(255,255,255)">')
+    for star in constellation_data["stars"]:
+        parts.append(f'<circle cx="{star["x"]}" cy="{star["y"]}" r="3"/>')
+    parts.append('</g></svg>')
+    return "".join(parts)
+
+def render_constellation(image: np.ndarray, points: List[List[Tuple[int, int]]],
+                         topology: str = "mst", extra_edges: int = 0) -> Tuple[Image.Image, Dict[str, Any]]:
+    """
+    メモリ上の画像に星座のラインを描画する
+    ファイルの読み書きを行わないインメモリパイプライン用
+    
+    Args:
+        image: 元画像（グレースケールまたはBGR形式の配列）
+        points: 星座の点群（クラスタごとの座標リスト）
+        topology: 星座ラインの繋ぎ方（compute_constellation_edgesを参照）
+        extra_edges: "mst"の場合に追加する短い辺の数
+        
+    Returns:
+        描画済みの画像と星座ラインの情報のタプル
+    """
+    if image is None or image.size == 0:
+        logger.warning("画像データが空のため、黒い背景を使用します")
+        rendered = Image.new('RGB', (800, 600), color=(0, 0, 0))
+    elif image.ndim == 2:
+        rendered = Image.fromarray(image).convert('RGB')
+    else:
+        rendered = Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+    
+    constellation_data = _draw_constellation(rendered, points, topology, extra_edges)
+    return rendered, constellation_data
+
+def available_output_formats() -> List[str]:
+    """
+    このサーバーでエンコードできる出力フォーマットを返す
+    AVIFはPILのプラグイン（pillow-avif-plugin など）がインストールされている場合のみ
+    
+    Returns:
+        OUTPUT_FORMATS のキーのうちエンコードできるもののリスト
+    """
+    load_pillow_plugins()
+    Image.init()
+    return [name for name, (pil_format, _, _) in OUTPUT_FORMATS.items() if pil_format in Image.SAVE]
+
+def encode_constellation_image(image: Image.Image, image_format: str = "jpeg", quality: str = "standard") -> bytes:
+    """
+    描画済みの星座画像をバイト列にエンコードする
+    
+    Args:
+        image: 描画済みの画像
+        image_format: 出力フォーマット（"jpeg", "webp", "avif"）
+        quality: 画質の段階（"low", "standard", "high"）
+        
+    Returns:
+        エンコードされた画像のバイト内容
+    """
+    image_format = image_format.lower()
+    if image_format not in OUTPUT_FORMATS:
+        raise ValueError(f"未対応の出力フォーマットです: {image_format}")
+    if quality not in QUALITY_TIERS:
+        raise ValueError(f"未対応の画質です: {quality}")
+    
+    options = {"quality": QUALITY_TIERS[quality][image_format]}
+    if image_format == "jpeg":
+        options["optimize"] = True
+    elif image_format == "webp":
+        options["method"] = 4
+    
+    buffer = io.BytesIO()
+    image.save(buffer, format=OUTPUT_FORMATS[image_format][0], **options)
+    return buffer.getvalue()
+
+def draw_constellation_lines(image_path: str, points: List[List[Tuple[int, int]]], output_path: Optional[str] = None,
+                             topology: str = "mst", extra_edges: int = 0,
+                             image_format: str = "jpeg", quality: str = "standard") -> Dict[str, Any]:
     """
     星座のラインを描画する
     
@@ -16,6 +300,10 @@ def draw_constellation_lines(image_path: str, points: List[List[Tuple[int, int]]
         image_path: 元画像のパス
         points: 星座の点群（クラスタごとの座標リスト）
         output_path: 出力画像のパス（指定がない場合は自動生成）
+        topology: 星座ラインの繋ぎ方（compute_constellation_edgesを参照）
+        extra_edges: "mst"の場合に追加する短い辺の数
+        image_format: 出力フォーマット（"jpeg", "webp", "avif"）
+        quality: 画質の段階（"low", "standard", "high"）
         
     Returns:
         描画された画像のパスと星座ラインの情報を含む辞書
@@ -54,69 +342,27 @@ def draw_constellation_lines(image_path: str, points: List[List[Tuple[int, int]]
                     image = Image.new('RGB', (800, 600), color=(0, 0, 0))
                     logger.info("画像読み込みに失敗したため、黒い背景を使用します")
             
-        draw = ImageDraw.Draw(image)
-        
-        if not points or all(len(cluster) < 3 for cluster in points):
-            logger.warning("有効な星座の点が提供されていません。デフォルトの点を使用します。")
-            points = [
-                [(100, 100), (200, 150), (300, 200), (400, 250), (500, 300)]
-            ]
-        
-        constellation_data = {
-            "stars": [],
-            "lines": []
-        }
-        
-        for cluster_points in points:
-            if len(cluster_points) < 3:
-                continue
-                
-            connected = [cluster_points[0]]  # 最初の点を追加
-            remaining = cluster_points[1:]
-            
-            for x, y in cluster_points:
-                constellation_data["stars"].append({"x": x, "y": y})
-            
-            while remaining:
-                last_point = connected[-1]
-                
-                closest_idx = 0
-                min_distance = float('inf')
-                
-                for i, point in enumerate(remaining):
-                    distance = np.sqrt((last_point[0] - point[0])**2 + (last_point[1] - point[1])**2)
-                    if distance < min_distance:
-                        min_distance = distance
-                        closest_idx = i
-                
-                closest_point = remaining.pop(closest_idx)
-                connected.append(closest_point)
-                
-                constellation_data["lines"].append({
-                    "start": {"x": last_point[0], "y": last_point[1]},
-                    "end": {"x": closest_point[0], "y": closest_point[1]}
-                })
-                
-                draw.line([last_point, closest_point], fill=(255, 215, 0), width=2)
-                
-                for x, y in connected:
-                    draw.ellipse([(x-3, y-3), (x+3, y+3)], fill=(255, 255, 255))
+        constellation_data = _draw_constellation(image, points, topology, extra_edges)
         
+        extension = OUTPUT_FORMATS[image_format.lower()][2]
         if output_path is None:
             try:
-                output_path = image_path.rsplit(".", 1)[0] + "_constellation.jpg"
+                output_path = image_path.rsplit(".", 1)[0] + f"_constellation{extension}"
             except Exception:
                 import uuid
-                output_path = f"/tmp/{uuid.uuid4()}_constellation.jpg"
+                output_path = f"/tmp/{uuid.uuid4()}_constellation{extension}"
         
+        encoded = encode_constellation_image(image, image_format, quality)
         try:
-            image.save(output_path, format='JPEG')
+            with open(output_path, "wb") as f:
+                f.write(encoded)
             logger.info(f"星座画像を保存しました: {output_path}")
         except Exception as save_error:
             logger.error(f"画像の保存に失敗しました: {save_error}")
             import uuid
-            output_path = f"/tmp/{uuid.uuid4()}_constellation.jpg"
-            image.save(output_path, format='JPEG')
+            output_path = f"/tmp/{uuid.uuid4()}_constellation{extension}"
+            with open(output_path, "wb") as f:
+                f.write(encoded)
             logger.info(f"代替パスに星座画像を保存しました: {output_path}")
         
         return {
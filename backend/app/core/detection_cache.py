@@ -0,0 +1,213 @@
+import os
+import json
+import pickle
+import hashlib
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Tuple
+
+import numpy as np
+
+from app.core.star_detection import StarField
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class StarFieldCache:
+    """
+    星検出とクラスタリングの結果を画像の内容で引けるキャッシュ
+
+    キーはデコード済み画像のバイト列と検出パラメータのハッシュで、値は最適化済み画像と
+    StarFieldの組。メモリ上のLRU（合計バイト数で上限を設定）と、任意のディスク層の2段構成。
+    同じ写真をキーワードだけ変えて再送した場合に、星検出とクラスタリングを省略できる。
+    ディスク層も合計バイト数で上限を設定し、書き込むたびに最も長く使われていないファイルから削除する
+    （ファイルの更新時刻を最後に使った時刻として扱うため、複数のワーカープロセスで共有しても動作する）。
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, cache_dir: Optional[str] = None,
+                 disk_max_bytes: int = 256 * 1024 * 1024):
+        """
+        Args:
+            max_bytes: メモリ層に保持する合計バイト数の上限（0の場合はメモリ層を使用しない）
+            cache_dir: ディスク層のディレクトリ（Noneの場合はディスク層を使用しない）
+            disk_max_bytes: ディスク層に保持する合計バイト数の上限
+        """
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.disk_max_bytes = disk_max_bytes
+        self._entries: "OrderedDict[str, Tuple[np.ndarray, StarField, int]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._counts = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "disk_evictions": 0
+        }
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(image: np.ndarray, params: Dict[str, Any]) -> str:
+        """
+        デコード済み画像と検出パラメータからキャッシュキーを作成する
+
+        Args:
+            image: デコード済みの画像
+            params: 検出・クラスタリングのパラメータ
+
+        Returns:
+            キャッシュキー（16進文字列）
+        """
+        digest = hashlib.blake2b(digest_size=20)
+        digest.update(f"{image.shape}:{image.dtype}".encode())
+        digest.update(memoryview(np.ascontiguousarray(image)).cast("B"))
+        digest.update(json.dumps(params, sort_keys=True, default=str).encode())
+        return digest.hexdigest()
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.pkl")
+
+    def get(self, key: str) -> Optional[Tuple[np.ndarray, StarField]]:
+        """
+        キャッシュから最適化済み画像とStarFieldを取得する
+
+        Args:
+            key: キャッシュキー
+
+        Returns:
+            最適化済み画像とStarFieldのタプル、見つからない場合はNone
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._counts["memory_hits"] += 1
+                return entry[0], entry[1]
+
+        if self.cache_dir:
+            path = self._disk_path(key)
+            try:
+                with open(path, "rb") as f:
+                    optimized, star_field = pickle.load(f)
+                # 更新時刻を最後に使った時刻にして、ディスク層の削除の順番を後にする
+                os.utime(path)
+                self._store_in_memory(key, optimized, star_field)
+                with self._lock:
+                    self._counts["disk_hits"] += 1
+                return optimized, star_field
+            except FileNotFoundError:
+                pass
+            except Exception as disk_error:
+                logger.warning(f"ディスクキャッシュの読み込みに失敗しました: {disk_error}")
+
+        with self._lock:
+            self._counts["misses"] += 1
+        return None
+
+    def put(self, key: str, optimized: np.ndarray, star_field: StarField) -> None:
+        """
+        最適化済み画像とStarFieldをキャッシュに保存する
+
+        Args:
+            key: キャッシュキー
+            optimized: 最適化済みの画像
+            star_field: 星検出結果
+        """
+        self._store_in_memory(key, optimized, star_field)
+
+        if self.cache_dir:
+            path = self._disk_path(key)
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), delete=False) as f:
+                    pickle.dump((optimized, star_field), f, protocol=pickle.HIGHEST_PROTOCOL)
+                    temp_path = f.name
+                os.replace(temp_path, path)
+            except Exception as disk_error:
+                logger.warning(f"ディスクキャッシュへの書き込みに失敗しました: {disk_error}")
+            self._prune_disk()
+
+    def _prune_disk(self) -> None:
+        """ディスク層の合計バイト数が上限を超えている場合、更新時刻が古いファイルから削除する"""
+        files = []
+        total = 0
+        try:
+            subdirs = [entry.path for entry in os.scandir(self.cache_dir) if entry.is_dir()]
+        except OSError:
+            return
+        for subdir in subdirs:
+            try:
+                entries = list(os.scandir(subdir))
+            except OSError:
+                continue
+            for entry in entries:
+                if not entry.name.endswith(".pkl"):
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+        if total <= self.disk_max_bytes:
+            return
+
+        removed = 0
+        for _, size, path in sorted(files):
+            if total <= self.disk_max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning(f"ディスクキャッシュの削除に失敗しました: {path} ({e})")
+                continue
+            total -= size
+            removed += 1
+        with self._lock:
+            self._counts["disk_evictions"] += removed
+        logger.info(f"ディスクキャッシュを{removed}個削除しました（合計 {total} バイト）")
+
+    def _store_in_memory(self, key: str, optimized: np.ndarray, star_field: StarField) -> None:
+        # 星のリストの大きさはpickle後のサイズで概算する
+        size = optimized.nbytes + len(pickle.dumps(star_field, protocol=pickle.HIGHEST_PROTOCOL))
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous[2]
+            self._entries[key] = (optimized, star_field, size)
+            self._bytes += size
+
+            while self._bytes > self.max_bytes and self._entries:
+                _, (_, _, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self._counts["evictions"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        キャッシュの使用状況とヒット数を返す
+
+        Returns:
+            エントリ数、使用バイト数、ヒット・ミス数を含む辞書
+        """
+        with self._lock:
+            hits = self._counts["memory_hits"] + self._counts["disk_hits"]
+            lookups = hits + self._counts["misses"]
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "disk_enabled": bool(self.cache_dir),
+                "disk_max_bytes": self.disk_max_bytes,
+                "hits": hits,
+                **self._counts,
+                "hit_rate": hits / lookups if lookups else 0.0
+            }
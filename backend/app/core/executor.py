@@ -0,0 +1,262 @@
+import os
+import time
+import asyncio
+import logging
+import functools
+import multiprocessing
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Any, Dict, Optional, Tuple
+
+from app.core.metrics import record_stage
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class PipelineBusyError(Exception):
+    """処理キューが満杯で新しいジョブを受け付けられない場合に送出されるエラー"""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"処理キューが満杯です。{retry_after}秒後に再試行してください。")
+        self.retry_after = retry_after
+
+def _init_worker() -> None:
+    """
+    ワーカープロセスの初期化処理
+    ワーカー数ぶんのプロセスが並列に動くため、OpenCV内部のスレッド数を1に制限する
+    """
+    try:
+        import cv2
+        cv2.setNumThreads(1)
+    except Exception as e:
+        logger.warning(f"ワーカープロセスの初期化中にエラーが発生しました: {e}")
+
+def _timed_call(fn: Callable[..., Any], submitted_at: float, *args, **kwargs) -> Tuple[Any, float, float]:
+    """
+    ワーカー上でジョブを実行し、キュー待ち時間と実行時間を計測する
+
+    Args:
+        fn: 実行する関数
+        submitted_at: ジョブを投入した時刻（time.time()）
+        *args: 関数の位置引数
+        **kwargs: 関数のキーワード引数
+
+    Returns:
+        関数の戻り値、キュー待ち時間（秒）、実行時間（秒）のタプル
+    """
+    started_at = time.time()
+    result = fn(*args, **kwargs)
+    return result, max(0.0, started_at - submitted_at), time.time() - started_at
+
+class PipelineExecutor:
+    """
+    CPU負荷の高い画像処理をイベントループの外で実行する有界ワーカープール
+
+    実行中と待機中のジョブの合計が max_workers + max_queue に達した場合は、
+    ジョブをキューに積まずに PipelineBusyError を送出する（アドミッション制御）。
+    submit() と run() はイベントループのスレッドからのみ呼び出すことを前提とする。
+    """
+
+    def __init__(self, max_workers: Optional[int] = None, max_queue: Optional[int] = None,
+                 retry_after: int = 2, use_processes: bool = True):
+        """
+        Args:
+            max_workers: ワーカー数（Noneの場合はCPUコア数）
+            max_queue: ワーカーが空くのを待てるジョブの最大数（Noneの場合はワーカー数の2倍）
+            retry_after: キューが満杯の場合にクライアントへ返す再試行までの秒数
+            use_processes: Trueの場合はプロセスプール、Falseの場合はスレッドプールで実行する
+        """
+        self.max_workers = max(1, max_workers or os.cpu_count() or 1)
+        self.max_queue = max(0, max_queue if max_queue is not None else self.max_workers * 2)
+        self.retry_after = retry_after
+        self.use_processes = use_processes
+        self._pool: Optional[Executor] = None
+        self._in_flight = 0
+        self._stats = {
+            "submitted": 0,
+            "completed": 0,
+            "failed": 0,
+            "rejected": 0,
+            "queue_wait_seconds_total": 0.0,
+            "queue_wait_seconds_max": 0.0,
+            "execution_seconds_total": 0.0,
+            "execution_seconds_max": 0.0
+        }
+
+    @property
+    def capacity(self) -> int:
+        """同時に受け付けられるジョブの最大数（実行中 + 待機中）"""
+        return self.max_workers + self.max_queue
+
+    @property
+    def in_flight(self) -> int:
+        """実行中と待機中のジョブの合計数"""
+        return self._in_flight
+
+    @property
+    def queue_depth(self) -> int:
+        """ワーカーが空くのを待っているジョブの数"""
+        return max(0, self._in_flight - self.max_workers)
+
+    def _get_pool(self) -> Executor:
+        if self._pool is None:
+            if self.use_processes:
+                # uvicornのスレッドを引き継がないようにspawnでワーカーを起動する
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_worker
+                )
+            else:
+                self._pool = ThreadPoolExecutor(
+                    max_workers=self.max_workers,
+                    thread_name_prefix="pipeline"
+                )
+            logger.info(
+                f"パイプラインのワーカープールを起動しました: "
+                f"{'プロセス' if self.use_processes else 'スレッド'}, "
+                f"ワーカー数={self.max_workers}, キュー上限={self.max_queue}"
+            )
+        return self._pool
+
+    def reserve(self, count: int) -> None:
+        """
+        複数のジョブの枠をまとめて確保する（バッチのように1つのリクエストが複数のジョブを投入する場合）
+        確保した枠は submit(..., reserved=True) で1つずつ使い、使わなかった枠は release() で返す
+
+        Args:
+            count: 確保するジョブの数
+
+        Raises:
+            PipelineBusyError: 実行中と待機中のジョブに count を加えると上限を超える場合
+        """
+        if count <= 0:
+            return
+        if self._in_flight + count > self.capacity:
+            self._stats["rejected"] += 1
+            logger.warning(
+                f"処理キューに空きがないためジョブ{count}件の受付を拒否しました: 実行中+待機中={self._in_flight}"
+            )
+            raise PipelineBusyError(self.retry_after)
+        self._in_flight += count
+
+    def release(self, count: int) -> None:
+        """reserve() で確保して使わなかった枠、または実行が終わったジョブの枠を返す"""
+        self._in_flight -= count
+
+    def submit(self, fn: Callable[..., Any], *args, admitted: bool = False, reserved: bool = False,
+               **kwargs) -> "asyncio.Future[Any]":
+        """
+        ジョブをワーカープールに投入し、完了を待つためのFutureを返す
+        アドミッション制御はこの呼び出しの時点で同期的に行われる
+
+        Args:
+            fn: 実行する関数（プロセスプールの場合はモジュールレベルの関数である必要がある）
+            *args: 関数の位置引数
+            admitted: 受付済みのリクエストの後続ジョブの場合はTrue（キューの上限チェックを行わない）
+            reserved: reserve() で確保した枠を使う場合はTrue
+            **kwargs: 関数のキーワード引数
+
+        Returns:
+            関数の戻り値を結果に持つFuture
+
+        Raises:
+            PipelineBusyError: 実行中と待機中のジョブが上限に達している場合
+        """
+        if not reserved:
+            if not admitted and self._in_flight >= self.capacity:
+                self._stats["rejected"] += 1
+                logger.warning(f"処理キューが満杯のためジョブを拒否しました: 実行中+待機中={self._in_flight}")
+                raise PipelineBusyError(self.retry_after)
+            self._in_flight += 1
+        loop = asyncio.get_running_loop()
+        call = functools.partial(_timed_call, fn, time.time(), *args, **kwargs)
+        try:
+            job = self._get_pool().submit(call)
+        except Exception:
+            # 投入できなかったジョブの枠はここで返す（reserved の場合も同じ）
+            self._in_flight -= 1
+            self._stats["failed"] += 1
+            raise
+        # 待っているリクエストがキャンセルされても、実行中のジョブはワーカーで最後まで動き続ける。
+        # 枠はリクエストの終了時ではなく、ワーカーでの実行が終わった時点で返す
+        # （待機中のジョブは取り消されるため、その時点で返る）
+        job.add_done_callback(self._release_on_done(loop))
+        self._stats["submitted"] += 1
+        task = asyncio.ensure_future(self._execute(fn, job))
+        task.add_done_callback(lambda finished: job.cancel() if finished.cancelled() else None)
+        return task
+
+    async def run(self, fn: Callable[..., Any], *args, admitted: bool = False, **kwargs) -> Any:
+        """
+        ジョブをワーカープールで実行し、完了を待つ
+
+        Args:
+            fn: 実行する関数（プロセスプールの場合はモジュールレベルの関数である必要がある）
+            *args: 関数の位置引数
+            admitted: 受付済みのリクエストの後続ジョブの場合はTrue（キューの上限チェックを行わない）
+            **kwargs: 関数のキーワード引数
+
+        Returns:
+            関数の戻り値
+
+        Raises:
+            PipelineBusyError: 実行中と待機中のジョブが上限に達している場合
+        """
+        return await self.submit(fn, *args, admitted=admitted, **kwargs)
+
+    def _release_on_done(self, loop: asyncio.AbstractEventLoop) -> Callable[[Any], None]:
+        """ワーカーでの実行が終わった（または開始前に取り消された）時点で、イベントループ上で枠を返すコールバック"""
+        def release(_job) -> None:
+            try:
+                loop.call_soon_threadsafe(self.release, 1)
+            except RuntimeError:
+                # イベントループが既に終了している場合
+                self.release(1)
+        return release
+
+    async def _execute(self, fn: Callable[..., Any], job: Future) -> Any:
+        try:
+            result, queue_wait, execution = await asyncio.wrap_future(job)
+        except Exception:
+            self._stats["failed"] += 1
+            raise
+
+        self._stats["completed"] += 1
+        self._stats["queue_wait_seconds_total"] += queue_wait
+        self._stats["queue_wait_seconds_max"] = max(self._stats["queue_wait_seconds_max"], queue_wait)
+        self._stats["execution_seconds_total"] += execution
+        self._stats["execution_seconds_max"] = max(self._stats["execution_seconds_max"], execution)
+        # キュー待ち時間は投入したリクエストの段階の時間として記録する
+        record_stage("queue", queue_wait)
+        logger.info(
+            f"ジョブが完了しました: {getattr(fn, '__name__', fn)}, "
+            f"キュー待ち={queue_wait * 1000:.1f}ms, 実行={execution * 1000:.1f}ms"
+        )
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        ワーカープールの状態と計測値を返す
+
+        Returns:
+            ワーカー数、キューの状態、ジョブ数、キュー待ち時間と実行時間の統計を含む辞書
+        """
+        completed = self._stats["completed"]
+        return {
+            "mode": "process" if self.use_processes else "thread",
+            "max_workers": self.max_workers,
+            "max_queue": self.max_queue,
+            "in_flight": self._in_flight,
+            "running": min(self._in_flight, self.max_workers),
+            "queue_depth": self.queue_depth,
+            **self._stats,
+            "queue_wait_seconds_avg": self._stats["queue_wait_seconds_total"] / completed if completed else 0.0,
+            "execution_seconds_avg": self._stats["execution_seconds_total"] / completed if completed else 0.0
+        }
+
+    def shutdown(self) -> None:
+        """ワーカープールを停止する"""
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+            logger.info("パイプラインのワーカープールを停止しました")
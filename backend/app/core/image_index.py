@@ -0,0 +1,180 @@
+import os
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Any, Optional, Tuple
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 生成した画像は名前（UUID）ごとに内容が変わらないため、ブラウザ・CDNに長期間キャッシュさせる
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+@dataclass
+class ImageEntry:
+    """インデックスに登録された画像の保存場所と、配信に使うファイル情報"""
+    path: str
+    stat: os.stat_result
+    etag: str
+
+    @property
+    def size(self) -> int:
+        return self.stat.st_size
+
+class ImageIndex:
+    """
+    画像の名前（/api/images/{name} の name）から保存場所を引くメモリ上のインデックス
+
+    画像を生成した時点で登録し、配信時にはファイルの存在確認（os.path.exists / os.stat）を行わない。
+    ETagは登録時に1回だけ読み込んだ内容のハッシュから作る強いETagで、
+    エントリ数の上限を超えた場合は最も長く参照されていないものから削除する。
+    """
+
+    def __init__(self, max_entries: int = 10000):
+        """
+        Args:
+            max_entries: 保持するエントリ数の上限
+        """
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, ImageEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._counts = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def register(self, image_id: str, path: str) -> Optional[ImageEntry]:
+        """
+        画像を登録する
+
+        Args:
+            image_id: 画像の名前
+            path: 画像の保存場所
+
+        Returns:
+            登録したエントリ、ファイルが存在しない場合はNone
+        """
+        try:
+            with open(path, "rb") as f:
+                stat = os.fstat(f.fileno())
+                digest = hashlib.blake2b(f.read(), digest_size=16).hexdigest()
+        except OSError as e:
+            logger.warning(f"画像をインデックスに登録できませんでした: {path} ({e})")
+            return None
+
+        entry = ImageEntry(path=path, stat=stat, etag=f'"{digest}"')
+        with self._lock:
+            self._entries[image_id] = entry
+            self._entries.move_to_end(image_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._counts["evictions"] += 1
+        return entry
+
+    def get(self, image_id: str) -> Optional[ImageEntry]:
+        """
+        画像の保存場所を取得する
+
+        Args:
+            image_id: 画像の名前
+
+        Returns:
+            登録されているエントリ、見つからない場合はNone
+        """
+        with self._lock:
+            entry = self._entries.get(image_id)
+            if entry is None:
+                self._counts["misses"] += 1
+                return None
+            self._entries.move_to_end(image_id)
+            self._counts["hits"] += 1
+            return entry
+
+    def discard(self, image_id: str) -> Optional[ImageEntry]:
+        """
+        画像の登録を削除する（ファイルは削除しない）
+
+        Args:
+            image_id: 画像の名前
+
+        Returns:
+            削除したエントリ、登録されていない場合はNone
+        """
+        with self._lock:
+            return self._entries.pop(image_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        インデックスのエントリ数とヒット数を返す
+
+        Returns:
+            エントリ数、ヒット・ミス数、ヒット率を含む辞書
+        """
+        with self._lock:
+            lookups = self._counts["hits"] + self._counts["misses"]
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                **self._counts,
+                "hit_rate": self._counts["hits"] / lookups if lookups else 0.0
+            }
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    If-None-Matchヘッダーが指定したETagに一致するかを判定する（弱い比較）
+
+    Args:
+        if_none_match: If-None-Matchヘッダー
+        etag: 比較するETag
+
+    Returns:
+        一致する場合はTrue
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == opaque:
+            return True
+    return False
+
+def parse_range(range_header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    Rangeヘッダーを解析して、返すバイト範囲を求める
+    複数の範囲を指定された場合や解釈できない場合は、範囲を無視して全体を返す（None）
+
+    Args:
+        range_header: Rangeヘッダー（例: "bytes=0-1023", "bytes=-500"）
+        size: コンテンツの大きさ（バイト）
+
+    Returns:
+        範囲の先頭と末尾（末尾を含む）のタプル、全体を返す場合はNone
+
+    Raises:
+        ValueError: 範囲がコンテンツの外にある場合（416を返す）
+    """
+    if not range_header:
+        return None
+    unit, _, ranges = range_header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in ranges:
+        return None
+    first, _, last = ranges.strip().partition("-")
+    if not (first.isdigit() or first == "") or not (last.isdigit() or last == "") or first == last == "":
+        return None
+    if first == "":
+        # 末尾から指定したバイト数（bytes=-500）
+        suffix = int(last)
+        if suffix == 0:
+            raise ValueError(f"範囲が空です: {range_header}")
+        return max(0, size - suffix), size - 1
+    start = int(first)
+    end = int(last) if last else size - 1
+    if start >= size:
+        raise ValueError(f"範囲がコンテンツの外にあります: {range_header}")
+    if end < start:
+        return None
+    return start, min(end, size - 1)
@@ -2,20 +2,202 @@ import cv2
 import numpy as np
 from PIL import Image
 import os
-import logging
-from typing import Tuple, Optional
 import io
+import time
+import uuid
+import shutil
+import struct
+import logging
+import tempfile
+import threading
+import subprocess
+from dataclasses import dataclass
+from typing import Tuple, Optional, Dict, Any
+from dotenv import load_dotenv
+
+load_dotenv()
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def validate_image(file_content: bytes) -> bool:
+# デコードを許可する最大画素数（これを超える画像はデコードする前に拒否する）
+MAX_IMAGE_PIXELS = int(os.getenv("MAX_IMAGE_PIXELS", str(100_000_000)))
+
+# ISO BMFF（AVIF/HEIC）のブランドとフォーマットの対応
+AVIF_BRANDS = {b"avif", b"avis"}
+HEIF_BRANDS = {b"heic", b"heix", b"hevc", b"hevx", b"heim", b"heis", b"mif1", b"msf1"}
+
+# 幅と高さを持つJPEGのSOFマーカー（DHT・JPG・DACを除く）
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+@dataclass
+class ImageHeader:
+    """画像のヘッダーから読み取ったフォーマットと大きさ"""
+    format: str
+    width: int
+    height: int
+
+    @property
+    def pixels(self) -> int:
+        return self.width * self.height
+
+def sniff_image_format(file_content: bytes) -> Optional[str]:
+    """
+    先頭のマジックバイトから画像のコンテナ形式を判定する
+    
+    Args:
+        file_content: 画像ファイルのバイト内容
+        
+    Returns:
+        "jpeg", "png", "webp", "avif", "heic", "gif", "bmp", "tiff" のいずれか、
+        判定できない場合はNone
+    """
+    if file_content[:3] == b"\xff\xd8\xff":
+        return "jpeg"
+    if file_content[:8] == b"\x89PNG\r\n\x1a\n":
+        return "png"
+    if file_content[:4] == b"RIFF" and file_content[8:12] == b"WEBP":
+        return "webp"
+    if file_content[4:8] == b"ftyp":
+        box_size = struct.unpack(">I", file_content[:4])[0]
+        brands = {file_content[8:12]}
+        brands.update(file_content[i:i + 4] for i in range(16, min(box_size, len(file_content)) - 3, 4))
+        if brands & AVIF_BRANDS:
+            return "avif"
+        if brands & HEIF_BRANDS:
+            return "heic"
+        return None
+    if file_content[:6] in (b"GIF87a", b"GIF89a"):
+        return "gif"
+    if file_content[:2] == b"BM":
+        return "bmp"
+    if file_content[:4] in (b"II*\x00", b"MM\x00*"):
+        return "tiff"
+    return None
+
+def _jpeg_size(data: bytes) -> Optional[Tuple[int, int]]:
+    """JPEGのマーカーを順にたどり、最初のSOFから幅と高さを読む（スキャンデータは読まない）"""
+    i = 2
+    while i + 4 <= len(data):
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if marker == 0xFF:  # 埋め草のバイト
+            i += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD8:  # 長さを持たないマーカー
+            i += 2
+            continue
+        if marker in (0xD9, 0xDA):  # SOFより先に画像の終わりやスキャンが来た
+            return None
+        if marker in JPEG_SOF_MARKERS:
+            if i + 9 > len(data):
+                return None
+            height, width = struct.unpack(">HH", data[i + 5:i + 9])
+            return width, height
+        i += 2 + struct.unpack(">H", data[i + 2:i + 4])[0]
+    return None
+
+def _webp_size(data: bytes) -> Optional[Tuple[int, int]]:
+    """WebPの最初のチャンク（VP8 / VP8L / VP8X）から幅と高さを読む"""
+    chunk = data[12:16]
+    if chunk == b"VP8 " and len(data) >= 30 and data[23:26] == b"\x9d\x01\x2a":
+        width, height = struct.unpack("<HH", data[26:30])
+        return width & 0x3FFF, height & 0x3FFF
+    if chunk == b"VP8L" and len(data) >= 25 and data[20] == 0x2F:
+        bits = struct.unpack("<I", data[21:25])[0]
+        return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    if chunk == b"VP8X" and len(data) >= 30:
+        width = int.from_bytes(data[24:27], "little") + 1
+        height = int.from_bytes(data[27:30], "little") + 1
+        return width, height
+    return None
+
+def _isobmff_size(data: bytes) -> Optional[Tuple[int, int]]:
+    """
+    AVIF/HEICのトップレベルのボックスをたどってmetaボックスを探し、
+    その中の画像の大きさ（ispe）のうち最大のものを返す（mdatの中身は読まない）
+    """
+    offset = 0
+    while offset + 8 <= len(data):
+        size, box_type = struct.unpack(">I4s", data[offset:offset + 8])
+        header = 8
+        if size == 1:
+            if offset + 16 > len(data):
+                return None
+            size = struct.unpack(">Q", data[offset + 8:offset + 16])[0]
+            header = 16
+        elif size == 0:
+            size = len(data) - offset
+        if size < header:
+            return None
+        if box_type == b"meta":
+            meta = data[offset + header:offset + size]
+            sizes = []
+            position = meta.find(b"ispe")
+            while position >= 0 and position + 16 <= len(meta):
+                sizes.append(struct.unpack(">II", meta[position + 8:position + 16]))
+                position = meta.find(b"ispe", position + 4)
+            return max(sizes, key=lambda wh: wh[0] * wh[1]) if sizes else None
+        offset += size
+    return None
+
+def _parse_image_size(image_format: str, data: bytes) -> Optional[Tuple[int, int]]:
+    if image_format == "jpeg":
+        return _jpeg_size(data)
+    if image_format == "png":
+        if data[12:16] != b"IHDR" or len(data) < 24:
+            return None
+        return struct.unpack(">II", data[16:24])
+    if image_format == "webp":
+        return _webp_size(data)
+    if image_format in ("avif", "heic"):
+        return _isobmff_size(data)
+    if image_format == "gif":
+        return struct.unpack("<HH", data[6:10]) if len(data) >= 10 else None
+    if image_format == "bmp":
+        if len(data) < 26:
+            return None
+        if struct.unpack("<I", data[14:18])[0] == 12:  # OS/2のBITMAPCOREHEADER
+            return struct.unpack("<HH", data[18:22])
+        width, height = struct.unpack("<ii", data[18:26])
+        return width, abs(height)
+    # TIFFはIFDの構造が複雑なため、ヘッダーだけを読むPILの遅延読み込みを使う
+    with Image.open(io.BytesIO(data)) as image:
+        return image.size
+
+def read_image_header(file_content: bytes) -> Optional[ImageHeader]:
+    """
+    画像のヘッダーだけを読み、フォーマットと幅・高さを返す
+    画素データのデコードや外部プロセスの起動は行わない
+    
+    Args:
+        file_content: 画像ファイルのバイト内容
+        
+    Returns:
+        画像のヘッダー情報、フォーマットを判定できないかヘッダーが壊れている場合はNone
+    """
+    image_format = sniff_image_format(file_content)
+    if image_format is None:
+        return None
+    try:
+        size = _parse_image_size(image_format, file_content)
+    except (struct.error, OSError, ValueError, Image.DecompressionBombError) as parse_error:
+        logger.warning(f"画像のヘッダーの読み込みに失敗しました: {parse_error}")
+        return None
+    if size is None:
+        return None
+    return ImageHeader(format=image_format, width=int(size[0]), height=int(size[1]))
+
+def validate_image(file_content: bytes, max_pixels: Optional[int] = None) -> bool:
     """
     アップロードされた画像が有効かどうかを検証する
-    複数の方法を試して、可能な限り画像を検証する
+    マジックバイトでフォーマットを判定し、ヘッダーから読んだ大きさを確認する。
+    画像全体のデコードは行わないため、画像でないデータは即座に拒否できる。
     
     Args:
         file_content: 画像ファイルのバイト内容
+        max_pixels: 許可する最大画素数（Noneの場合は MAX_IMAGE_PIXELS）
         
     Returns:
         有効な場合はTrue、そうでない場合はFalse
@@ -25,85 +207,314 @@ def validate_image(file_content: bytes) -> bool:
         logger.error("画像データが空です")
         return False
     
-    logger.info(f"検証する画像データのサイズ: {len(file_content)} バイト")
+    header = read_image_header(file_content)
+    if header is None:
+        logger.warning(f"対応していない画像形式か、ヘッダーが壊れています: {len(file_content)} バイト")
+        return False
     
-    if len(file_content) > 1000:  # 1KB以上あれば何かしらの画像データと見なす
-        logger.info("ファイルサイズに基づいて画像を検証しました")
-        return True
+    if header.width <= 0 or header.height <= 0:
+        logger.error(f"画像サイズが無効です: {header.width}x{header.height}")
+        return False
     
-    try:
-        image_bytes = io.BytesIO(file_content)
-        image = Image.open(image_bytes)
-        
-        try:
-            image.verify()
-        except Exception as verify_error:
-            logger.warning(f"画像検証エラー（無視して続行）: {verify_error}")
-            
-        image_bytes = io.BytesIO(file_content)
-        image = Image.open(image_bytes)
-        
-        width, height = image.size
-        if width == 0 or height == 0:
-            logger.error("画像サイズが無効です")
-        else:
-            logger.info(f"PILで画像を検証しました: {width}x{height}, フォーマット={image.format}")
-            return True
-    except Exception as pil_error:
-        logger.warning(f"PILでの画像検証に失敗しました: {pil_error}")
+    limit = MAX_IMAGE_PIXELS if max_pixels is None else max_pixels
+    if header.pixels > limit:
+        # 展開後のサイズが極端に大きい画像（解凍爆弾）はデコードする前に拒否する
+        logger.error(f"画像の画素数が上限を超えています: {header.width}x{header.height} > {limit}画素")
+        return False
     
-    try:
-        nparr = np.frombuffer(file_content, np.uint8)
-        img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        if img is not None and img.size > 0:
-            height, width = img.shape[:2]
-            logger.info(f"OpenCVで画像を検証しました: {width}x{height}")
-            return True
-        else:
-            logger.warning("OpenCVでの画像デコードに失敗しました（Noneまたは空の画像）")
-    except Exception as cv_error:
-        logger.warning(f"OpenCVでの画像検証に失敗しました: {cv_error}")
+    logger.info(f"画像のヘッダーを検証しました: {header.width}x{header.height}, フォーマット={header.format}")
+    return True
+
+# 画像全体の読み込みに使う外部コマンド（インプロセスのデコーダーがない形式だけに使う）
+IMAGEMAGICK_COMMAND = shutil.which("magick") or shutil.which("convert")
+
+# フォーマットごとのデコーダーの優先順位（利用できる最初のものを起動時に1つだけ選ぶ）
+DECODER_PRIORITY = {
+    "jpeg": ("opencv", "pillow"),
+    "png": ("opencv", "pillow"),
+    "webp": ("opencv", "pillow"),
+    "bmp": ("opencv", "pillow"),
+    "tiff": ("opencv", "pillow"),
+    "gif": ("pillow",),
+    "avif": ("pillow", "imagemagick"),
+    "heic": ("pillow", "imagemagick")
+}
+
+# PILのプラグインでのフォーマット名
+PILLOW_FORMATS = {
+    "jpeg": "JPEG", "png": "PNG", "webp": "WEBP", "bmp": "BMP",
+    "tiff": "TIFF", "gif": "GIF", "avif": "AVIF", "heic": "HEIF"
+}
+
+# JPEGのDCTスケーリングで縮小デコードする倍率と、対応するOpenCVの読み込みフラグ
+REDUCED_GRAYSCALE_FLAGS = {
+    8: cv2.IMREAD_REDUCED_GRAYSCALE_8,
+    4: cv2.IMREAD_REDUCED_GRAYSCALE_4,
+    2: cv2.IMREAD_REDUCED_GRAYSCALE_2,
+    1: cv2.IMREAD_GRAYSCALE
+}
+REDUCED_COLOR_FLAGS = {
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    1: cv2.IMREAD_COLOR
+}
+
+def reduced_decode_scale(width: int, height: int, target_size: Tuple[int, int]) -> int:
+    """
+    目標サイズに縮小する画像を、縮小後の大きさを下回らない範囲で何分の1でデコードできるかを返す
     
-    try:
-        import subprocess
-        import tempfile
-        import shutil
+    Args:
+        width: 元の画像の幅
+        height: 元の画像の高さ
+        target_size: 目標サイズ（幅, 高さ）
         
-        if not shutil.which('identify'):
-            logger.warning("ImageMagickがインストールされていません")
+    Returns:
+        1, 2, 4, 8 のいずれか
+    """
+    scale = min(target_size[0] / width, target_size[1] / height)
+    for factor in (8, 4, 2):
+        if factor * scale <= 1.0:
+            return factor
+    return 1
+
+def _decode_with_opencv(file_content: bytes, header: ImageHeader, grayscale: bool,
+                        target_size: Optional[Tuple[int, int]]) -> Optional[np.ndarray]:
+    """OpenCVでデコードする（JPEGは target_size を下回らない最も小さい倍率で縮小デコードする）"""
+    factor = 1
+    if target_size is not None and header.format == "jpeg" and header.pixels > 0:
+        factor = reduced_decode_scale(header.width, header.height, target_size)
+    flags = (REDUCED_GRAYSCALE_FLAGS if grayscale else REDUCED_COLOR_FLAGS)[factor]
+    image = cv2.imdecode(np.frombuffer(file_content, np.uint8), flags | cv2.IMREAD_IGNORE_ORIENTATION)
+    if image is None or image.size == 0:
+        return None
+    return image
+
+def _decode_with_pillow(file_content: bytes, header: ImageHeader, grayscale: bool,
+                        target_size: Optional[Tuple[int, int]]) -> Optional[np.ndarray]:
+    """PILでデコードする（JPEGはドラフトモードで縮小・グレースケールのままデコードする）"""
+    mode = "L" if grayscale else "RGB"
+    with Image.open(io.BytesIO(file_content)) as pil_image:
+        if target_size is not None:
+            pil_image.draft(mode, target_size)
+        converted = pil_image if pil_image.mode == mode else pil_image.convert(mode)
+        image = np.asarray(converted)
+    return image if grayscale else cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
+
+def _decode_with_imagemagick(file_content: bytes, header: ImageHeader, grayscale: bool,
+                             target_size: Optional[Tuple[int, int]]) -> Optional[np.ndarray]:
+    """ImageMagickでPNGに変換してから読み込む（インプロセスのデコーダーがない形式のみ）"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        input_path = os.path.join(temp_dir, f"input.{header.format}")
+        output_path = os.path.join(temp_dir, "output.png")
+        with open(input_path, "wb") as f:
+            f.write(file_content)
+        result = subprocess.run(
+            [IMAGEMAGICK_COMMAND, input_path, "-strip", output_path], capture_output=True, text=True
+        )
+        if result.returncode != 0:
+            logger.warning(f"ImageMagickでの変換に失敗しました: {result.stderr.strip()}")
+            return None
+        return cv2.imread(output_path, cv2.IMREAD_GRAYSCALE if grayscale else cv2.IMREAD_COLOR)
+
+DECODER_BACKENDS = {
+    "opencv": _decode_with_opencv,
+    "pillow": _decode_with_pillow,
+    "imagemagick": _decode_with_imagemagick
+}
+
+def load_pillow_plugins() -> None:
+    """AVIF・HEICのPILプラグインがインストールされていれば登録する"""
+    try:
+        import pillow_heif
+        pillow_heif.register_heif_opener()
+    except ImportError:
+        pass
+    try:
+        import pillow_avif  # noqa: F401 (インポート時にAVIFのプラグインが登録される)
+    except ImportError:
+        pass
+
+def _backend_available(backend: str, image_format: str) -> bool:
+    """デコーダーがそのフォーマットを扱えるかどうかを、起動時に1回だけ確認する"""
+    if backend == "opencv":
+        # 小さな画像をエンコードしてデコードできるかで、OpenCVのビルドが対応しているかを確認する
+        extension = {"jpeg": ".jpg", "tiff": ".tiff"}.get(image_format, f".{image_format}")
+        try:
+            encoded, data = cv2.imencode(extension, np.zeros((8, 8, 3), dtype=np.uint8))
+            return bool(encoded) and cv2.imdecode(data, cv2.IMREAD_COLOR) is not None
+        except cv2.error:
             return False
-        
-        with tempfile.NamedTemporaryFile(suffix='.jpg', delete=False) as temp_file:
-            temp_file.write(file_content)
-            temp_path = temp_file.name
-        
-        identify_cmd = ['identify', temp_path]
-        result = subprocess.run(identify_cmd, capture_output=True, text=True)
-        
+    if backend == "pillow":
+        Image.init()
+        return PILLOW_FORMATS[image_format] in Image.OPEN
+    if backend == "imagemagick":
+        return IMAGEMAGICK_COMMAND is not None
+    return False
+
+@dataclass
+class DecodeRecord:
+    """1回のデコードの記録"""
+    format: str
+    backend: str
+    seconds: float
+    success: bool
+
+class DecodeStats:
+    """フォーマットごとのデコード回数・失敗回数・所要時間の集計"""
+
+    def __init__(self):
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, record: DecodeRecord) -> None:
+        """
+        デコードの記録を集計に加える
+
+        Args:
+            record: デコードの記録
+        """
+        with self._lock:
+            entry = self._entries.setdefault(record.format, {
+                "backend": record.backend, "decodes": 0, "failures": 0,
+                "total_seconds": 0.0, "max_seconds": 0.0
+            })
+            entry["backend"] = record.backend
+            entry["decodes"] += 1
+            entry["failures"] += 0 if record.success else 1
+            entry["total_seconds"] += record.seconds
+            entry["max_seconds"] = max(entry["max_seconds"], record.seconds)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """
+        フォーマットごとの集計を返す
+
+        Returns:
+            フォーマットをキーとし、使用したデコーダー、回数、失敗回数、平均・最大の所要時間を含む辞書
+        """
+        with self._lock:
+            return {
+                image_format: {
+                    **entry,
+                    "average_seconds": entry["total_seconds"] / entry["decodes"]
+                }
+                for image_format, entry in self._entries.items()
+            }
+
+class DecoderRegistry:
+    """
+    画像のフォーマットごとに使用するデコーダーを1つだけ保持するレジストリ
+
+    マジックバイトで判定したフォーマットから、起動時に選んだデコーダーを直接呼び出す。
+    失敗したら別のデコーダーを順に試す方式ではないため、壊れた画像のデコードは1回で終わり、
+    外部プロセスもインプロセスのデコーダーがない形式でしか起動しない。
+    """
+
+    def __init__(self):
+        self._backends: Dict[str, str] = {}
+        self.stats = DecodeStats()
+
+    def register(self, image_format: str, backend: str) -> None:
+        """
+        フォーマットのデコーダーを登録する（既に登録されている場合は置き換える）
+
+        Args:
+            image_format: sniff_image_format が返すフォーマット名
+            backend: DECODER_BACKENDS のデコーダー名
+        """
+        if backend not in DECODER_BACKENDS:
+            raise ValueError(f"未対応のデコーダーです: {backend}")
+        self._backends[image_format] = backend
+
+    def backend_for(self, image_format: Optional[str]) -> Optional[str]:
+        """フォーマットに登録されたデコーダー名を返す（登録がない場合はNone）"""
+        return self._backends.get(image_format)
+
+    def backends(self) -> Dict[str, str]:
+        """フォーマットとデコーダー名の対応を返す"""
+        return dict(self._backends)
+
+    def decode(self, file_content: bytes, grayscale: bool = False,
+               target_size: Optional[Tuple[int, int]] = None) -> Tuple[Optional[np.ndarray], Optional[DecodeRecord]]:
+        """
+        画像のフォーマットに対応するデコーダーでデコードする
+
+        Args:
+            file_content: 画像ファイルのバイト内容
+            grayscale: グレースケールでデコードするかどうか
+            target_size: 最終的に縮小する目標サイズ（幅, 高さ）、対応するデコーダーは縮小してデコードする
+
+        Returns:
+            デコードされた画像（BGRまたはグレースケール、失敗した場合はNone）と、
+            デコードの記録（デコーダーを呼び出さなかった場合はNone）のタプル
+        """
+        if not file_content:
+            logger.error("画像データが空です")
+            return None, None
+
+        header = read_image_header(file_content)
+        image_format = header.format if header is not None else sniff_image_format(file_content)
+        backend = self.backend_for(image_format)
+        if backend is None:
+            logger.error(f"この画像形式に対応するデコーダーがありません: {image_format or '不明'}")
+            return None, None
+        if header is None:
+            # ヘッダーが読めない場合もデコーダーには渡す（大きさは不明として扱う）
+            header = ImageHeader(format=image_format, width=0, height=0)
+        elif header.pixels > MAX_IMAGE_PIXELS:
+            logger.error(f"画像の画素数が上限を超えているためデコードしません: {header.width}x{header.height}")
+            return None, None
+
+        start = time.perf_counter()
         try:
-            os.remove(temp_path)
-        except:
-            pass
-        
-        if result.returncode == 0:
-            logger.info(f"ImageMagickで画像を検証しました: {result.stdout.strip()}")
-            return True
+            image = DECODER_BACKENDS[backend](file_content, header, grayscale, target_size)
+        except Exception as decode_error:
+            logger.warning(f"{backend}での画像デコードに失敗しました: {decode_error}")
+            image = None
+        record = DecodeRecord(
+            format=image_format, backend=backend,
+            seconds=time.perf_counter() - start, success=image is not None
+        )
+        self.stats.record(record)
+
+        if image is None:
+            logger.error(f"画像のデコードに失敗しました: フォーマット={image_format}, デコーダー={backend}")
         else:
-            logger.warning(f"ImageMagickでの画像検証に失敗しました: {result.stderr}")
-    except Exception as im_error:
-        logger.warning(f"ImageMagickでの処理中にエラーが発生しました: {im_error}")
-    
-    logger.warning("すべての検証方法が失敗しましたが、フォールバックとして有効と見なします")
-    return True
+            logger.info(
+                f"{backend}で画像をデコードしました: フォーマット={image_format}, "
+                f"サイズ={image.shape[1]}x{image.shape[0]}, {record.seconds * 1000:.1f}ミリ秒"
+            )
+        return image, record
 
-def save_uploaded_image(file_content: bytes, output_dir: str = "/tmp") -> str:
+def build_decoder_registry() -> DecoderRegistry:
+    """
+    DECODER_PRIORITY の順に、利用できる最初のデコーダーを各フォーマットに登録したレジストリを作成する
+
+    Returns:
+        デコーダーのレジストリ
+    """
+    load_pillow_plugins()
+    registry = DecoderRegistry()
+    for image_format, candidates in DECODER_PRIORITY.items():
+        for backend in candidates:
+            if _backend_available(backend, image_format):
+                registry.register(image_format, backend)
+                break
+    logger.info(f"画像デコーダーを登録しました: {registry.backends()}")
+    return registry
+
+decoder_registry = build_decoder_registry()
+
+def save_uploaded_image(file_content: bytes, output_dir: str = "/tmp",
+                        decode_stats: Optional[DecodeStats] = None) -> str:
     """
     アップロードされた画像を一時ファイルとして保存する
-    複数の方法を試して、可能な限り画像を保存する
+    JPEGはそのまま書き込み、それ以外の形式はデコードしてJPEGで保存する
     
     Args:
         file_content: 画像ファイルのバイト内容
         output_dir: 出力ディレクトリ
+        decode_stats: デコードの記録を加える集計（Noneの場合は記録しない）
         
     Returns:
         保存された画像のパス
@@ -112,168 +523,142 @@ def save_uploaded_image(file_content: bytes, output_dir: str = "/tmp") -> str:
     os.makedirs(output_dir, exist_ok=True)
     
     # ファイル名の生成
-    import uuid
     filename = f"{uuid.uuid4()}.jpg"
     output_path = os.path.join(output_dir, filename)
     
-    try:
-        image_bytes = io.BytesIO(file_content)
-        image = Image.open(image_bytes)
-        # RGBモードに変換（透過画像の場合に対応）
-        if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
-            image = image.convert('RGB')
-        image.save(output_path, 'JPEG', quality=95)
-        
-        logger.info(f"PILで画像を保存しました: {output_path}")
+    if sniff_image_format(file_content) == "jpeg":
+        # 再エンコードは不要
+        with open(output_path, "wb") as f:
+            f.write(file_content)
+        logger.info(f"JPEG画像をそのまま保存しました: {output_path}")
         return output_path
-    except Exception as pil_error:
-        logger.warning(f"PILでの画像保存に失敗しました: {pil_error}")
     
-    try:
-        nparr = np.frombuffer(file_content, np.uint8)
-        img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        if img is not None and img.size > 0:
-            cv2.imwrite(output_path, img)
-            logger.info(f"OpenCVで画像を保存しました: {output_path}")
-            return output_path
-    except Exception as cv_error:
-        logger.warning(f"OpenCVでの画像保存に失敗しました: {cv_error}")
-    
-    try:
-        import subprocess
-        import tempfile
-        
-        with tempfile.NamedTemporaryFile(suffix='.bin', delete=False) as temp_file:
-            temp_file.write(file_content)
-            temp_input_path = temp_file.name
-        
-        convert_cmd = ['convert', temp_input_path, output_path]
-        result = subprocess.run(convert_cmd, capture_output=True, text=True)
-        
-        try:
-            os.remove(temp_input_path)
-        except:
-            pass
-        
-        if result.returncode == 0 and os.path.exists(output_path) and os.path.getsize(output_path) > 0:
-            logger.info(f"ImageMagickで画像を保存しました: {output_path}")
-            return output_path
-        else:
-            logger.warning(f"ImageMagickでの画像保存に失敗しました: {result.stderr}")
-    except Exception as im_error:
-        logger.warning(f"ImageMagickでの処理中にエラーが発生しました: {im_error}")
+    image, record = decoder_registry.decode(file_content)
+    if decode_stats is not None and record is not None:
+        decode_stats.record(record)
+    if image is None or not cv2.imwrite(output_path, image, [cv2.IMWRITE_JPEG_QUALITY, 95]):
+        logger.error("画像の保存に失敗しました")
+        raise ValueError("画像の保存に失敗しました。別の画像を試してください。")
     
-    try:
-        with open(output_path, 'wb') as f:
-            f.write(file_content)
-        
-        if os.path.exists(output_path) and os.path.getsize(output_path) > 0:
-            logger.info(f"単純なファイル書き込みで画像を保存しました: {output_path}")
-            return output_path
-    except Exception as write_error:
-        logger.warning(f"ファイル書き込みでの保存に失敗しました: {write_error}")
-        
-    logger.error("すべての方法で画像の保存に失敗しました")
-    raise ValueError("画像の保存に失敗しました。別の画像を試してください。")
+    logger.info(f"画像をJPEGに変換して保存しました: {output_path}")
+    return output_path
 
-def optimize_image(image_path: str, target_size: Tuple[int, int] = (800, 600)) -> str:
+def optimize_image(image_path: str, target_size: Tuple[int, int] = (800, 600),
+                   decode_stats: Optional[DecodeStats] = None) -> str:
     """
     画像を最適化する（リサイズ、コントラスト調整など）
-    複数の方法を試して、可能な限り画像を最適化する
+    目標サイズに近い解像度のグレースケールで直接デコードしてから処理する
     
     Args:
         image_path: 処理する画像のパス
         target_size: 目標サイズ（幅, 高さ）
+        decode_stats: デコードの記録を加える集計（Noneの場合は記録しない）
         
     Returns:
-        最適化された画像のパス
+        最適化された画像のパス（失敗した場合は元の画像のパス）
     """
     # 出力パスの生成
     output_path = image_path.rsplit(".", 1)[0] + "_optimized.jpg"
     
     try:
-        # 画像の読み込み
-        image = Image.open(image_path)
+        with open(image_path, "rb") as f:
+            gray, record = decoder_registry.decode(f.read(), grayscale=True, target_size=target_size)
+        if decode_stats is not None and record is not None:
+            decode_stats.record(record)
         
-        # RGBモードに変換
-        if image.mode != 'RGB':
-            image = image.convert('RGB')
-        
-        # アスペクト比を保持してリサイズ
-        image.thumbnail(target_size, Image.Resampling.LANCZOS)
-        
-        # NumPy配列に変換
-        image_array = np.array(image)
-        
-        # OpenCV形式に変換
-        image_cv = cv2.cvtColor(image_array, cv2.COLOR_RGB2BGR)
-        
-        # グレースケール変換
-        gray = cv2.cvtColor(image_cv, cv2.COLOR_BGR2GRAY)
-        
-        # コントラスト調整
-        clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8,8))
-        enhanced = clahe.apply(gray)
-        
-        # BGRに戻す
-        enhanced_bgr = cv2.cvtColor(enhanced, cv2.COLOR_GRAY2BGR)
-        
-        # 画像の保存
-        cv2.imwrite(output_path, enhanced_bgr)
-        
-        logger.info(f"PILとOpenCVで画像を最適化しました: {output_path}")
-        return output_path
-    except Exception as pil_error:
-        logger.warning(f"PILとOpenCVでの画像最適化に失敗しました: {pil_error}")
-    
-    try:
-        # 画像の読み込み
-        image = cv2.imread(image_path)
-        if image is not None and image.size > 0:
-            height, width = image.shape[:2]
-            if width > target_size[0] or height > target_size[1]:
-                scale = min(target_size[0] / width, target_size[1] / height)
-                new_width = int(width * scale)
-                new_height = int(height * scale)
-                image = cv2.resize(image, (new_width, new_height), interpolation=cv2.INTER_LANCZOS4)
-            
-            # グレースケール変換
-            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-            
-            # コントラスト調整
-            clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8,8))
-            enhanced = clahe.apply(gray)
+        if gray is not None:
+            # リサイズ、コントラスト調整
+            enhanced = optimize_image_array(gray, target_size)
             
-            # BGRに戻す
-            enhanced_bgr = cv2.cvtColor(enhanced, cv2.COLOR_GRAY2BGR)
+            # 画像の保存（グレースケールのまま保存する）
+            cv2.imwrite(output_path, enhanced)
             
-            # 画像の保存
-            cv2.imwrite(output_path, enhanced_bgr)
-            
-            logger.info(f"OpenCVのみで画像を最適化しました: {output_path}")
+            logger.info(f"縮小デコードした画像を最適化しました: {output_path}")
             return output_path
-    except Exception as cv_error:
-        logger.warning(f"OpenCVでの画像最適化に失敗しました: {cv_error}")
+    except Exception as decode_error:
+        logger.warning(f"画像の最適化に失敗しました: {decode_error}")
     
-    try:
-        import subprocess
+    logger.error(f"画像の最適化に失敗しました。元の画像を使用します: {image_path}")
+    return image_path
+
+def decode_image(file_content: bytes) -> Optional[np.ndarray]:
+    """
+    画像のバイト内容をメモリ上でデコードする
+    一時ファイルを経由せずにOpenCV形式の配列を返す
+    
+    Args:
+        file_content: 画像ファイルのバイト内容
         
-        convert_cmd = [
-            'convert', image_path,
-            '-resize', f'{target_size[0]}x{target_size[1]}>', # アスペクト比を保持してリサイズ
-            '-contrast-stretch', '2%',  # コントラスト調整
-            '-sharpen', '0x1.0',       # シャープネス調整
-            output_path
-        ]
-        result = subprocess.run(convert_cmd, capture_output=True, text=True)
+    Returns:
+        デコードされた画像（OpenCV形式のBGR配列）、失敗した場合はNone
+    """
+    return decoder_registry.decode(file_content)[0]
+
+def decode_image_gray(file_content: bytes, target_size: Optional[Tuple[int, int]] = None) -> Optional[np.ndarray]:
+    """
+    画像のバイト内容をグレースケールで直接デコードする
+    カラー画像の配列と色変換の中間バッファを作らず、JPEGの場合は target_size を下回らない
+    最も小さい倍率（1/2, 1/4, 1/8）でDCTスケーリングしてデコードする。
+    EXIFの回転情報は decode_image と同じく適用しない。
+    
+    Args:
+        file_content: 画像ファイルのバイト内容
+        target_size: 最終的に縮小する目標サイズ（幅, 高さ）、Noneの場合は元の解像度でデコードする
         
-        if result.returncode == 0 and os.path.exists(output_path) and os.path.getsize(output_path) > 0:
-            logger.info(f"ImageMagickで画像を最適化しました: {output_path}")
-            return output_path
-        else:
-            logger.warning(f"ImageMagickでの画像最適化に失敗しました: {result.stderr}")
-    except Exception as im_error:
-        logger.warning(f"ImageMagickでの処理中にエラーが発生しました: {im_error}")
+    Returns:
+        デコードされたグレースケール画像、失敗した場合はNone
+    """
+    return decoder_registry.decode(file_content, grayscale=True, target_size=target_size)[0]
+
+# EXIFの Orientation タグ
+EXIF_ORIENTATION_TAG = 0x0112
+
+def read_exif_orientation(file_content: bytes) -> int:
+    """
+    画像のEXIFから回転情報（Orientation、1〜8）を読み取る
+    画素はデコードせず、ヘッダーだけを読む。デコードでは回転情報を適用しないため、
+    ブラウザが回転して表示する元画像に座標を重ねる場合に使う
+
+    Args:
+        file_content: 画像ファイルのバイト内容
+
+    Returns:
+        Orientation の値（EXIFがない場合や読み取れない場合は1）
+    """
+    try:
+        with Image.open(io.BytesIO(file_content)) as image:
+            orientation = image.getexif().get(EXIF_ORIENTATION_TAG, 1)
+    except Exception as e:
+        logger.debug(f"EXIFの回転情報を読み取れませんでした: {e}")
+        return 1
+    return orientation if orientation in range(1, 9) else 1
+
+def optimize_image_array(image: np.ndarray, target_size: Tuple[int, int] = (800, 600)) -> np.ndarray:
+    """
+    メモリ上の画像を最適化する（リサイズ、コントラスト調整など）
+    optimize_imageと同じ処理をファイルの読み書きなしで行う
     
-    logger.error(f"すべての方法で画像の最適化に失敗しました。元の画像を使用します: {image_path}")
-    return image_path
+    Args:
+        image: 処理する画像（BGR形式またはグレースケール）
+        target_size: 目標サイズ（幅, 高さ）
+        
+    Returns:
+        コントラスト調整済みのグレースケール画像
+    """
+    # アスペクト比を保持して縮小
+    height, width = image.shape[:2]
+    if width > target_size[0] or height > target_size[1]:
+        scale = min(target_size[0] / width, target_size[1] / height)
+        new_width = max(1, int(width * scale))
+        new_height = max(1, int(height * scale))
+        image = cv2.resize(image, (new_width, new_height), interpolation=cv2.INTER_LANCZOS4)
+    
+    # グレースケール変換
+    if image.ndim == 2:
+        gray = image
+    else:
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    
+    # コントラスト調整
+    clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8,8))
+    return clahe.apply(gray)
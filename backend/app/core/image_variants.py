@@ -0,0 +1,163 @@
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Sequence, Tuple
+
+import cv2
+from PIL import Image
+
+from app.core.image_processing import decode_image
+from app.core.constellation import encode_constellation_image
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 複数のフォーマットを同じ優先度で受け付けるクライアントには、小さくなる順に選ぶ
+FORMAT_PREFERENCE = ("avif", "webp", "jpeg")
+
+# フォーマットとMIMEタイプの対応
+FORMAT_MEDIA_TYPES = {
+    "jpeg": "image/jpeg",
+    "webp": "image/webp",
+    "avif": "image/avif"
+}
+
+def _parse_accept(accept: str) -> Dict[str, float]:
+    """Acceptヘッダーをメディアタイプと品質値（q）の辞書に変換する"""
+    qualities: Dict[str, float] = {}
+    for part in accept.split(","):
+        media_type, _, params = part.strip().partition(";")
+        quality = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        media_type = media_type.strip().lower()
+        if media_type:
+            qualities[media_type] = max(quality, qualities.get(media_type, 0.0))
+    return qualities
+
+def negotiate_image_format(accept: Optional[str], available: Sequence[str], default: str) -> str:
+    """
+    Acceptヘッダーから配信する画像のフォーマットを選ぶ
+
+    image/* や */* のワイルドカードだけでは新しい形式に対応しているとはみなさず、
+    明示的に列挙されたフォーマットのうち品質値が最も高いもの（同じ場合は小さくなるもの）を選ぶ。
+
+    Args:
+        accept: リクエストのAcceptヘッダー
+        available: エンコードできるフォーマット
+        default: 明示的に受け付けるフォーマットがない場合に返すフォーマット（保存されている形式）
+
+    Returns:
+        配信するフォーマット
+    """
+    if not accept:
+        return default
+    qualities = _parse_accept(accept)
+    best, best_quality = default, qualities.get(FORMAT_MEDIA_TYPES.get(default, ""), 0.0)
+    for image_format in FORMAT_PREFERENCE:
+        if image_format not in available:
+            continue
+        quality = qualities.get(FORMAT_MEDIA_TYPES[image_format], 0.0)
+        if quality > best_quality:
+            best, best_quality = image_format, quality
+    return best
+
+def encode_image_variant(path: str, image_format: str, quality: str) -> Optional[bytes]:
+    """
+    保存されている画像を別のフォーマット・画質にエンコードし直す
+
+    Args:
+        path: 変換元の画像のパス
+        image_format: 出力フォーマット（"jpeg", "webp", "avif"）
+        quality: 画質の段階（"low", "standard", "high"）
+
+    Returns:
+        エンコードされた画像のバイト内容、変換元を読み込めない場合はNone
+    """
+    with open(path, "rb") as f:
+        image = decode_image(f.read())
+    if image is None:
+        return None
+    rendered = Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+    return encode_constellation_image(rendered, image_format, quality)
+
+class ImageVariantCache:
+    """
+    フォーマット・画質ごとにエンコードし直した画像を保持するLRUキャッシュ（合計バイト数で上限を設定）
+
+    キーには変換元のファイルの更新時刻を含めるため、同じ名前のファイルが書き換えられても
+    古い変換結果は返さない。
+    """
+
+    def __init__(self, max_bytes: int = 32 * 1024 * 1024):
+        """
+        Args:
+            max_bytes: 保持する合計バイト数の上限（0の場合はキャッシュしない）
+        """
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[Tuple[str, int, str, str], bytes]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._counts = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def get(self, key: Tuple[str, int, str, str]) -> Optional[bytes]:
+        """
+        キャッシュから変換済みの画像を取得する
+
+        Args:
+            key: （変換元のパス, 更新時刻, フォーマット, 画質）のタプル
+
+        Returns:
+            変換済みの画像のバイト内容、見つからない場合はNone
+        """
+        with self._lock:
+            data = self._entries.get(key)
+            if data is None:
+                self._counts["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._counts["hits"] += 1
+            return data
+
+    def put(self, key: Tuple[str, int, str, str], data: bytes) -> None:
+        """
+        変換済みの画像をキャッシュに保存する
+
+        Args:
+            key: （変換元のパス, 更新時刻, フォーマット, 画質）のタプル
+            data: 変換済みの画像のバイト内容
+        """
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= len(previous)
+            self._entries[key] = data
+            self._bytes += len(data)
+            while self._bytes > self.max_bytes and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+                self._counts["evictions"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        キャッシュの使用状況とヒット数を返す
+
+        Returns:
+            エントリ数、使用バイト数、ヒット・ミス数、ヒット率を含む辞書
+        """
+        with self._lock:
+            lookups = self._counts["hits"] + self._counts["misses"]
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                **self._counts,
+                "hit_rate": self._counts["hits"] / lookups if lookups else 0.0
+            }
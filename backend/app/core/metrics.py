@@ -0,0 +1,293 @@
+import re
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 処理時間のヒストグラムのバケット（秒）。画像処理は数ms〜数秒、LLMの呼び出しは数秒〜数十秒
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Prometheusのテキスト形式（/metrics のContent-Type）
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Server-Timingのメトリクス名に使える文字（token）以外は _ に置き換える
+_SERVER_TIMING_NAME = re.compile(r"[^A-Za-z0-9!#$%&'*+.^_`|~-]")
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def _format_labels(label_names: Sequence[str], label_values: Sequence[Any]) -> str:
+    if not label_names:
+        return ""
+    pairs = []
+    for name, value in zip(label_names, label_values):
+        escaped = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        pairs.append(f'{name}="{escaped}"')
+    return "{" + ",".join(pairs) + "}"
+
+class Histogram:
+    """観測値の分布（処理時間など）。バケットごとの累積数と合計・件数を持つ"""
+
+    def __init__(self, name: str, help_text: str, label_names: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        # ラベルの組ごとに [バケットごとの数, 合計, 件数]
+        self._series: Dict[Tuple[str, ...], List[Any]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, labels: Sequence[Any] = ()) -> None:
+        key = tuple(str(label) for label in labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][index] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def snapshot(self, labels: Sequence[Any] = ()) -> Optional[Dict[str, Any]]:
+        """ラベルの組の累積バケット数・合計・件数（観測がない場合はNone）"""
+        with self._lock:
+            series = self._series.get(tuple(str(label) for label in labels))
+            if series is None:
+                return None
+            cumulative, total = [], 0
+            for count in series[0]:
+                total += count
+                cumulative.append(total)
+            return {"buckets": dict(zip(self.buckets, cumulative)), "sum": series[1], "count": series[2]}
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series_items = sorted((key, [list(series[0]), series[1], series[2]]) for key, series in self._series.items())
+        for key, (counts, total_sum, count) in series_items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.label_names + ("le",), key + (_format_value(bound),))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.label_names, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total_sum)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+class CallbackMetric:
+    """
+    取得時に関数を呼び出して値を求めるメトリクス（キューの深さ、キャッシュのヒット数など）
+    既存の stats() の値をそのまま公開するために使う
+    """
+
+    def __init__(self, name: str, help_text: str, callback: Callable[[], Any],
+                 metric_type: str = "gauge", label_names: Sequence[str] = ()):
+        """
+        Args:
+            name: メトリクス名
+            help_text: 説明
+            callback: 値を返す関数（ラベルがある場合はラベルの値のタプルから値への辞書を返す）
+            metric_type: "gauge" または "counter"
+            label_names: ラベル名
+        """
+        self.name = name
+        self.help_text = help_text
+        self.callback = callback
+        self.metric_type = metric_type
+        self.label_names = tuple(label_names)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.metric_type}"]
+        try:
+            values = self.callback()
+        except Exception as e:
+            logger.warning(f"メトリクスの取得に失敗しました: {self.name} ({e})")
+            return lines
+        if not self.label_names:
+            values = {(): values}
+        for key, value in values.items():
+            key = key if isinstance(key, tuple) else (key,)
+            lines.append(f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}")
+        return lines
+
+class MetricsRegistry:
+    """メトリクスを登録し、Prometheusのテキスト形式で出力する"""
+
+    def __init__(self):
+        self._metrics: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric: Any) -> Any:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"同じ名前のメトリクスが登録されています: {metric.name}")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def histogram(self, name: str, help_text: str, label_names: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help_text, label_names, buckets))
+
+    def callback(self, name: str, help_text: str, callback: Callable[[], Any],
+                 metric_type: str = "gauge", label_names: Sequence[str] = ()) -> CallbackMetric:
+        return self._register(CallbackMetric(name, help_text, callback, metric_type, label_names))
+
+    def get(self, name: str) -> Any:
+        with self._lock:
+            return self._metrics.get(name)
+
+    def render(self) -> str:
+        """登録されている全てのメトリクスをPrometheusのテキスト形式で返す"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+class RequestTimings:
+    """
+    1つのリクエストで行った処理の段階ごとの時間
+    同じ段階を複数回行った場合（バッチなど）は、Server-Timingでは合計を、ヒストグラムには1回ずつの時間を使う
+    """
+
+    def __init__(self):
+        self.records: List[Tuple[str, float]] = []
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self.records.append((stage, seconds))
+
+    def totals(self) -> Dict[str, float]:
+        """段階ごとの合計時間（秒、最初に記録した順）"""
+        totals: Dict[str, float] = {}
+        with self._lock:
+            for stage, seconds in self.records:
+                totals[stage] = totals.get(stage, 0.0) + seconds
+        return totals
+
+    def server_timing(self, total_seconds: Optional[float] = None) -> str:
+        """
+        Server-Timingヘッダーの値を組み立てる
+
+        Args:
+            total_seconds: リクエスト全体の時間（指定した場合は total として加える）
+
+        Returns:
+            "detect;dur=12.3, draw;dur=4.5" 形式の文字列（時間はミリ秒）
+        """
+        entries = [
+            f"{_SERVER_TIMING_NAME.sub('_', stage)};dur={seconds * 1000:.1f}"
+            for stage, seconds in self.totals().items()
+        ]
+        if total_seconds is not None:
+            entries.append(f"total;dur={total_seconds * 1000:.1f}")
+        return ", ".join(entries)
+
+# 処理中のリクエストの段階ごとの時間（MetricsMiddlewareが設定し、タスクとスレッドプールに引き継がれる）
+_current_timings: ContextVar[Optional[RequestTimings]] = ContextVar("request_timings", default=None)
+
+def current_request_timings() -> Optional[RequestTimings]:
+    """処理中のリクエストの RequestTimings（リクエストの外ではNone）"""
+    return _current_timings.get()
+
+def record_stage(stage: str, seconds: float) -> None:
+    """処理中のリクエストに段階の時間を記録する（リクエストの外では何もしない）"""
+    timings = _current_timings.get()
+    if timings is not None:
+        timings.add(stage, seconds)
+
+def record_stages(stage_timings: Optional[Dict[str, float]]) -> None:
+    """ワーカープロセスから返された段階ごとの時間をまとめて記録する"""
+    for stage, seconds in (stage_timings or {}).items():
+        record_stage(stage, seconds)
+
+@contextmanager
+def timed_stage(stage: str, timings: Optional[Dict[str, float]] = None) -> Iterator[None]:
+    """
+    with ブロックの実行時間を段階の時間として記録する
+
+    Args:
+        stage: 段階の名前（validate, detect, llm_name など）
+        timings: 記録先の辞書（ワーカープロセスで計測して結果と一緒に返す場合）。
+            Noneの場合は処理中のリクエストに記録する
+    """
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started_at
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + elapsed
+        else:
+            record_stage(stage, elapsed)
+
+class RequestMetrics:
+    """リクエストの処理時間・段階ごとの処理時間のヒストグラムと、処理中のリクエスト数"""
+
+    def __init__(self, registry: MetricsRegistry):
+        self.in_flight = 0
+        self.request_duration = registry.histogram(
+            "http_request_duration_seconds", "HTTPリクエストの処理時間", ("method", "route", "status")
+        )
+        self.stage_duration = registry.histogram(
+            "pipeline_stage_duration_seconds", "星座生成の段階ごとの処理時間", ("stage",)
+        )
+        registry.callback("http_requests_in_flight", "処理中のHTTPリクエスト数", lambda: self.in_flight)
+
+    def observe(self, method: str, route: str, status: int, seconds: float, timings: RequestTimings) -> None:
+        self.request_duration.observe(seconds, (method, route, status))
+        for stage, stage_seconds in list(timings.records):
+            self.stage_duration.observe(stage_seconds, (stage,))
+
+class MetricsMiddleware:
+    """
+    リクエストごとに段階ごとの時間を集め、Server-Timingヘッダーとヒストグラムに出力するASGIミドルウェア
+
+    Server-Timingはレスポンスヘッダーを送る時点までに記録された段階を含む。
+    ストリーミングのレスポンスでは、ヘッダーを送った後に終わった段階はヒストグラムにのみ記録される。
+    """
+
+    def __init__(self, app, metrics: RequestMetrics):
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings = RequestTimings()
+        token = _current_timings.set(timings)
+        started_at = time.perf_counter()
+        status = 500
+        self.metrics.in_flight += 1
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                header = timings.server_timing(time.perf_counter() - started_at).encode("latin-1")
+                message = {**message, "headers": list(message.get("headers", [])) + [(b"server-timing", header)]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            self.metrics.in_flight -= 1
+            _current_timings.reset(token)
+            # ルートはパスのテンプレート（/api/images/{image_name}）で集計し、ラベルの種類を増やさない
+            route = getattr(scope.get("route"), "path", None) or "other"
+            self.metrics.observe(scope["method"], route, status, time.perf_counter() - started_at, timings)
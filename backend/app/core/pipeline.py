@@ -0,0 +1,268 @@
+import os
+import uuid
+import logging
+from typing import Dict, Any, List, Tuple
+from dataclasses import asdict
+import numpy as np
+from dotenv import load_dotenv
+
+from app.core.image_processing import decoder_registry, optimize_image_array, read_exif_orientation
+from app.core.star_detection import StarField, compute_star_field
+from app.core.constellation import (
+    render_constellation, encode_constellation_image, available_output_formats, OUTPUT_FORMATS,
+    build_constellation_data, render_constellation_svg
+)
+from app.core.detection_cache import StarFieldCache
+from app.core.metrics import timed_stage
+
+load_dotenv()
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 星検出とクラスタリングのパラメータ（キャッシュキーにも含まれる）
+DETECTION_PARAMS = {
+    "target_size": (800, 600),
+    "min_stars": 3,
+    "max_distance": 50,
+    "max_stars": 12,
+    "use_adaptive_threshold": True,
+    "use_blob_detection": True,
+    "max_detected": int(os.getenv("MAX_DETECTED_STARS", "200")),
+    "cluster_engine": os.getenv("CLUSTER_ENGINE", "grid"),
+    "detection_mode": os.getenv("DETECTION_MODE", "single"),
+    "tile_size": int(os.getenv("DETECTION_TILE_SIZE", "1024")),
+    "tile_workers": int(os.getenv("DETECTION_TILE_WORKERS", "0")) or None,
+    "pyramid_size": int(os.getenv("DETECTION_PYRAMID_SIZE", "1024"))
+}
+
+# 星座ラインの描画パラメータ
+RENDER_PARAMS = {
+    "topology": os.getenv("CONSTELLATION_TOPOLOGY", "mst"),
+    "extra_edges": int(os.getenv("CONSTELLATION_EXTRA_EDGES", "0"))
+}
+
+# 保存する星座画像のフォーマットと画質（/api/images で配信する各形式の変換元にもなる）
+OUTPUT_PARAMS = {
+    "image_format": os.getenv("CONSTELLATION_IMAGE_FORMAT", "jpeg").lower(),
+    "quality": os.getenv("CONSTELLATION_IMAGE_QUALITY", "high")
+}
+if OUTPUT_PARAMS["image_format"] not in available_output_formats():
+    logger.warning(f"星座画像の出力フォーマットに対応していないため、JPEGで保存します: {OUTPUT_PARAMS['image_format']}")
+    OUTPUT_PARAMS["image_format"] = "jpeg"
+
+# パイプラインの出力（image: 星座を描画した画像を保存 / svg: 元画像に重ねるSVGを返す / vectors: 座標のみ返す）
+OUTPUT_MODES = ("image", "svg", "vectors")
+
+# 星検出結果のキャッシュ（ワーカープロセスごとのメモリ層と、任意で共有のディスク層）
+star_field_cache = StarFieldCache(
+    max_bytes=int(os.getenv("STAR_CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+    cache_dir=os.getenv("STAR_CACHE_DIR") or None,
+    disk_max_bytes=int(os.getenv("STAR_CACHE_DISK_MAX_BYTES", str(256 * 1024 * 1024)))
+)
+
+def detect_constellation_stars(file_content: bytes, use_cache: bool = True) -> Dict[str, Any]:
+    """
+    パイプラインの前半: 画像をデコード・最適化し、星検出とクラスタリングを行う
+    同じ画像と検出パラメータの結果はキャッシュから返す
+
+    Args:
+        file_content: アップロードされた画像ファイルのバイト内容
+        use_cache: 検出結果のキャッシュを使用するかどうか
+
+    Returns:
+        最適化済みのグレースケール画像（optimized）、星検出結果（star_field）、
+        キャッシュにヒットしたかどうか（cache_hit）、デコードの記録（decode）、
+        段階ごとの時間（timings、ワーカープロセスで計測して呼び出し元で集計する）を含む辞書
+    """
+    timings: Dict[str, float] = {}
+    params = dict(DETECTION_PARAMS)
+    target_size = params.pop("target_size")
+    # 星検出に必要なのはグレースケールのみ。"single"の場合は目標サイズに近い解像度で縮小デコードし、
+    # それ以外はフル解像度で検出するため縮小せずにデコードする
+    single = params["detection_mode"] == "single"
+    with timed_stage("decode", timings):
+        image, decode_record = decoder_registry.decode(
+            file_content, grayscale=True, target_size=target_size if single else None
+        )
+    decode_info = asdict(decode_record) if decode_record is not None else None
+    if image is None:
+        raise ValueError("画像のデコードに失敗しました。別の画像を試してください。")
+
+    cache_key = None
+    if use_cache:
+        cache_key = StarFieldCache.make_key(image, DETECTION_PARAMS)
+        cached = star_field_cache.get(cache_key)
+        if cached is not None:
+            optimized, star_field = cached
+            logger.info(f"星検出結果をキャッシュから取得しました: {cache_key}")
+            return {
+                "optimized": optimized, "star_field": star_field, "cache_hit": True, "decode": decode_info,
+                "timings": timings
+            }
+
+    with timed_stage("optimize", timings):
+        optimized = optimize_image_array(image, target_size=target_size)
+    logger.info(f"画像をメモリ上で最適化しました: {optimized.shape[1]}x{optimized.shape[0]}")
+
+    if single:
+        del image  # デコードした画像はこれ以降不要
+        star_field = compute_star_field(optimized, timings=timings, **params)
+    else:
+        # フル解像度のグレースケール画像で検出し、座標を描画用の画像に合わせる
+        star_field = compute_star_field(
+            image, render_size=(optimized.shape[1], optimized.shape[0]), timings=timings, **params
+        )
+    logger.info(
+        f"星検出とクラスタリングが完了しました: "
+        f"{len(star_field.stars)}個の星, {len(star_field.clusters)}個のクラスタ"
+    )
+
+    if cache_key is not None:
+        star_field_cache.put(cache_key, optimized, star_field)
+
+    return {
+        "optimized": optimized, "star_field": star_field, "cache_hit": False, "decode": decode_info,
+        "timings": timings
+    }
+
+def render_constellation_image(optimized: np.ndarray, star_field: StarField,
+                               output_dir: str = "static/images") -> Dict[str, Any]:
+    """
+    パイプラインの後半: 星座ラインを描画し、1回だけエンコードして保存する
+
+    Args:
+        optimized: 最適化済みの画像
+        star_field: 星検出結果
+        output_dir: 星座画像の保存先ディレクトリ
+
+    Returns:
+        星座画像のパス、星座ラインの情報、星検出結果（StarField）、段階ごとの時間（timings）を含む辞書
+    """
+    timings: Dict[str, float] = {}
+    with timed_stage("draw", timings):
+        rendered, constellation_data = render_constellation(optimized, star_field.constellation_points, **RENDER_PARAMS)
+    with timed_stage("encode", timings):
+        encoded = encode_constellation_image(rendered, **OUTPUT_PARAMS)
+
+    with timed_stage("save", timings):
+        os.makedirs(output_dir, exist_ok=True)
+        image_filename = f"{uuid.uuid4()}_constellation{OUTPUT_FORMATS[OUTPUT_PARAMS['image_format']][2]}"
+        image_path = os.path.join(output_dir, image_filename)
+        with open(image_path, "wb") as f:
+            f.write(encoded)
+    logger.info(f"星座画像を保存しました: {image_path} ({len(encoded)} バイト)")
+
+    return {
+        "image_path": image_path,
+        "image_filename": image_filename,
+        "stars": constellation_data["stars"],
+        "constellation_lines": constellation_data["lines"],
+        "star_field": star_field,
+        "timings": timings
+    }
+
+def orient_points(points: List[List[Tuple[int, int]]], width: int, height: int,
+                  orientation: int) -> Tuple[List[List[Tuple[int, int]]], int, int]:
+    """
+    保存されている画素の向きの座標を、EXIFの回転情報を適用して表示する向きの座標に変換する
+
+    Args:
+        points: 星座の点群（クラスタごとの座標リスト）
+        width: 座標系の幅（回転前）
+        height: 座標系の高さ（回転前）
+        orientation: EXIFの Orientation（1〜8）
+
+    Returns:
+        変換した点群と、表示する向きの座標系の幅と高さのタプル
+    """
+    transforms = {
+        2: lambda x, y: (width - 1 - x, y),
+        3: lambda x, y: (width - 1 - x, height - 1 - y),
+        4: lambda x, y: (x, height - 1 - y),
+        5: lambda x, y: (y, x),
+        6: lambda x, y: (height - 1 - y, x),
+        7: lambda x, y: (height - 1 - y, width - 1 - x),
+        8: lambda x, y: (y, width - 1 - x)
+    }
+    transform = transforms.get(orientation)
+    if transform is None:
+        return points, width, height
+    oriented = [[transform(x, y) for x, y in cluster] for cluster in points]
+    # 5〜8は90度回転を含むため、幅と高さが入れ替わる
+    if orientation >= 5:
+        width, height = height, width
+    return oriented, width, height
+
+def build_constellation_overlay(optimized: np.ndarray, star_field: StarField, include_svg: bool = True,
+                                orientation: int = 1) -> Dict[str, Any]:
+    """
+    パイプラインの後半を画像の描画なしで行う: 星座ラインの座標と、元画像に重ねるSVGを作る
+    画像の描画・エンコード・保存を行わないため、クライアントが持っている元画像に重ねて表示する
+    
+    座標は最適化済みの画像（アスペクト比を保って縮小した画像）の座標系で、
+    overlay の width / height がその大きさになる。元画像の表示サイズに合わせて拡大すればよい。
+    デコード時にはEXIFの回転情報を適用しないため、orientation を指定して
+    ブラウザが回転して表示する元画像と同じ向きの座標に変換する
+
+    Args:
+        optimized: 最適化済みの画像（座標系の大きさを決めるためだけに使う）
+        star_field: 星検出結果
+        include_svg: SVGを作るかどうか（Falseの場合は座標のみ）
+        orientation: 元画像のEXIFの Orientation（1の場合は変換しない）
+
+    Returns:
+        星座ラインの情報、座標系の大きさとSVG（overlay）、星検出結果（StarField）、
+        段階ごとの時間（timings）を含む辞書（保存する画像はないため image_path と image_filename は None）
+    """
+    timings: Dict[str, float] = {}
+    with timed_stage("draw", timings):
+        height, width = optimized.shape[:2]
+        points, width, height = orient_points(star_field.constellation_points, width, height, orientation)
+        constellation_data = build_constellation_data(points, **RENDER_PARAMS)
+        overlay = {"width": width, "height": height, "orientation": orientation}
+        if include_svg:
+            overlay["svg"] = render_constellation_svg(constellation_data, width, height)
+    logger.info(f"星座のオーバーレイを作成しました: {width}x{height}, ライン{len(constellation_data['lines'])}本")
+
+    return {
+        "image_path": None,
+        "image_filename": None,
+        "stars": constellation_data["stars"],
+        "constellation_lines": constellation_data["lines"],
+        "overlay": overlay,
+        "star_field": star_field,
+        "timings": timings
+    }
+
+def run_constellation_pipeline(file_content: bytes, output_dir: str = "static/images",
+                               output: str = "image") -> Dict[str, Any]:
+    """
+    アップロードされた画像から星座画像を生成するインメモリパイプライン
+    画像のデコードは1回のみ行い、最適化→星検出→クラスタリング→描画をメモリ上で処理して
+    最後に1回だけエンコードして保存する
+
+    Args:
+        file_content: アップロードされた画像ファイルのバイト内容
+        output_dir: 星座画像の保存先ディレクトリ
+        output: 出力（OUTPUT_MODESを参照）。"svg"と"vectors"の場合は画像の描画・保存を行わない
+
+    Returns:
+        星座画像のパス、星座ラインの情報、星検出結果（StarField）、
+        キャッシュにヒットしたかどうか、デコードの記録、段階ごとの時間を含む辞書
+        （"svg"と"vectors"の場合は画像のパスの代わりに overlay を含む）
+    """
+    if output not in OUTPUT_MODES:
+        raise ValueError(f"未対応の出力です: {output}")
+    detection = detect_constellation_stars(file_content)
+    if output == "image":
+        result = render_constellation_image(detection["optimized"], detection["star_field"], output_dir=output_dir)
+    else:
+        result = build_constellation_overlay(
+            detection["optimized"], detection["star_field"], include_svg=output == "svg",
+            orientation=read_exif_orientation(file_content)
+        )
+    result["cache_hit"] = detection["cache_hit"]
+    result["decode"] = detection["decode"]
+    result["timings"] = {**detection["timings"], **result["timings"]}
+    return result
@@ -1,15 +1,39 @@
 import cv2
 import numpy as np
-from typing import List, Tuple, Dict, Any, Optional
+from typing import List, Tuple, Dict, Any, Optional, Union
+from dataclasses import dataclass
 import logging
 import os
-from PIL import Image, UnidentifiedImageError
+import heapq
+from concurrent.futures import ThreadPoolExecutor
+
+from app.core.star_table import StarTable, group_clusters
+from app.core.image_processing import decode_image, decode_image_gray
+from app.core.metrics import timed_stage
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+DETECTION_MODES = ("single", "tiled", "pyramid")
+
+def _default_stars() -> List[Dict[str, Any]]:
+    """検出に失敗した場合に使用するデフォルトの星のリストを返す"""
+    return [
+        {"x": 100, "y": 100, "brightness": 200, "area": 10},
+        {"x": 200, "y": 150, "brightness": 180, "area": 8},
+        {"x": 300, "y": 200, "brightness": 220, "area": 12},
+        {"x": 400, "y": 250, "brightness": 190, "area": 9},
+        {"x": 500, "y": 300, "brightness": 210, "area": 11}
+    ]
+
+def _default_star_table() -> StarTable:
+    """検出に失敗した場合に使用するデフォルトの星のテーブルを返す"""
+    return StarTable.from_dicts(_default_stars())
+
 def detect_stars(image_path: str, threshold: Optional[int] = None, min_area: int = 5, 
-                 use_adaptive_threshold: bool = True, use_blob_detection: bool = True) -> List[Dict[str, Any]]:
+                 use_adaptive_threshold: bool = True, use_blob_detection: bool = True,
+                 max_detected: int = 200, mode: str = "single", tile_size: int = 1024,
+                 tile_workers: Optional[int] = None, pyramid_size: int = 1024) -> List[Dict[str, Any]]:
     """
     画像から星を検出し、座標と明るさを返す
     
@@ -19,183 +43,247 @@ def detect_stars(image_path: str, threshold: Optional[int] = None, min_area: int
         min_area: 星として認識する最小面積
         use_adaptive_threshold: 適応的閾値処理を使用するかどうか
         use_blob_detection: Blob検出を使用するかどうか
+        max_detected: 返す星の最大数（明るい順）
+        mode: 検出方法（detect_stars_in_imageを参照）
+        tile_size: "tiled"の場合のタイルの一辺の長さ
+        tile_workers: "tiled"の場合の並列数（Noneの場合はCPUコア数）
+        pyramid_size: "pyramid"の場合に候補を探す縮小画像の長辺の長さ
         
     Returns:
         検出された星のリスト、各星は辞書形式で座標とサイズを含む
     """
-    default_stars = [
-        {"x": 100, "y": 100, "brightness": 200, "area": 10},
-        {"x": 200, "y": 150, "brightness": 180, "area": 8},
-        {"x": 300, "y": 200, "brightness": 220, "area": 12},
-        {"x": 400, "y": 250, "brightness": 190, "area": 9},
-        {"x": 500, "y": 300, "brightness": 210, "area": 11}
-    ]
-    
     try:
         if not os.path.exists(image_path):
             logger.error(f"画像ファイルが存在しません: {image_path}")
-            return default_stars
+            return _default_stars()
         
-        image = load_image(image_path)
+        image = load_image(image_path, grayscale=True)
         if image is None:
             logger.error(f"画像の読み込みに失敗しました: {image_path}")
-            return default_stars
-            
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+            return _default_stars()
         
-        stars = []
+        return detect_stars_in_image(
+            image,
+            threshold=threshold,
+            min_area=min_area,
+            use_adaptive_threshold=use_adaptive_threshold,
+            use_blob_detection=use_blob_detection,
+            max_detected=max_detected,
+            mode=mode,
+            tile_size=tile_size,
+            tile_workers=tile_workers,
+            pyramid_size=pyramid_size
+        )
+    except Exception as e:
+        logger.error(f"星の検出中にエラーが発生しました: {e}")
+        return _default_stars()
+
+def detect_stars_in_image(image: np.ndarray, threshold: Optional[int] = None, min_area: int = 5,
+                          use_adaptive_threshold: bool = True,
+                          use_blob_detection: bool = True,
+                          max_detected: int = 200, mode: str = "single", tile_size: int = 1024,
+                          tile_workers: Optional[int] = None, pyramid_size: int = 1024) -> List[Dict[str, Any]]:
+    """
+    メモリ上の画像配列から星を検出する
+    結果を従来の辞書形式のリストで返す（内部の処理では detect_star_table を使用する）
+    
+    Args:
+        image: 処理する画像（グレースケールまたはBGR形式）
+        threshold: 白色を検出するための閾値（0-255）、Noneの場合は自動設定
+        min_area: 星として認識する最小面積
+        use_adaptive_threshold: 適応的閾値処理を使用するかどうか
+        use_blob_detection: Blob検出を使用するかどうか
+        max_detected: 返す星の最大数（明るい順）
+        mode: 検出方法
+            "single": 画像全体を1回で処理する（デフォルト）
+            "tiled": 画像を重なりのあるタイルに分割して並列に処理する（フル解像度の大きな画像向け）
+            "pyramid": 縮小画像で候補を探し、元の解像度の小さな窓で重心・明るさ・面積を求める
+                （処理時間が画素数ではなく星の数に比例する。サブピクセルの重心を centroid_x/centroid_y に持つ。
+                threshold, use_adaptive_threshold, use_blob_detection は使用しない）
+        tile_size: "tiled"の場合のタイルの一辺の長さ
+        tile_workers: "tiled"の場合の並列数（Noneの場合はCPUコア数）
+        pyramid_size: "pyramid"の場合に候補を探す縮小画像の長辺の長さ
+        
+    Returns:
+        検出された星のリスト、各星は辞書形式で座標とサイズを含む
+    """
+    return detect_star_table(
+        image,
+        threshold=threshold,
+        min_area=min_area,
+        use_adaptive_threshold=use_adaptive_threshold,
+        use_blob_detection=use_blob_detection,
+        max_detected=max_detected,
+        mode=mode,
+        tile_size=tile_size,
+        tile_workers=tile_workers,
+        pyramid_size=pyramid_size
+    ).to_dicts()
+
+def detect_star_table(image: np.ndarray, threshold: Optional[int] = None, min_area: int = 5,
+                      use_adaptive_threshold: bool = True,
+                      use_blob_detection: bool = True,
+                      max_detected: int = 200, mode: str = "single", tile_size: int = 1024,
+                      tile_workers: Optional[int] = None, pyramid_size: int = 1024) -> StarTable:
+    """
+    メモリ上の画像配列から星を検出し、列形式のテーブルで返す
+    ファイルを経由しないインメモリパイプライン用
+    
+    Args:
+        image: 処理する画像（グレースケールまたはBGR形式）
+        threshold: 白色を検出するための閾値（0-255）、Noneの場合は自動設定
+        min_area: 星として認識する最小面積
+        use_adaptive_threshold: 適応的閾値処理を使用するかどうか
+        use_blob_detection: Blob検出を使用するかどうか
+        max_detected: 返す星の最大数（明るい順）
+        mode: 検出方法
+            "single": 画像全体を1回で処理する（デフォルト）
+            "tiled": 画像を重なりのあるタイルに分割して並列に処理する（フル解像度の大きな画像向け）
+            "pyramid": 縮小画像で候補を探し、元の解像度の小さな窓で重心・明るさ・面積を求める
+                （処理時間が画素数ではなく星の数に比例する。サブピクセルの重心を centroid_x/centroid_y に持つ。
+                threshold, use_adaptive_threshold, use_blob_detection は使用しない）
+        tile_size: "tiled"の場合のタイルの一辺の長さ
+        tile_workers: "tiled"の場合の並列数（Noneの場合はCPUコア数）
+        pyramid_size: "pyramid"の場合に候補を探す縮小画像の長辺の長さ
         
-        if use_blob_detection:
-            blob_stars = detect_stars_with_blob(gray)
-            if blob_stars:
-                stars.extend(blob_stars)
-                logger.info(f"Blob検出で{len(blob_stars)}個の星を検出しました")
+    Returns:
+        検出された星のテーブル（明るい順）
+    """
+    if mode not in DETECTION_MODES:
+        raise ValueError(f"未対応の星検出モードです: {mode}")
+    
+    try:
+        if image is None or image.size == 0:
+            logger.error("画像データが空です")
+            return _default_star_table()
         
-        if len(stars) < 10:
-            threshold_stars = detect_stars_with_threshold(gray, threshold, min_area, use_adaptive_threshold)
-            if threshold_stars:
-                for star in threshold_stars:
-                    if not any(is_close_to_existing_star(star, existing_star, 10) for existing_star in stars):
-                        stars.append(star)
-                logger.info(f"閾値処理で{len(threshold_stars)}個の星を検出しました")
+        if image.ndim == 2:
+            gray = image
+        else:
+            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
         
-        if not stars:
-            logger.warning(f"星が検出されませんでした。デフォルトの星を使用します: {image_path}")
-            return default_stars
+        if mode == "pyramid":
+            stars = StarTable.from_dicts(detect_stars_with_pyramid(gray, min_area, pyramid_size))
+        else:
+            stars = _detect_blob_and_threshold_stars(
+                gray, threshold, min_area, use_adaptive_threshold, use_blob_detection,
+                tiled=(mode == "tiled"), tile_size=tile_size, tile_workers=tile_workers
+            )
         
-        stars = sorted(stars, key=lambda x: x["brightness"], reverse=True)
+        if not len(stars):
+            logger.warning("星が検出されませんでした。デフォルトの星を使用します")
+            return _default_star_table()
         
-        if len(stars) > 200:
-            stars = stars[:200]
-            
-        logger.info(f"合計{len(stars)}個の星を検出しました")
-        return stars
+        table = stars.sorted_by_brightness()[:max_detected]
+        logger.info(f"合計{len(table)}個の星を検出しました")
+        return table
     except Exception as e:
         logger.error(f"星の検出中にエラーが発生しました: {e}")
-        return default_stars
+        return _default_star_table()
 
-def load_image(image_path: str) -> Optional[np.ndarray]:
+def _detect_blob_and_threshold_stars(gray: np.ndarray, threshold: Optional[int], min_area: int,
+                                     use_adaptive_threshold: bool, use_blob_detection: bool,
+                                     tiled: bool = False, tile_size: int = 1024,
+                                     tile_workers: Optional[int] = None) -> StarTable:
     """
-    複数の方法を試して画像を読み込む
-    AVIF、HEIC、WebPなどの特殊な形式にも対応
+    Blob検出を行い、星が少ない場合は閾値処理で検出した星を重複しないように追加する
     
     Args:
-        image_path: 画像ファイルのパス
+        gray: グレースケール画像
+        threshold: 白色を検出するための閾値（0-255）、Noneの場合は自動設定
+        min_area: 星として認識する最小面積
+        use_adaptive_threshold: 適応的閾値処理を使用するかどうか
+        use_blob_detection: Blob検出を使用するかどうか
+        tiled: タイルに分割して並列に処理するかどうか
+        tile_size: タイルの一辺の長さ
+        tile_workers: 並列数（Noneの場合はCPUコア数）
         
     Returns:
-        読み込まれた画像（OpenCV形式）、失敗した場合はNone
+        検出された星のテーブル（並び順は検出順）
     """
-    logger.info(f"画像の読み込みを開始します: {image_path}")
+    stars = StarTable()
     
-    try:
-        pil_image = Image.open(image_path)
-        logger.info(f"PILで画像を開きました: フォーマット={pil_image.format}, サイズ={pil_image.size}, モード={pil_image.mode}")
-        
-        if pil_image.mode != 'RGB':
-            pil_image = pil_image.convert('RGB')
-            logger.info(f"画像をRGBモードに変換しました")
-            
-        image_np = np.array(pil_image)
-        image = cv2.cvtColor(image_np, cv2.COLOR_RGB2BGR)
-        logger.info(f"PILで画像を正常に読み込みました: {image_path}")
-        return image
-    except (UnidentifiedImageError, Exception) as pil_error:
-        logger.warning(f"PILでの画像読み込みに失敗しました: {pil_error}")
+    if use_blob_detection:
+        if tiled:
+            stars = _detect_on_tiles([gray], tile_size, tile_workers, _blob_star_table)
+        else:
+            stars = _blob_star_table(gray)
+        if len(stars):
+            logger.info(f"Blob検出で{len(stars)}個の星を検出しました")
     
-    try:
-        image = cv2.imread(image_path)
-        if image is not None and image.size > 0:
-            height, width = image.shape[:2]
-            logger.info(f"OpenCVで画像を読み込みました: {image_path}, サイズ={width}x{height}")
-            return image
+    if len(stars) < 10:
+        if tiled:
+            threshold_stars = _threshold_star_table_tiled(
+                gray, threshold, min_area, use_adaptive_threshold, tile_size, tile_workers
+            )
         else:
-            logger.warning(f"OpenCVでの画像読み込みに失敗しました: 画像データがNoneまたは空です")
-    except Exception as cv_error:
-        logger.warning(f"OpenCVでの画像読み込みに失敗しました: {cv_error}")
+            threshold_stars = _threshold_star_table(gray, threshold, min_area, use_adaptive_threshold)
+        if len(threshold_stars):
+            stars = _merge_distinct_stars(stars, threshold_stars, 10)
+            logger.info(f"閾値処理で{len(threshold_stars)}個の星を検出しました")
     
-    try:
-        import subprocess
-        import tempfile
-        import uuid
-        
-        temp_dir = tempfile.gettempdir()
-        temp_filename = f"converted_{uuid.uuid4()}.jpg"
-        temp_path = os.path.join(temp_dir, temp_filename)
-        
-        convert_cmd = ['convert', image_path, '-auto-orient', '-strip', temp_path]
-        logger.info(f"ImageMagickで変換を試みます: {' '.join(convert_cmd)}")
+    return stars
+
+def _merge_distinct_stars(stars: StarTable, candidates: StarTable, min_distance: float) -> StarTable:
+    """
+    候補の星を検出順に調べ、既存の星と、それまでに追加した候補の星のどれとも
+    min_distance 未満の距離にない星だけを追加する
+    近いペアは _radius_pairs で一括で求めるため、候補ごとに全ての星と比較する必要がない
+    
+    Args:
+        stars: 既存の星のテーブル
+        candidates: 追加する候補の星のテーブル
+        min_distance: 最小距離（これ未満の距離の星は重複とみなす）
         
-        result = subprocess.run(convert_cmd, capture_output=True, text=True)
+    Returns:
+        既存の星の後ろに採用した候補の星を並べたテーブル
+    """
+    if not len(stars) and len(candidates) < 2:
+        return candidates
+    existing = len(stars)
+    xs = np.concatenate([stars.x, candidates.x]).astype(np.float64)
+    ys = np.concatenate([stars.y, candidates.y]).astype(np.float64)
+    # 距離が min_distance ちょうどのペアは重複に含めない
+    lefts, rights = _radius_pairs(xs, ys, np.nextafter(float(min_distance), 0.0))
+    firsts, seconds = np.minimum(lefts, rights), np.maximum(lefts, rights)
+    
+    accepted = np.ones(len(candidates), dtype=bool)
+    accepted[seconds[firsts < existing] - existing] = False
+    # 候補どうしの重複は、先に検出された星が採用された場合だけ後の星を除外する
+    between = firsts >= existing
+    order = np.argsort(seconds[between], kind="stable")
+    for first, second in zip((firsts[between][order] - existing).tolist(),
+                             (seconds[between][order] - existing).tolist()):
+        if accepted[first]:
+            accepted[second] = False
+    
+    return StarTable.concatenate([stars, candidates.take(np.flatnonzero(accepted))])
+
+def load_image(image_path: str, grayscale: bool = False) -> Optional[np.ndarray]:
+    """
+    画像を読み込む
+    AVIF、HEIC、WebPなどの形式も、フォーマットに対応するデコーダーで1回だけデコードする
+    
+    Args:
+        image_path: 画像ファイルのパス
+        grayscale: グレースケールで直接デコードするかどうか（カラー画像の中間バッファを作らない）
         
-        if result.returncode == 0:
-            logger.info(f"ImageMagickで画像を変換しました: {image_path} -> {temp_path}")
-            
-            try:
-                converted_image = cv2.imread(temp_path)
-                if converted_image is not None and converted_image.size > 0:
-                    height, width = converted_image.shape[:2]
-                    logger.info(f"変換された画像を読み込みました: {temp_path}, サイズ={width}x{height}")
-                    
-                    try:
-                        os.remove(temp_path)
-                        logger.info(f"一時ファイルを削除しました: {temp_path}")
-                    except Exception as rm_error:
-                        logger.warning(f"一時ファイルの削除に失敗しました: {rm_error}")
-                    
-                    return converted_image
-                else:
-                    logger.warning(f"変換された画像の読み込みに失敗しました: 画像データがNoneまたは空です")
-            except Exception as read_error:
-                logger.warning(f"変換された画像の読み込みに失敗しました: {read_error}")
-        else:
-            logger.warning(f"ImageMagickでの変換に失敗しました: {result.stderr}")
-            
-            try:
-                special_convert_cmd = [
-                    'convert', image_path, 
-                    '-auto-orient', '-strip', 
-                    '-define', 'heif:preserve-orientation=true',
-                    '-define', 'avif:preserve-orientation=true',
-                    temp_path
-                ]
-                logger.info(f"特殊オプションでImageMagickによる変換を再試行します")
-                
-                special_result = subprocess.run(special_convert_cmd, capture_output=True, text=True)
-                
-                if special_result.returncode == 0:
-                    logger.info(f"特殊オプションでImageMagickによる変換に成功しました")
-                    
-                    converted_image = cv2.imread(temp_path)
-                    if converted_image is not None and converted_image.size > 0:
-                        try:
-                            os.remove(temp_path)
-                        except:
-                            pass
-                        
-                        return converted_image
-            except Exception as special_error:
-                logger.warning(f"特殊オプションでの変換にも失敗しました: {special_error}")
-    except Exception as im_error:
-        logger.warning(f"ImageMagickでの処理中にエラーが発生しました: {im_error}")
+    Returns:
+        読み込まれた画像（OpenCV形式）、失敗した場合はNone
+    """
+    logger.info(f"画像の読み込みを開始します: {image_path}")
     
     try:
-        with open(image_path, 'rb') as f:
-            binary_data = f.read()
-            
-        nparr = np.frombuffer(binary_data, np.uint8)
-        img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        
-        if img is not None and img.size > 0:
-            height, width = img.shape[:2]
-            logger.info(f"バイナリデータから直接画像を読み込みました: {image_path}, サイズ={width}x{height}")
-            return img
-        else:
-            logger.warning("バイナリデータからの画像読み込みに失敗しました")
-    except Exception as bin_error:
-        logger.warning(f"バイナリデータからの読み込みに失敗しました: {bin_error}")
+        with open(image_path, "rb") as f:
+            content = f.read()
+    except OSError as read_error:
+        logger.error(f"画像ファイルの読み込みに失敗しました: {read_error}")
+        return None
     
-    logger.error(f"すべての方法で画像の読み込みに失敗しました: {image_path}")
-    return None
+    image = decode_image_gray(content) if grayscale else decode_image(content)
+    if image is None:
+        logger.error(f"画像の読み込みに失敗しました: {image_path}")
+    return image
 
 def is_close_to_existing_star(star1: Dict[str, Any], star2: Dict[str, Any], min_distance: int) -> bool:
     """
@@ -212,15 +300,47 @@ def is_close_to_existing_star(star1: Dict[str, Any], star2: Dict[str, Any], min_
     distance = np.sqrt((star1["x"] - star2["x"])**2 + (star1["y"] - star2["y"])**2)
     return distance < min_distance
 
-def detect_stars_with_blob(gray_image: np.ndarray) -> List[Dict[str, Any]]:
+def _window_photometry(gray_image: np.ndarray, xs: np.ndarray, ys: np.ndarray,
+                       radius: int = 2) -> Tuple[np.ndarray, np.ndarray]:
     """
-    Blob検出を使用して星を検出
+    各星の座標を中心とする (2*radius+1) 四方の窓の平均と最大の明るさを、全ての星について一度に求める
+    画像の端で欠けた部分は平均に含めない（従来の星ごとの np.mean と同じ値になる）
     
     Args:
         gray_image: グレースケール画像
+        xs: 星のx座標（整数）
+        ys: 星のy座標（整数）
+        radius: 窓の半径
         
     Returns:
-        検出された星のリスト
+        平均の明るさと最大の明るさの配列
+    """
+    height, width = gray_image.shape[:2]
+    offsets = np.arange(-radius, radius + 1)
+    window_xs = np.asarray(xs, dtype=np.int64)[:, None] + offsets
+    window_ys = np.asarray(ys, dtype=np.int64)[:, None] + offsets
+    inside = (
+        ((window_ys >= 0) & (window_ys < height))[:, :, None]
+        & ((window_xs >= 0) & (window_xs < width))[:, None, :]
+    )
+    values = gray_image[
+        np.clip(window_ys, 0, height - 1)[:, :, None],
+        np.clip(window_xs, 0, width - 1)[:, None, :]
+    ].astype(np.float64)
+    values[~inside] = 0.0
+    mean = values.sum(axis=(1, 2)) / inside.sum(axis=(1, 2))
+    return mean, values.max(axis=(1, 2))
+
+def _blob_star_table(gray_image: np.ndarray) -> StarTable:
+    """
+    Blob検出を使用して星を検出し、テーブルで返す
+    明るさはキーポイントごとではなく、全てのキーポイントについて一度に求める
+    
+    Args:
+        gray_image: グレースケール画像
+        
+    Returns:
+        検出された星のテーブル
     """
     params = cv2.SimpleBlobDetector_Params()
     
@@ -242,23 +362,32 @@ def detect_stars_with_blob(gray_image: np.ndarray) -> List[Dict[str, Any]]:
     
     detector = cv2.SimpleBlobDetector_create(params)
     keypoints = detector.detect(gray_image)
+    if not keypoints:
+        return StarTable()
     
-    stars = []
-    for kp in keypoints:
-        x, y = int(kp.pt[0]), int(kp.pt[1])
-        size = kp.size
-        x_min, x_max = max(0, x-2), min(gray_image.shape[1]-1, x+2)
-        y_min, y_max = max(0, y-2), min(gray_image.shape[0]-1, y+2)
-        brightness = np.mean(gray_image[y_min:y_max+1, x_min:x_max+1])
-        
-        stars.append({
-            "x": x,
-            "y": y,
-            "brightness": brightness,
-            "area": size * size * np.pi / 4  # 円の面積の近似
-        })
+    points = cv2.KeyPoint_convert(keypoints)
+    xs = points[:, 0].astype(np.int32)
+    ys = points[:, 1].astype(np.int32)
+    sizes = np.fromiter((kp.size for kp in keypoints), dtype=np.float64, count=len(keypoints))
+    brightness, peak = _window_photometry(gray_image, xs, ys)
     
-    return stars
+    return StarTable.from_columns(
+        xs, ys, brightness,
+        sizes * sizes * np.pi / 4,  # 円の面積の近似
+        peak=peak
+    )
+
+def detect_stars_with_blob(gray_image: np.ndarray) -> List[Dict[str, Any]]:
+    """
+    Blob検出を使用して星を検出
+    
+    Args:
+        gray_image: グレースケール画像
+        
+    Returns:
+        検出された星のリスト
+    """
+    return _blob_star_table(gray_image).to_dicts()
 
 def detect_stars_with_threshold(gray_image: np.ndarray, threshold: Optional[int] = None, 
                                min_area: int = 5, use_adaptive: bool = True) -> List[Dict[str, Any]]:
@@ -268,133 +397,805 @@ def detect_stars_with_threshold(gray_image: np.ndarray, threshold: Optional[int]
     Args:
         gray_image: グレースケール画像
         threshold: 閾値（Noneの場合は自動設定）
-        min_area: 最小面積
+        min_area: 最小面積（輪郭の面積）
         use_adaptive: 適応的閾値処理を使用するかどうか
         
     Returns:
         検出された星のリスト
     """
+    return _threshold_star_table(gray_image, threshold, min_area, use_adaptive).to_dicts()
+
+def _threshold_star_table(gray_image: np.ndarray, threshold: Optional[int] = None,
+                          min_area: int = 5, use_adaptive: bool = True) -> StarTable:
+    """閾値処理を使用して星を検出し、テーブルで返す"""
+    enhanced = _enhance_for_threshold(gray_image)
+    if not use_adaptive and threshold is None:
+        threshold, _ = cv2.threshold(enhanced, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    
+    return _threshold_stars(gray_image, enhanced, threshold, min_area, use_adaptive)
+
+def _enhance_for_threshold(gray_image: np.ndarray) -> np.ndarray:
+    """閾値処理の前にCLAHEでコントラストを強調する"""
     clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
-    enhanced = clahe.apply(gray_image)
+    return clahe.apply(gray_image)
+
+def _threshold_stars(gray_image: np.ndarray, enhanced: np.ndarray, threshold: Optional[float],
+                     min_area: int, use_adaptive: bool) -> StarTable:
+    """
+    コントラスト強調済みの画像を2値化し、連結成分ごとの測光値を星として返す
+    
+    面積・重心・明るさは cv2.connectedComponentsWithStats と、前景の画素だけを対象にした
+    ラベルごとの集計で全ての星について一度に求める（星ごとのPythonの処理は行わない）。
+    面積は連結成分の画素数、重心は明るさで重み付けしたサブピクセルの重心（centroid_x/centroid_y）。
+    ノイズの除外には従来どおり輪郭の面積を使い、境界の画素数からピックの定理で求める
+    （輪郭の面積 = 画素数 - 境界の画素数 / 2 - 1）。
     
+    Args:
+        gray_image: 明るさの計算に使用するグレースケール画像
+        enhanced: コントラスト強調済みの画像
+        threshold: 固定閾値（use_adaptiveがFalseの場合に使用）
+        min_area: 最小面積（輪郭の面積）
+        use_adaptive: 適応的閾値処理を使用するかどうか
+        
+    Returns:
+        検出された星のテーブル（平均の明るさ・最大の明るさ・明るさの合計を含む）
+    """
     if use_adaptive:
         thresh = cv2.adaptiveThreshold(
             enhanced, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, 
             cv2.THRESH_BINARY, 11, -2
         )
     else:
-        if threshold is None:
-            threshold, _ = cv2.threshold(enhanced, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
         _, thresh = cv2.threshold(enhanced, threshold, 255, cv2.THRESH_BINARY)
     
-    contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    count, labels, stats, _ = cv2.connectedComponentsWithStats(thresh, connectivity=8)
     
-    # 検出された星のリスト
-    stars = []
+    # 前景の画素だけをラベルごとに集計する（ラベル0は背景）
+    foreground = np.flatnonzero(labels)
+    pixel_labels = labels.ravel()[foreground]
+    values = gray_image.ravel()[foreground].astype(np.float64)
+    width = gray_image.shape[1]
+    flux = np.bincount(pixel_labels, weights=values, minlength=count)
+    weighted_x = np.bincount(pixel_labels, weights=values * (foreground % width), minlength=count)
+    weighted_y = np.bincount(pixel_labels, weights=values * (foreground // width), minlength=count)
+    peak = np.zeros(count)
+    np.maximum.at(peak, pixel_labels, values)
     
-    for contour in contours:
-        area = cv2.contourArea(contour)
-        if area >= min_area:  # 小さすぎる点はノイズとして除外
-            M = cv2.moments(contour)
-            if M["m00"] != 0:
-                cx = int(M["m10"] / M["m00"])
-                cy = int(M["m01"] / M["m00"])
-                
-                x_min, x_max = max(0, cx-2), min(gray_image.shape[1]-1, cx+2)
-                y_min, y_max = max(0, cy-2), min(gray_image.shape[0]-1, cy+2)
-                brightness = np.mean(gray_image[y_min:y_max+1, x_min:x_max+1])
-                
-                stars.append({
-                    "x": cx,
-                    "y": cy,
-                    "brightness": brightness,
-                    "area": area
-                })
+    # 境界の画素（4近傍に背景がある前景の画素。画像の外側は背景とみなす）
+    eroded = cv2.erode(thresh, cv2.getStructuringElement(cv2.MORPH_CROSS, (3, 3)),
+                       borderType=cv2.BORDER_CONSTANT, borderValue=0)
+    border = np.bincount(labels[(thresh > 0) & (eroded == 0)], minlength=count)
+    areas = stats[:, cv2.CC_STAT_AREA]
+    contour_areas = areas - border / 2 - 1
+    
+    # 小さすぎる点はノイズとして除外し、明るさの合計が0の成分（重心が求まらない）も除外する
+    keep = np.flatnonzero((contour_areas >= min_area) & (flux > 0))
+    keep = keep[keep > 0]
+    centroid_x = weighted_x[keep] / flux[keep]
+    centroid_y = weighted_y[keep] / flux[keep]
+    xs = centroid_x.astype(np.int32)
+    ys = centroid_y.astype(np.int32)
+    brightness, _ = _window_photometry(gray_image, xs, ys)
+    
+    return StarTable.from_columns(
+        xs, ys, brightness, areas[keep],
+        centroid_x=centroid_x, centroid_y=centroid_y, peak=peak[keep], flux=flux[keep]
+    )
+
+# タイルの周囲に付ける重なりの幅（Blob検出の最大面積300ピクセルの星と、
+# 適応的閾値処理の11x11の窓がタイルの境界で欠けない大きさ）
+TILE_HALO = 32
+
+def _tile_windows(width: int, height: int, tile_size: int) -> List[Tuple[int, int, int, int]]:
+    """
+    画像をタイルに分割したときの各タイルの担当範囲を返す
+    
+    Args:
+        width: 画像の幅
+        height: 画像の高さ
+        tile_size: タイルの一辺の長さ
+        
+    Returns:
+        各タイルの（左, 上, 右, 下）のリスト（右と下は含まない）
+    """
+    tile_size = max(tile_size, 1)
+    return [
+        (x0, y0, min(x0 + tile_size, width), min(y0 + tile_size, height))
+        for y0 in range(0, height, tile_size)
+        for x0 in range(0, width, tile_size)
+    ]
+
+def _detect_on_tiles(images: List[np.ndarray], tile_size: int, tile_workers: Optional[int],
+                     detect: Any) -> StarTable:
+    """
+    重なりのあるタイルごとに検出処理を並列に実行し、結果を画像全体の座標にまとめる
+    
+    各タイルは周囲に TILE_HALO ピクセルの重なりを持たせて切り出し、重心が担当範囲に
+    入る星だけを採用する。境界をまたぐ星は重なりの部分で完全に見えているため、
+    どちらか一方のタイルだけで1回ずつ検出される。
+    
+    Args:
+        images: タイルに分割する画像のリスト（全て同じ大きさ）
+        tile_size: タイルの一辺の長さ
+        tile_workers: 並列数（Noneの場合はCPUコア数）
+        detect: 切り出した画像を受け取って星のテーブルを返す関数
+        
+    Returns:
+        検出された星のテーブル（座標は画像全体の座標）
+    """
+    height, width = images[0].shape[:2]
+    windows = _tile_windows(width, height, tile_size)
+    
+    def run(window: Tuple[int, int, int, int]) -> StarTable:
+        x0, y0, x1, y1 = window
+        left, top = max(0, x0 - TILE_HALO), max(0, y0 - TILE_HALO)
+        right, bottom = min(width, x1 + TILE_HALO), min(height, y1 + TILE_HALO)
+        crops = [image[top:bottom, left:right] for image in images]
+        data = detect(*crops).data.copy()
+        data["x"] += left
+        data["y"] += top
+        data["centroid_x"] += left
+        data["centroid_y"] += top
+        owned = (data["x"] >= x0) & (data["x"] < x1) & (data["y"] >= y0) & (data["y"] < y1)
+        return StarTable(data[owned])
+    
+    # OpenCVの処理中はGILが解放されるため、スレッドで複数コアを使用できる
+    workers = max(1, min(tile_workers or os.cpu_count() or 1, len(windows)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="star-tile") as pool:
+        results = list(pool.map(run, windows))
+    
+    stars = StarTable.concatenate(results)
+    logger.info(f"{len(windows)}個のタイルを{workers}並列で処理し、{len(stars)}個の星を検出しました")
+    return stars
+
+def detect_stars_with_blob_tiled(gray_image: np.ndarray, tile_size: int = 1024,
+                                 tile_workers: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    画像をタイルに分割してBlob検出を並列に実行する
+    Blob検出は局所的な処理のため、画像全体を1回で処理した場合と同じ星が得られる
+    （Blobの重心はfloat32で計算されるため、整数座標への切り捨てがまれに1ピクセル異なる）
+    
+    Args:
+        gray_image: グレースケール画像
+        tile_size: タイルの一辺の長さ
+        tile_workers: 並列数（Noneの場合はCPUコア数）
+        
+    Returns:
+        検出された星のリスト
+    """
+    return _detect_on_tiles([gray_image], tile_size, tile_workers, _blob_star_table).to_dicts()
+
+def detect_stars_with_threshold_tiled(gray_image: np.ndarray, threshold: Optional[int] = None,
+                                      min_area: int = 5, use_adaptive: bool = True,
+                                      tile_size: int = 1024,
+                                      tile_workers: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    画像をタイルに分割して閾値処理による検出を並列に実行する
+    CLAHEと大津の閾値は画像全体に依存するため先に画像全体で1回だけ計算し、
+    局所的な2値化と連結成分の集計だけをタイルごとに行う
+    
+    Args:
+        gray_image: グレースケール画像
+        threshold: 閾値（Noneの場合は自動設定）
+        min_area: 最小面積（輪郭の面積）
+        use_adaptive: 適応的閾値処理を使用するかどうか
+        tile_size: タイルの一辺の長さ
+        tile_workers: 並列数（Noneの場合はCPUコア数）
+        
+    Returns:
+        検出された星のリスト
+    """
+    return _threshold_star_table_tiled(
+        gray_image, threshold, min_area, use_adaptive, tile_size, tile_workers
+    ).to_dicts()
+
+def _threshold_star_table_tiled(gray_image: np.ndarray, threshold: Optional[int], min_area: int,
+                                use_adaptive: bool, tile_size: int,
+                                tile_workers: Optional[int]) -> StarTable:
+    """タイルに分割して閾値処理による検出を並列に実行し、テーブルで返す"""
+    enhanced = _enhance_for_threshold(gray_image)
+    if not use_adaptive and threshold is None:
+        threshold, _ = cv2.threshold(enhanced, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
     
+    def detect(gray_tile: np.ndarray, enhanced_tile: np.ndarray) -> StarTable:
+        return _threshold_stars(gray_tile, enhanced_tile, threshold, min_area, use_adaptive)
+    
+    return _detect_on_tiles([gray_image, enhanced], tile_size, tile_workers, detect)
+
+def detect_stars_with_pyramid(gray_image: np.ndarray, min_area: int = 5, pyramid_size: int = 1024,
+                              detection_sigma: float = 5.0) -> List[Dict[str, Any]]:
+    """
+    縮小画像で星の候補を探し、元の解像度の小さな窓で各星を精密に測定する（coarse-to-fine）
+    
+    候補は長辺が pyramid_size の縮小画像から、局所背景を差し引いた信号の極大点として求める。
+    元の解像度の処理は候補の周囲の窓に限定するため、処理時間は画素数ではなく星の数に比例する。
+    
+    Args:
+        gray_image: 元の解像度のグレースケール画像
+        min_area: 星として認識する最小面積（元の解像度の面積）
+        pyramid_size: 縮小画像の長辺の長さ
+        detection_sigma: 候補とする信号の大きさ（背景ノイズの標準偏差の倍数）
+        
+    Returns:
+        検出された星のリスト（座標は元の解像度、サブピクセルの重心を centroid_x/centroid_y に持つ）
+    """
+    height, width = gray_image.shape[:2]
+    scale = max(1.0, max(width, height) / max(pyramid_size, 1))
+    if scale > 1.0:
+        coarse = cv2.resize(
+            gray_image, (max(1, round(width / scale)), max(1, round(height / scale))),
+            interpolation=cv2.INTER_AREA
+        )
+    else:
+        coarse = gray_image
+    scale_x, scale_y = width / coarse.shape[1], height / coarse.shape[0]
+    
+    # 局所背景（メディアン）を差し引き、背景ノイズを中央絶対偏差で推定する
+    signal = coarse.astype(np.float32) - cv2.medianBlur(coarse, 15).astype(np.float32)
+    noise = 1.4826 * float(np.median(np.abs(signal - np.median(signal))))
+    peaks = (signal == cv2.dilate(signal, np.ones((3, 3), np.uint8))) & (signal > max(detection_sigma * noise, 5.0))
+    candidate_ys, candidate_xs = np.nonzero(peaks)
+    
+    # 候補の位置の誤差（縮小率ぶん）を含む窓から測定を始める
+    radius = int(np.ceil(2 * max(scale_x, scale_y))) + 4
+    stars = []
+    seen = set()
+    for x, y in zip(candidate_xs.tolist(), candidate_ys.tolist()):
+        star = _refine_star(gray_image, int((x + 0.5) * scale_x), int((y + 0.5) * scale_y), radius)
+        if star is None or star["area"] < min_area or (star["x"], star["y"]) in seen:
+            continue
+        seen.add((star["x"], star["y"]))
+        stars.append(star)
+    
+    logger.info(
+        f"縮小画像（{coarse.shape[1]}x{coarse.shape[0]}）で{len(candidate_xs)}個の候補を検出し、"
+        f"{len(stars)}個の星を元の解像度で測定しました"
+    )
     return stars
 
+def _refine_star(gray_image: np.ndarray, cx: int, cy: int, radius: int,
+                 max_radius: int = 64) -> Optional[Dict[str, Any]]:
+    """
+    候補の周囲の窓で背景を差し引いた輝度重心を求める
+    星が窓の端で切れている場合は、max_radius まで窓を広げて測定し直す
+    
+    Args:
+        gray_image: 元の解像度のグレースケール画像
+        cx: 候補のx座標
+        cy: 候補のy座標
+        radius: 窓の半径
+        max_radius: 窓の半径の上限
+        
+    Returns:
+        測定した星、窓の中に背景より明るい成分がない場合はNone
+    """
+    height, width = gray_image.shape[:2]
+    while True:
+        x0, x1 = max(0, cx - radius), min(width, cx + radius + 1)
+        y0, y1 = max(0, cy - radius), min(height, cy + radius + 1)
+        window = gray_image[y0:y1, x0:x1].astype(np.float32)
+        if window.size == 0:
+            return None
+        
+        # 背景は窓の中央値、ノイズは中央絶対偏差で推定する
+        background = float(np.median(window))
+        noise = 1.4826 * float(np.median(np.abs(window - background)))
+        signal = window - background
+        mask = (signal > max(3.0 * noise, 10.0)).astype(np.uint8)
+        
+        count, labels, stats, centroids = cv2.connectedComponentsWithStats(mask, connectivity=8)
+        if count <= 1:
+            return None
+        
+        # 窓の中心（候補の位置）に最も近い成分を星とする
+        offsets = centroids[1:] - np.array([cx - x0, cy - y0], dtype=np.float64)
+        label = 1 + int(np.argmin((offsets ** 2).sum(axis=1)))
+        left, top, w, h = stats[label, :4]
+        touches_edge = (
+            (left == 0 and x0 > 0) or (top == 0 and y0 > 0)
+            or (left + w == x1 - x0 and x1 < width) or (top + h == y1 - y0 and y1 < height)
+        )
+        if not touches_edge or radius >= max_radius:
+            break
+        radius = min(radius * 2, max_radius)
+    
+    component = labels == label
+    weights = signal[component]
+    ys, xs = np.nonzero(component)
+    centroid_x = x0 + float((xs * weights).sum() / weights.sum())
+    centroid_y = y0 + float((ys * weights).sum() / weights.sum())
+    
+    x, y = int(centroid_x), int(centroid_y)
+    x_min, x_max = max(0, x-2), min(width-1, x+2)
+    y_min, y_max = max(0, y-2), min(height-1, y+2)
+    brightness = np.mean(gray_image[y_min:y_max+1, x_min:x_max+1])
+    
+    return {
+        "x": x,
+        "y": y,
+        "brightness": brightness,
+        "area": float(stats[label, cv2.CC_STAT_AREA]),
+        "centroid_x": centroid_x,
+        "centroid_y": centroid_y
+    }
+
 def cluster_stars(stars: List[Dict[str, Any]], max_distance: int = 50, 
-                        min_stars: int = 3, max_stars: int = 12) -> List[List[Dict[str, Any]]]:
+                        min_stars: int = 3, max_stars: int = 12,
+                        engine: str = "grid") -> List[List[Dict[str, Any]]]:
     """
     星をクラスタリングして星座を形成するためのグループに分ける
+    最も明るい未割り当ての星を起点に、クラスタ内のいずれかの星から最も近い星を
+    max_distance 以内で順に追加していく
     
     Args:
         stars: 検出された星のリスト
         max_distance: 同じクラスタとみなす星間の最大距離
         min_stars: クラスタあたりの最小星数
         max_stars: クラスタあたりの最大星数
+        engine: クラスタリングの実装
+            "grid": 一様グリッドの近傍インデックスを使用する（デフォルト）
+            "greedy": 全ての星を総当たりで走査する従来の実装
+            "union_find": 半径内の星のペアを一括で求めて連結成分にまとめ、
+                max_stars を超える成分を空間的に分割する（近似、最も高速）
         
     Returns:
         クラスタリングされた星のリスト
     """
     if not stars:
-        default_stars = [
-            {"x": 100, "y": 100, "brightness": 200, "area": 10},
-            {"x": 200, "y": 150, "brightness": 180, "area": 8},
-            {"x": 300, "y": 200, "brightness": 220, "area": 12},
-            {"x": 400, "y": 250, "brightness": 190, "area": 9},
-            {"x": 500, "y": 300, "brightness": 210, "area": 11}
-        ]
-        return [default_stars]
+        return [_default_stars()]
+    
+    clusters = cluster_star_table(
+        StarTable.from_dicts(stars), max_distance=max_distance, min_stars=min_stars,
+        max_stars=max_stars, engine=engine
+    )
+    return [cluster.to_dicts() for cluster in clusters]
+
+def cluster_star_table(table: StarTable, max_distance: int = 50, min_stars: int = 3,
+                       max_stars: int = 12, engine: str = "grid") -> List[StarTable]:
+    """
+    星のテーブルをクラスタリングし、クラスタごとのテーブルを返す
+    各クラスタは1つの連続したテーブルのビューで、クラスタ内の星は明るい順に並ぶ
     
-    adaptive_min_stars = min(min_stars, max(2, len(stars) // 2))
+    Args:
+        table: 検出された星のテーブル
+        max_distance: 同じクラスタとみなす星間の最大距離
+        min_stars: クラスタあたりの最小星数
+        max_stars: クラスタあたりの最大星数
+        engine: クラスタリングの実装（cluster_starsを参照）
+        
+    Returns:
+        クラスタごとの星のテーブルのリスト
+    """
+    if len(table) == 0:
+        return [_default_star_table()]
+    
+    adaptive_min_stars = min(min_stars, max(2, len(table) // 2))
     logger.info(f"適応的な最小星数: {adaptive_min_stars}（元の設定: {min_stars}）")
     
-    sorted_stars = sorted(stars, key=lambda x: x["brightness"], reverse=True)
+    sorted_table = table.sorted_by_brightness()
+    xs = sorted_table.x.astype(np.float64)
+    ys = sorted_table.y.astype(np.float64)
+    
+    if engine == "greedy":
+        grown, assigned = _grow_clusters_greedy(xs, ys, max_distance, max_stars)
+    elif engine == "grid":
+        grown, assigned = _grow_clusters_grid(xs, ys, max_distance, max_stars)
+    elif engine == "union_find":
+        grown, assigned = _group_clusters_union_find(xs, ys, max_distance, max_stars)
+    else:
+        raise ValueError(f"未対応のクラスタリングエンジンです: {engine}")
+    
+    clusters = [cluster for cluster in grown if len(cluster) >= adaptive_min_stars]
+    
+    if not clusters and not all(assigned):
+        # テーブルは明るい順に並んでいるため、未割り当ての星も明るい順になる
+        unassigned = [i for i, is_assigned in enumerate(assigned) if not is_assigned]
+        if len(unassigned) >= 2:
+            clusters.append(unassigned[:min(max_stars, len(unassigned))])
+    
+    if not clusters:
+        logger.warning("クラスタが形成されなかったため、すべての星を1つのクラスタとして扱います")
+        clusters.append(list(range(min(max_stars, len(sorted_table)))))
+    
+    brightness = sorted_table.brightness
+    clusters = [
+        np.asarray(cluster, dtype=np.int64)[np.argsort(-brightness[cluster], kind="stable")]
+        for cluster in clusters
+    ]
+    
+    logger.info(f"{len(clusters)}個の星座クラスタを形成しました")
+    return group_clusters(sorted_table, clusters)
+
+def _grow_clusters_greedy(xs: np.ndarray, ys: np.ndarray, max_distance: float,
+                          max_stars: int) -> Tuple[List[List[int]], List[bool]]:
+    """
+    明るい順に並んだ星からクラスタを成長させる（総当たりの従来実装、O(n²·k)）
     
+    Args:
+        xs: 明るい順に並んだ星のx座標
+        ys: 明るい順に並んだ星のy座標
+        max_distance: 同じクラスタとみなす星間の最大距離
+        max_stars: クラスタあたりの最大星数
+        
+    Returns:
+        クラスタごとの星のインデックスのリストと、各星が割り当て済みかどうかのリスト
+    """
+    xs, ys = xs.tolist(), ys.tolist()
     clusters = []
-    assigned = [False] * len(sorted_stars)
+    assigned = [False] * len(xs)
     
-    for i, seed_star in enumerate(sorted_stars):
+    for i in range(len(xs)):
         if assigned[i]:
             continue
             
-        cluster = [seed_star]
+        cluster = [i]
         assigned[i] = True
         
         while len(cluster) < max_stars:
-            nearest_star = None
             min_dist = float('inf')
             nearest_idx = -1
             
-            for j, candidate in enumerate(sorted_stars):
+            for j in range(len(xs)):
                 if assigned[j]:
                     continue
                     
-                for s in cluster:
-                    dist = np.sqrt((s["x"] - candidate["x"])**2 + (s["y"] - candidate["y"])**2)
+                for k in cluster:
+                    dist = np.sqrt((xs[k] - xs[j])**2 + (ys[k] - ys[j])**2)
                     if dist < min_dist and dist <= max_distance:
                         min_dist = dist
-                        nearest_star = candidate
                         nearest_idx = j
             
-            if nearest_star is None:
+            if nearest_idx < 0:
                 break
                 
-            cluster.append(nearest_star)
+            cluster.append(nearest_idx)
             assigned[nearest_idx] = True
         
-        if len(cluster) >= adaptive_min_stars:
-            clusters.append(cluster)
+        clusters.append(cluster)
     
-    if not clusters and any(not a for a in assigned):
-        unassigned_stars = [star for i, star in enumerate(sorted_stars) if not assigned[i]]
-        unassigned_stars = sorted(unassigned_stars, key=lambda x: x["brightness"], reverse=True)
+    return clusters, assigned
+
+def _grow_clusters_grid(xs: np.ndarray, ys: np.ndarray, max_distance: float,
+                        max_stars: int) -> Tuple[List[List[int]], List[bool]]:
+    """
+    一様グリッドの近傍インデックスを使って、総当たりの実装と同じ結果になるようにクラスタを成長させる
+    
+    セルの大きさを max_distance にすると、ある星から max_distance 以内の星は周囲3x3のセルに収まる。
+    クラスタに星を追加するたびに近傍の未割り当ての星までの距離を更新し、ヒープから
+    （距離, インデックス）が最小の星を取り出すことで、総当たりと同じ順序で星を選ぶ。
+    
+    Args:
+        xs: 明るい順に並んだ星のx座標
+        ys: 明るい順に並んだ星のy座標
+        max_distance: 同じクラスタとみなす星間の最大距離
+        max_stars: クラスタあたりの最大星数
         
-        if len(unassigned_stars) >= 2:
-            new_cluster = unassigned_stars[:min(max_stars, len(unassigned_stars))]
-            clusters.append(new_cluster)
-            unassigned_stars = unassigned_stars[len(new_cluster):]
+    Returns:
+        クラスタごとの星のインデックスのリストと、各星が割り当て済みかどうかのリスト
+    """
+    count = len(xs)
+    assigned = np.zeros(count, dtype=bool)
     
-    if not clusters and stars:
-        logger.warning("クラスタが形成されなかったため、すべての星を1つのクラスタとして扱います")
-        clusters.append(sorted_stars[:min(max_stars, len(sorted_stars))])
+    cell_size = max(float(max_distance), 1.0)
+    cell_xs = np.floor(xs / cell_size).astype(np.int64)
+    cell_ys = np.floor(ys / cell_size).astype(np.int64)
+    cells: Dict[Tuple[int, int], List[int]] = {}
+    for i in range(count):
+        cells.setdefault((int(cell_xs[i]), int(cell_ys[i])), []).append(i)
+    grid = {cell: np.array(members, dtype=np.int64) for cell, members in cells.items()}
     
-    for i in range(len(clusters)):
-        clusters[i] = sorted(clusters[i], key=lambda x: x["brightness"], reverse=True)
+    def neighbors(i: int) -> Tuple[np.ndarray, np.ndarray]:
+        """星 i から max_distance 以内にある未割り当ての星のインデックスと距離を返す"""
+        cx, cy = int(cell_xs[i]), int(cell_ys[i])
+        candidates = [
+            grid[cell] for cell in (
+                (cx + dx, cy + dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1)
+            ) if cell in grid
+        ]
+        candidates = np.concatenate(candidates)
+        candidates = candidates[~assigned[candidates]]
+        distances = np.sqrt((xs[i] - xs[candidates])**2 + (ys[i] - ys[candidates])**2)
+        within = distances <= max_distance
+        return candidates[within], distances[within]
     
-    logger.info(f"{len(clusters)}個の星座クラスタを形成しました")
-    return clusters
+    clusters = []
+    for seed in range(count):
+        if assigned[seed]:
+            continue
+        
+        cluster = [seed]
+        assigned[seed] = True
+        best: Dict[int, float] = {}
+        frontier: List[Tuple[float, int]] = []
+        
+        def absorb(i: int) -> None:
+            for j, dist in zip(*neighbors(i)):
+                j, dist = int(j), float(dist)
+                if dist < best.get(j, float('inf')):
+                    best[j] = dist
+                    heapq.heappush(frontier, (dist, j))
+        
+        absorb(seed)
+        while len(cluster) < max_stars:
+            nearest_idx = -1
+            while frontier:
+                dist, j = heapq.heappop(frontier)
+                if not assigned[j] and best[j] == dist:
+                    nearest_idx = j
+                    break
+            
+            if nearest_idx < 0:
+                break
+            
+            cluster.append(nearest_idx)
+            assigned[nearest_idx] = True
+            absorb(nearest_idx)
+        
+        clusters.append(cluster)
+    
+    return clusters, assigned.tolist()
+
+def _radius_pairs(xs: np.ndarray, ys: np.ndarray, max_distance: float) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    互いの距離が max_distance 以内の星のペアを一括で求める
+    星を一様グリッドのセル順に並べ、各セルと隣接する半分のセル（自身・右上・右・右下・上）の
+    星の範囲を searchsorted で求めて展開するため、距離行列全体を作らずに済む
+    
+    Args:
+        xs: 星のx座標
+        ys: 星のy座標
+        max_distance: 最大距離
+        
+    Returns:
+        ペアの一方のインデックスと、もう一方のインデックスの配列（各ペアは1回ずつ現れる）
+    """
+    count = len(xs)
+    cell_size = max(float(max_distance), 1.0)
+    cell_xs = np.floor(xs / cell_size).astype(np.int64)
+    cell_ys = np.floor(ys / cell_size).astype(np.int64)
+    cell_xs -= cell_xs.min() - 1
+    cell_ys -= cell_ys.min() - 1
+    # 隣接セルのキーが別の列に回り込まないように上下に1セルずつ余白を取る
+    height = int(cell_ys.max()) + 2
+    keys = cell_xs * height + cell_ys
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+    
+    limit = float(max_distance) ** 2
+    indices = np.arange(count)
+    lefts, rights = [], []
+    for dx, dy in ((0, 0), (1, -1), (1, 0), (1, 1), (0, 1)):
+        targets = keys + dx * height + dy
+        starts = np.searchsorted(sorted_keys, targets, side="left")
+        counts = np.searchsorted(sorted_keys, targets, side="right") - starts
+        total = int(counts.sum())
+        if total == 0:
+            continue
+        left = np.repeat(indices, counts)
+        offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+        right = order[np.repeat(starts, counts) + offsets]
+        if dx == 0 and dy == 0:
+            keep = right > left
+            left, right = left[keep], right[keep]
+        ddx = xs[left] - xs[right]
+        ddy = ys[left] - ys[right]
+        within = ddx * ddx + ddy * ddy <= limit
+        lefts.append(left[within])
+        rights.append(right[within])
+    
+    if not lefts:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty
+    return np.concatenate(lefts), np.concatenate(rights)
+
+def _connected_components(count: int, lefts: np.ndarray, rights: np.ndarray) -> np.ndarray:
+    """
+    ペアのリストから連結成分を求める（ベクトル化したunion-find）
+    辺の両端のラベルを小さい方に揃える操作と、ポインタジャンプによる経路圧縮を収束するまで繰り返す
+    
+    Args:
+        count: 頂点の数
+        lefts: 辺の一方の頂点
+        rights: 辺のもう一方の頂点
+        
+    Returns:
+        各頂点の成分ラベル（成分内で最小のインデックス）
+    """
+    labels = np.arange(count, dtype=np.int64)
+    while True:
+        low = np.minimum(labels[lefts], labels[rights])
+        updated = labels.copy()
+        np.minimum.at(updated, labels[lefts], low)
+        np.minimum.at(updated, labels[rights], low)
+        while True:
+            jumped = updated[updated]
+            if np.array_equal(jumped, updated):
+                break
+            updated = jumped
+        if np.array_equal(updated, labels):
+            return labels
+        labels = updated
+
+def _split_component(members: np.ndarray, xs: np.ndarray, ys: np.ndarray,
+                     max_stars: int) -> List[np.ndarray]:
+    """
+    max_stars を超える連結成分を、広がりの大きい軸で再帰的に二分して星座の大きさに分割する
+    各グループの星数は max_stars 以下、かつ max_stars の半分程度以上になる
+    
+    Args:
+        members: 成分に含まれる星のインデックス
+        xs: 星のx座標
+        ys: 星のy座標
+        max_stars: グループあたりの最大星数
+        
+    Returns:
+        グループごとの星のインデックスの配列のリスト
+    """
+    if len(members) <= max_stars:
+        return [members]
+    
+    groups = -(-len(members) // max_stars)
+    left_size = int(round(len(members) * (groups // 2) / groups))
+    member_xs, member_ys = xs[members], ys[members]
+    coords = member_xs if np.ptp(member_xs) >= np.ptp(member_ys) else member_ys
+    order = np.argsort(coords, kind="stable")
+    return (
+        _split_component(np.sort(members[order[:left_size]]), xs, ys, max_stars)
+        + _split_component(np.sort(members[order[left_size:]]), xs, ys, max_stars)
+    )
+
+def _group_clusters_union_find(xs: np.ndarray, ys: np.ndarray, max_distance: float,
+                               max_stars: int) -> Tuple[List[List[int]], List[bool]]:
+    """
+    半径内の星のペアを一括で求め、連結成分ごとにクラスタを作る
+    
+    総当たりの実装とは異なり星の選び方は近似になるが、Pythonのループは
+    max_stars を超える成分の分割にしか現れない。
+    クラスタは最も明るい星の順に並び、各クラスタ内の星は明るい順になる。
+    
+    Args:
+        xs: 明るい順に並んだ星のx座標
+        ys: 明るい順に並んだ星のy座標
+        max_distance: 同じクラスタとみなす星間の最大距離
+        max_stars: クラスタあたりの最大星数
+        
+    Returns:
+        クラスタごとの星のインデックスのリストと、各星が割り当て済みかどうかのリスト
+    """
+    count = len(xs)
+    
+    lefts, rights = _radius_pairs(xs, ys, max_distance)
+    labels = _connected_components(count, lefts, rights)
+    
+    # ラベルは成分内で最も明るい星のインデックスなので、安定ソートで明るい順の成分に分かれる
+    order = np.argsort(labels, kind="stable")
+    boundaries = np.flatnonzero(np.diff(labels[order])) + 1
+    
+    clusters = []
+    for members in np.split(order, boundaries):
+        for group in _split_component(members, xs, ys, max_stars):
+            clusters.append(group.tolist())
+    clusters.sort(key=lambda cluster: cluster[0])
+    
+    return clusters, [True] * count
+
+@dataclass
+class StarField:
+    """
+    1枚の画像に対する星検出とクラスタリングの結果
+    リクエストごとに1回だけ計算し、描画・クラスタマッチング・APIレスポンスで共有する
+    
+    Attributes:
+        stars: 検出された星のテーブル（明るい順）
+        clusters: クラスタごとの星のテーブル（1つの連続したテーブルのビュー、クラスタ内は明るい順）
+        min_stars: 星座あたりの最小星数
+        max_distance: 同じ星座とみなす星間の最大距離
+        max_stars: クラスタあたりの最大星数
+        image_size: 検出に使用した画像のサイズ（幅, 高さ）
+    """
+    stars: StarTable
+    clusters: List[StarTable]
+    min_stars: int = 3
+    max_distance: int = 50
+    max_stars: int = 12
+    image_size: Optional[Tuple[int, int]] = None
+    
+    @property
+    def constellation_points(self) -> List[List[Tuple[int, int]]]:
+        """描画用の星座の点群（クラスタごとの座標リスト）"""
+        return clusters_to_points(self.clusters, min_stars=self.min_stars)
+
+def compute_star_field(image: Union[str, np.ndarray], min_stars: int = 3, max_distance: int = 50,
+                       max_stars: int = 12, threshold: Optional[int] = None, min_area: int = 5,
+                       use_adaptive_threshold: bool = True,
+                       use_blob_detection: bool = True, max_detected: int = 200,
+                       cluster_engine: str = "grid", detection_mode: str = "single",
+                       tile_size: int = 1024, tile_workers: Optional[int] = None,
+                       pyramid_size: int = 1024,
+                       render_size: Optional[Tuple[int, int]] = None,
+                       timings: Optional[Dict[str, float]] = None) -> StarField:
+    """
+    画像から星を検出してクラスタリングし、結果をStarFieldにまとめる
+    
+    Args:
+        image: 処理する画像のパス、またはメモリ上の画像配列
+        min_stars: 星座あたりの最小星数
+        max_distance: 同じ星座とみなす星間の最大距離
+        max_stars: クラスタあたりの最大星数
+        threshold: 白色を検出するための閾値（0-255）、Noneの場合は自動設定
+        min_area: 星として認識する最小面積
+        use_adaptive_threshold: 適応的閾値処理を使用するかどうか
+        use_blob_detection: Blob検出を使用するかどうか
+        max_detected: 検出する星の最大数（明るい順）
+        cluster_engine: クラスタリングの実装（cluster_starsのengineを参照）
+        detection_mode: 星検出の方法（detect_stars_in_imageのmodeを参照）
+        tile_size: "tiled"の場合のタイルの一辺の長さ
+        tile_workers: "tiled"の場合の並列数（Noneの場合はCPUコア数）
+        pyramid_size: "pyramid"の場合に候補を探す縮小画像の長辺の長さ
+        render_size: 描画に使用する画像のサイズ（幅, 高さ）。検出した画像と異なる場合は
+            星の座標と面積をこのサイズに合わせてからクラスタリングする
+        timings: 星検出（detect）とクラスタリング（cluster）の時間を記録する辞書
+            （Noneの場合は処理中のリクエストに記録する、timed_stageを参照）
+        
+    Returns:
+        星検出とクラスタリングの結果
+    """
+    detection_params = {
+        "threshold": threshold,
+        "min_area": min_area,
+        "use_adaptive_threshold": use_adaptive_threshold,
+        "use_blob_detection": use_blob_detection,
+        "max_detected": max_detected,
+        "mode": detection_mode,
+        "tile_size": tile_size,
+        "tile_workers": tile_workers,
+        "pyramid_size": pyramid_size
+    }
+    
+    image_size = None
+    with timed_stage("detect", timings):
+        if isinstance(image, str):
+            stars = StarTable.from_dicts(detect_stars(image, **detection_params))
+        else:
+            stars = detect_star_table(image, **detection_params)
+            image_size = (image.shape[1], image.shape[0])
+            
+            if render_size is not None and render_size != image_size:
+                if not stars.equals(_default_star_table()):
+                    stars = stars.scaled(render_size[0] / image_size[0], render_size[1] / image_size[1])
+                image_size = render_size
+    
+    with timed_stage("cluster", timings):
+        clusters = cluster_star_table(
+            stars, 
+            max_distance=max_distance, 
+            min_stars=min_stars,
+            max_stars=max_stars,
+            engine=cluster_engine
+        )
+    
+    return StarField(
+        stars=stars,
+        clusters=clusters,
+        min_stars=min_stars,
+        max_distance=max_distance,
+        max_stars=max_stars,
+        image_size=image_size
+    )
+
+def scale_stars(stars: List[Dict[str, Any]], scale_x: float, scale_y: float) -> List[Dict[str, Any]]:
+    """
+    星の座標と面積を別の解像度の画像に合わせて変換する
+    
+    Args:
+        stars: 辞書形式の星のリスト
+        scale_x: x方向の倍率
+        scale_y: y方向の倍率
+        
+    Returns:
+        変換後の星のリスト
+    """
+    return StarTable.from_dicts(stars).scaled(scale_x, scale_y).to_dicts()
 
 def get_constellation_points(image_path: str, min_stars: int = 3, 
                                    max_distance: int = 50) -> List[List[Tuple[int, int]]]:
@@ -409,22 +1210,28 @@ def get_constellation_points(image_path: str, min_stars: int = 3,
     Returns:
         星座の点群（クラスタごとの座標リスト）
     """
-    stars = detect_stars(
-        image_path, 
-        use_adaptive_threshold=True, 
-        use_blob_detection=True
-    )
-    
-    clusters = cluster_stars(
-        stars, 
-        max_distance=max_distance, 
-        min_stars=min_stars
-    )
+    star_field = compute_star_field(image_path, min_stars=min_stars, max_distance=max_distance)
+    return star_field.constellation_points
+
+def clusters_to_points(clusters: List[Union[StarTable, List[Dict[str, Any]]]], 
+                       min_stars: int = 3) -> List[List[Tuple[int, int]]]:
+    """
+    星のクラスタを描画用の点群に変換する
     
+    Args:
+        clusters: 星のクラスタのリスト（StarTableまたは辞書形式の星のリスト）
+        min_stars: 星座あたりの最小星数
+        
+    Returns:
+        星座の点群（クラスタごとの座標リスト）
+    """
     constellation_points = []
     for cluster in clusters:
         if len(cluster) >= min_stars:
-            points = [(star["x"], star["y"]) for star in cluster]
+            if isinstance(cluster, StarTable):
+                points = cluster.points()
+            else:
+                points = [(star["x"], star["y"]) for star in cluster]
             constellation_points.append(points)
     
     if len(constellation_points) == 0:
@@ -437,24 +1244,29 @@ def get_constellation_points(image_path: str, min_stars: int = 3,
     
     return constellation_points
 
-def calculate_matching_score(features: dict, cluster: list) -> float:
+def calculate_matching_score(features: dict, cluster: Union[StarTable, List[Dict[str, Any]]]) -> float:
     """
     星座の特徴とクラスタのマッチングスコアを計算する
     
     Args:
         features: 星座の特徴
-        cluster: 星のクラスタ
+        cluster: 星のクラスタ（StarTableまたは辞書形式の星のリスト）
         
     Returns:
         マッチングスコア（0-1の範囲）
     """
+    if not isinstance(cluster, StarTable):
+        cluster = StarTable.from_dicts(cluster)
+    xs = cluster.x.astype(np.float64)
+    ys = cluster.y.astype(np.float64)
+    
     score = 0.0
     
     star_count_match = min(len(cluster) / features["star_count"], 
                           features["star_count"] / len(cluster))
     score += star_count_match * 0.3
     
-    avg_brightness = sum(star["brightness"] for star in cluster) / len(cluster)
+    avg_brightness = float(cluster.brightness.mean())
     if features["brightness"] == "high" and avg_brightness > 200:
         score += 0.2
     elif features["brightness"] == "medium" and 100 <= avg_brightness <= 200:
@@ -463,52 +1275,48 @@ def calculate_matching_score(features: dict, cluster: list) -> float:
         score += 0.2
     
     if features["pattern"] == "scattered":
-        xs = [star["x"] for star in cluster]
-        ys = [star["y"] for star in cluster]
         if len(cluster) >= 5 and np.std(xs) > 50 and np.std(ys) > 50:
             score += 0.2
     elif features["pattern"] == "linear":
-        xs = [star["x"] for star in cluster]
-        ys = [star["y"] for star in cluster]
         if len(cluster) >= 3:
             try:
                 from sklearn.linear_model import LinearRegression
-                X = np.array(xs).reshape(-1, 1)
-                y = np.array(ys)
-                model = LinearRegression().fit(X, y)
-                r2 = model.score(X, y)
+                X = xs.reshape(-1, 1)
+                model = LinearRegression().fit(X, ys)
+                r2 = model.score(X, ys)
                 if r2 > 0.7:  # R^2が0.7以上なら線形と見なす
                     score += 0.2
             except:
-                if len(cluster) >= 3:
-                    x1, y1 = xs[0], ys[0]
-                    x2, y2 = xs[-1], ys[-1]
-                    distances = []
-                    for i in range(1, len(xs) - 1):
-                        numerator = abs((y2-y1)*xs[i] - (x2-x1)*ys[i] + x2*y1 - y2*x1)
-                        denominator = ((y2-y1)**2 + (x2-x1)**2)**0.5
-                        distance = numerator / denominator if denominator != 0 else 0
-                        distances.append(distance)
-                    if sum(distances) / len(distances) < 20:  # 平均距離が小さければ線形と見なす
-                        score += 0.2
+                # 両端の星を結ぶ直線から、間の星までの距離の平均を求める
+                x1, y1 = xs[0], ys[0]
+                x2, y2 = xs[-1], ys[-1]
+                denominator = ((y2-y1)**2 + (x2-x1)**2)**0.5
+                if denominator != 0:
+                    numerator = np.abs((y2-y1)*xs[1:-1] - (x2-x1)*ys[1:-1] + x2*y1 - y2*x1)
+                    distances = numerator / denominator
+                else:
+                    distances = np.zeros(len(xs) - 2)
+                if distances.mean() < 20:  # 平均距離が小さければ線形と見なす
+                    score += 0.2
     elif features["pattern"] == "dense":
         if len(cluster) >= 5:
-            xs = [star["x"] for star in cluster]
-            ys = [star["y"] for star in cluster]
             if np.std(xs) < 30 and np.std(ys) < 30:
                 score += 0.2
     
     
     return min(score, 1.0)
 
-def match_constellation_with_clusters(name: str, story: str, clusters: List[List[Dict[str, Any]]]) -> Optional[int]:
+def match_constellation_with_clusters(name: str, story: str,
+                                      clusters: List[Union[StarTable, List[Dict[str, Any]]]],
+                                      features: Optional[dict] = None) -> Optional[int]:
     """
     星座名とストーリーから最適なクラスタを選択する
     
     Args:
         name: 星座名
         story: 星座のストーリー
-        clusters: 星のクラスタのリスト
+        clusters: 星のクラスタのリスト（StarTableまたは辞書形式の星のリスト）
+        features: 星座の特徴（Noneの場合は星座名とストーリーから抽出する）
         
     Returns:
         最適なクラスタのインデックス、クラスタが空の場合でもデフォルト値0を返す
@@ -520,7 +1328,8 @@ def match_constellation_with_clusters(name: str, story: str, clusters: List[List
     from app.services.openai_service import extract_constellation_features
     
     try:
-        features = extract_constellation_features(name, story)
+        if features is None:
+            features = extract_constellation_features(name, story)
         
         scores = []
         for i, cluster in enumerate(clusters):
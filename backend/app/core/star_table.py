@@ -0,0 +1,247 @@
+import logging
+from typing import List, Dict, Any, Iterable, Optional, Sequence, Tuple
+
+import numpy as np
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 1個の星のレコード（56バイト）。centroid_x/centroid_y はサブピクセルの重心、
+# peak は最も明るい画素の値、flux は星の領域の画素値の合計で、いずれも不明な場合はNaN
+STAR_DTYPE = np.dtype([
+    ("x", np.int32),
+    ("y", np.int32),
+    ("brightness", np.float64),
+    ("area", np.float64),
+    ("centroid_x", np.float64),
+    ("centroid_y", np.float64),
+    ("peak", np.float64),
+    ("flux", np.float64)
+])
+
+# 検出方法によっては値が分からない列（NaNの値は to_dicts() で出力しない）
+OPTIONAL_FIELDS = ("centroid_x", "centroid_y", "peak", "flux")
+
+class StarTable:
+    """
+    星のリストを列ごとに保持するテーブル（NumPyの構造化配列）
+
+    星を1個ずつ辞書で持つ代わりに x, y, brightness, area などの列を連続したメモリに保持し、
+    列単位のベクトル演算とスライスによるコピーなしの部分テーブルを可能にする。
+    APIレスポンスなどで従来の辞書形式が必要な場合だけ to_dicts() で変換する。
+    """
+
+    __slots__ = ("data",)
+
+    def __init__(self, data: Optional[np.ndarray] = None):
+        """
+        Args:
+            data: STAR_DTYPE の構造化配列（Noneの場合は空のテーブル）
+        """
+        self.data = np.zeros(0, dtype=STAR_DTYPE) if data is None else data
+
+    @classmethod
+    def from_columns(cls, x: Iterable[float], y: Iterable[float], brightness: Iterable[float],
+                     area: Iterable[float], centroid_x: Optional[Iterable[float]] = None,
+                     centroid_y: Optional[Iterable[float]] = None,
+                     peak: Optional[Iterable[float]] = None,
+                     flux: Optional[Iterable[float]] = None) -> "StarTable":
+        """
+        列の配列からテーブルを作成する
+
+        Args:
+            x: x座標（整数に切り捨てる）
+            y: y座標（整数に切り捨てる）
+            brightness: 明るさ
+            area: 面積
+            centroid_x: サブピクセルの重心のx座標（Noneの場合はNaN）
+            centroid_y: サブピクセルの重心のy座標（Noneの場合はNaN）
+            peak: 最も明るい画素の値（Noneの場合はNaN）
+            flux: 星の領域の画素値の合計（Noneの場合はNaN）
+
+        Returns:
+            作成したテーブル
+        """
+        x = np.asarray(x)
+        data = np.zeros(len(x), dtype=STAR_DTYPE)
+        data["x"] = x
+        data["y"] = np.asarray(y)
+        data["brightness"] = np.asarray(brightness)
+        data["area"] = np.asarray(area)
+        for name, column in zip(OPTIONAL_FIELDS, (centroid_x, centroid_y, peak, flux)):
+            data[name] = np.nan if column is None else np.asarray(column)
+        return cls(data)
+
+    @classmethod
+    def from_dicts(cls, stars: Sequence[Dict[str, Any]]) -> "StarTable":
+        """
+        従来の辞書形式の星のリストからテーブルを作成する
+
+        Args:
+            stars: "x", "y", "brightness", "area"（任意で "centroid_x", "centroid_y", "peak", "flux"）を持つ辞書のリスト
+
+        Returns:
+            作成したテーブル
+        """
+        data = np.zeros(len(stars), dtype=STAR_DTYPE)
+        for i, star in enumerate(stars):
+            data[i] = (
+                star["x"], star["y"], star["brightness"], star["area"],
+                *(star.get(name, np.nan) for name in OPTIONAL_FIELDS)
+            )
+        return cls(data)
+
+    @classmethod
+    def concatenate(cls, tables: Sequence["StarTable"]) -> "StarTable":
+        """複数のテーブルを連結する"""
+        if not tables:
+            return cls()
+        return cls(np.concatenate([table.data for table in tables]))
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def __getitem__(self, index: Any) -> "StarTable":
+        """
+        部分テーブルを返す
+        スライスの場合は元のテーブルと同じメモリを参照するビューになる
+        """
+        if isinstance(index, (int, np.integer)):
+            index = slice(index, index + 1 if index != -1 else None)
+        return StarTable(self.data[index])
+
+    def __repr__(self) -> str:
+        return f"StarTable({len(self)} stars)"
+
+    def __getstate__(self) -> Tuple[np.ndarray]:
+        return (self.data,)
+
+    def __setstate__(self, state: Tuple[np.ndarray]) -> None:
+        data = state[0]
+        if data.dtype != STAR_DTYPE:
+            # 列が少ない古い形式（ディスクキャッシュなど）は、足りない列をNaNにして読み込む
+            upgraded = np.zeros(len(data), dtype=STAR_DTYPE)
+            for name in OPTIONAL_FIELDS:
+                upgraded[name] = np.nan
+            for name in data.dtype.names:
+                upgraded[name] = data[name]
+            data = upgraded
+        self.data = data
+
+    @property
+    def x(self) -> np.ndarray:
+        return self.data["x"]
+
+    @property
+    def y(self) -> np.ndarray:
+        return self.data["y"]
+
+    @property
+    def brightness(self) -> np.ndarray:
+        return self.data["brightness"]
+
+    @property
+    def area(self) -> np.ndarray:
+        return self.data["area"]
+
+    @property
+    def centroid_x(self) -> np.ndarray:
+        return self.data["centroid_x"]
+
+    @property
+    def centroid_y(self) -> np.ndarray:
+        return self.data["centroid_y"]
+
+    @property
+    def peak(self) -> np.ndarray:
+        return self.data["peak"]
+
+    @property
+    def flux(self) -> np.ndarray:
+        return self.data["flux"]
+
+    @property
+    def nbytes(self) -> int:
+        return self.data.nbytes
+
+    def equals(self, other: "StarTable") -> bool:
+        """2つのテーブルの内容が同じかどうかを返す（NaNどうしは等しいとみなす）"""
+        return len(self) == len(other) and all(
+            np.array_equal(self.data[name], other.data[name], equal_nan=(name in OPTIONAL_FIELDS))
+            for name in STAR_DTYPE.names
+        )
+
+    def take(self, indices: Sequence[int]) -> "StarTable":
+        """指定したインデックスの星を、その順序で並べたテーブルを返す（コピー）"""
+        return StarTable(self.data[np.asarray(indices, dtype=np.int64)])
+
+    def sorted_by_brightness(self) -> "StarTable":
+        """明るい順に並べたテーブルを返す（明るさが同じ星は元の順序を保つ）"""
+        return self.take(np.argsort(-self.brightness, kind="stable"))
+
+    def scaled(self, scale_x: float, scale_y: float) -> "StarTable":
+        """
+        座標と面積を別の解像度の画像に合わせて変換したテーブルを返す
+
+        Args:
+            scale_x: x方向の倍率
+            scale_y: y方向の倍率
+
+        Returns:
+            変換後のテーブル
+        """
+        data = self.data.copy()
+        data["x"] = (self.x * scale_x).astype(np.int32)
+        data["y"] = (self.y * scale_y).astype(np.int32)
+        data["area"] = self.area * scale_x * scale_y
+        data["centroid_x"] = self.centroid_x * scale_x
+        data["centroid_y"] = self.centroid_y * scale_y
+        return StarTable(data)
+
+    def points(self) -> List[Tuple[int, int]]:
+        """描画用の座標のリストを返す"""
+        return list(zip(self.x.tolist(), self.y.tolist()))
+
+    def to_dicts(self, fields: Optional[Sequence[str]] = None) -> List[Dict[str, Any]]:
+        """
+        従来の辞書形式の星のリストに変換する（APIレスポンスなどの境界でのみ使用する）
+
+        Args:
+            fields: 出力する列（Noneの場合は x, y, brightness, area と、値が分かっている任意の列）
+
+        Returns:
+            辞書形式の星のリスト（任意の列のうちNaNの値は出力しない）
+        """
+        if fields is None:
+            fields = ["x", "y", "brightness", "area"]
+            optional = [name for name in OPTIONAL_FIELDS if not np.isnan(self.data[name]).all()]
+        else:
+            optional = [name for name in fields if name in OPTIONAL_FIELDS]
+            fields = [name for name in fields if name not in OPTIONAL_FIELDS]
+        columns = [self.data[name].tolist() for name in fields]
+        stars = [dict(zip(fields, row)) for row in zip(*columns)]
+        for name in optional:
+            for star, value in zip(stars, self.data[name].tolist()):
+                if value == value:  # NaNでない
+                    star[name] = value
+        return stars
+
+def group_clusters(table: StarTable, clusters: Sequence[Sequence[int]]) -> List[StarTable]:
+    """
+    インデックスのリストで表したクラスタを、1つの連続したテーブルのビューに変換する
+
+    クラスタの順に並べ替えたテーブルを1回だけ作成し、各クラスタはそのスライスとして返すため、
+    クラスタごとのコピーは発生しない。
+
+    Args:
+        table: 星のテーブル
+        clusters: クラスタごとの星のインデックスのリスト
+
+    Returns:
+        クラスタごとのテーブル（ビュー）のリスト
+    """
+    if not clusters:
+        return []
+    ordered = table.take(np.concatenate([np.asarray(cluster, dtype=np.int64) for cluster in clusters]))
+    offsets = np.cumsum([0] + [len(cluster) for cluster in clusters])
+    return [ordered[int(start):int(stop)] for start, stop in zip(offsets[:-1], offsets[1:])]
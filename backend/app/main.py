@@ -1,19 +1,118 @@
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse, HTMLResponse
+from fastapi.responses import FileResponse, HTMLResponse, StreamingResponse, Response
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
-from typing import Optional, Union
+from typing import List, Optional, Union
 from dotenv import load_dotenv
+import asyncio
+import json
 import logging
+import mimetypes
 import os
 import shutil
+import tempfile
+import threading
+import uuid
 
-from app.core.star_detection import get_constellation_points, detect_stars, cluster_stars, match_constellation_with_clusters
-from app.core.constellation import draw_constellation_lines
-from app.core.image_processing import validate_image, save_uploaded_image, optimize_image
+from app.core.star_detection import compute_star_field, match_constellation_with_clusters
+from app.core.constellation import draw_constellation_lines, available_output_formats, OUTPUT_FORMATS, QUALITY_TIERS
+from app.core.image_processing import (
+    validate_image, save_uploaded_image, optimize_image, decoder_registry, DecodeRecord, DecodeStats
+)
+from app.core.pipeline import (
+    run_constellation_pipeline, detect_constellation_stars, render_constellation_image, RENDER_PARAMS, OUTPUT_PARAMS,
+    OUTPUT_MODES
+)
+from app.core.image_variants import ImageVariantCache, negotiate_image_format, encode_image_variant
+from app.core.image_index import ImageIndex, etag_matches, parse_range, IMMUTABLE_CACHE_CONTROL
+from app.core.artifact_store import ArtifactStore
+from app.core.executor import PipelineExecutor, PipelineBusyError
+from app.core.metrics import (
+    MetricsRegistry, RequestMetrics, MetricsMiddleware, timed_stage, record_stages, PROMETHEUS_CONTENT_TYPE
+)
+
+from app.services.openai_service import (
+    generate_constellation_name, generate_constellation_story, generate_constellation_profile,
+    stream_constellation_story, extract_constellation_features, llm_cache
+)
+from app.services.llm_cache import normalize_keyword
+
+def generate_constellation_content(keyword):
+    """
+    キーワードから星座名、ストーリー、星座の特徴を生成する
+    
+    Args:
+        keyword: 星座生成に使用するキーワード
+        
+    Returns:
+        星座名、ストーリー、特徴（sequentialモードの場合はNone）のタプル
+    """
+    if OPENAI_GENERATION_MODE == "combined":
+        print(f"星座名・ストーリー・特徴の生成を開始します: キーワード「{keyword}」")
+        with timed_stage("llm_profile"):
+            profile = generate_constellation_profile(keyword)
+        name, story, features = split_constellation_profile(profile)
+        print(f"星座名・ストーリー・特徴が生成されました: {name}")
+    else:
+        print(f"星座名の生成を開始します: キーワード「{keyword}」")
+        with timed_stage("llm_name"):
+            name = generate_constellation_name(keyword)
+        print(f"星座名が生成されました: {name}")
+        
+        print("星座ストーリーの生成を開始します")
+        with timed_stage("llm_story"):
+            story = generate_constellation_story(name, keyword)
+        print("星座ストーリーが生成されました")
+        features = None
+    
+    return name, story, features
 
-from app.services.openai_service import generate_constellation_name, generate_constellation_story
+def split_constellation_profile(profile):
+    """
+    generate_constellation_profile の結果を星座名、ストーリー、星座の特徴に分ける
+    
+    Args:
+        profile: name, story と星座の特徴を含む辞書
+        
+    Returns:
+        星座名、ストーリー、特徴のタプル
+    """
+    features = {key: profile[key] for key in ("shape", "star_count", "brightness", "pattern")}
+    return profile["name"], profile["story"], features
+
+def fallback_constellation_text():
+    """
+    テキスト生成に失敗した場合のデフォルトの星座名とストーリーを返す
+    
+    Returns:
+        星座名とストーリーのタプル
+    """
+    print("エラー発生時のフォールバック: デフォルトの名前とストーリーを使用します")
+    return "未知の星座", "この星座の物語は古来より語り継がれてきましたが、詳細は時間の流れとともに失われてしまいました。"
+
+def generate_constellation_text(keyword, clusters):
+    """
+    キーワードから星座名とストーリーを生成し、最適なクラスタを選択する
+    
+    Args:
+        keyword: 星座生成に使用するキーワード
+        clusters: 星のクラスタのリスト
+        
+    Returns:
+        星座名、ストーリー、選択されたクラスタインデックスのタプル
+    """
+    try:
+        name, story, features = generate_constellation_content(keyword)
+        selected_cluster_index = match_constellation_with_clusters(name, story, clusters, features=features)
+        print(f"選択されたクラスタインデックス: {selected_cluster_index}")
+    except Exception as openai_error:
+        print(f"OpenAI APIでのテキスト生成中にエラーが発生しました: {openai_error}")
+        name, story = fallback_constellation_text()
+        selected_cluster_index = None
+    
+    return name, story, selected_cluster_index
 
 def process_image_and_generate_constellation(image_path, keyword):
     """
@@ -30,12 +129,14 @@ def process_image_and_generate_constellation(image_path, keyword):
         with open(image_path, "rb") as f:
             content = f.read()
         
-        is_valid = validate_image(content)
+        with timed_stage("validate"):
+            is_valid = validate_image(content)
         if not is_valid:
             raise ValueError("無効な画像形式です。JPG、PNG、AVIF、HEICなどの画像形式をお試しください。")
         
         try:
-            optimized_image_path = optimize_image(image_path)
+            with timed_stage("optimize"):
+                optimized_image_path = optimize_image(image_path, decode_stats=decode_stats)
             print(f"画像を最適化しました: {optimized_image_path}")
         except Exception as optimize_error:
             print(f"画像の最適化中にエラーが発生しました: {optimize_error}")
@@ -43,41 +144,18 @@ def process_image_and_generate_constellation(image_path, keyword):
             print(f"最適化に失敗したため、元の画像を使用します: {image_path}")
         
         print(f"星検出を開始します: {optimized_image_path}")
-        constellation_points = get_constellation_points(optimized_image_path)
-        print(f"星検出が完了しました: {len(constellation_points)}個のクラスタを検出")
-        
-        # 星のクラスタを取得
-        stars = detect_stars(
-            optimized_image_path, 
-            use_adaptive_threshold=True, 
-            use_blob_detection=True
-        )
-        clusters = cluster_stars(stars, max_distance=50, min_stars=3, max_stars=12)
-        print(f"クラスタリングが完了しました: {len(clusters)}個のクラスタを形成")
+        star_field = compute_star_field(optimized_image_path, min_stars=3, max_distance=50, max_stars=12)
+        print(f"星検出が完了しました: {len(star_field.stars)}個の星を検出")
+        print(f"クラスタリングが完了しました: {len(star_field.clusters)}個のクラスタを形成")
         
         print("星座の生成を開始します")
-        constellation_result = draw_constellation_lines(optimized_image_path, constellation_points)
+        with timed_stage("draw"):
+            constellation_result = draw_constellation_lines(optimized_image_path, star_field.constellation_points, **RENDER_PARAMS, **OUTPUT_PARAMS)
         constellation_image_path = constellation_result["image_path"]
         constellation_data = constellation_result["constellation_data"]
         print(f"星座の生成が完了しました: {constellation_image_path}")
         
-        try:
-            print(f"星座名の生成を開始します: キーワード「{keyword}」")
-            name = generate_constellation_name(keyword)
-            print(f"星座名が生成されました: {name}")
-            
-            print("星座ストーリーの生成を開始します")
-            story = generate_constellation_story(name, keyword)
-            print("星座ストーリーが生成されました")
-            
-            selected_cluster_index = match_constellation_with_clusters(name, story, clusters)
-            print(f"選択されたクラスタインデックス: {selected_cluster_index}")
-        except Exception as openai_error:
-            print(f"OpenAI APIでのテキスト生成中にエラーが発生しました: {openai_error}")
-            name = "未知の星座"
-            story = "この星座の物語は古来より語り継がれてきましたが、詳細は時間の流れとともに失われてしまいました。"
-            selected_cluster_index = None
-            print("エラー発生時のフォールバック: デフォルトの名前とストーリーを使用します")
+        name, story, selected_cluster_index = generate_constellation_text(keyword, star_field.clusters)
         
         return {
             "constellation_name": name,
@@ -100,10 +178,495 @@ def process_image_and_generate_constellation(image_path, keyword):
             "selected_cluster_index": None
         }
 
+async def process_image_bytes_and_generate_constellation(content, keyword, output="image"):
+    """
+    アップロードされた画像のバイト列から一時ファイルを介さずに星座を生成する統合関数
+    画像処理はワーカープールで、テキスト生成はスレッドプールで実行し、イベントループをブロックしない
+    
+    Args:
+        content: アップロードされた画像のバイト内容
+        keyword: 星座生成に使用するキーワード
+        output: パイプラインの出力（"image", "svg", "vectors"）
+        
+    Returns:
+        星座データを含む辞書（"svg"と"vectors"の場合は画像のパスの代わりに overlay を含む）
+        
+    Raises:
+        PipelineBusyError: 画像処理のキューが満杯の場合
+    """
+    try:
+        print("インメモリパイプラインで星座の生成を開始します")
+        pipeline_result = await pipeline_executor.run(
+            run_constellation_pipeline, content, output_dir="static/images", output=output
+        )
+        print(f"星座の生成が完了しました: {pipeline_result['image_path'] or output}")
+        record_detection_result(pipeline_result)
+        register_generated_image(pipeline_result["image_path"])
+        
+        name, story, selected_cluster_index = await run_in_threadpool(
+            generate_constellation_text, keyword, pipeline_result["star_field"].clusters
+        )
+        
+        return {
+            "constellation_name": name,
+            "story": story,
+            "image_path": pipeline_result["image_path"],
+            "stars": pipeline_result["stars"],
+            "constellation_lines": pipeline_result["constellation_lines"],
+            "selected_cluster_index": selected_cluster_index,
+            "overlay": pipeline_result.get("overlay")
+        }
+    except PipelineBusyError:
+        raise
+    except Exception as e:
+        print(f"画像処理と星座生成中にエラーが発生しました: {e}")
+        import traceback
+        traceback.print_exc()
+        return {
+            "constellation_name": "エラー",
+            "story": f"星座の生成中にエラーが発生しました: {str(e)}",
+            "image_path": None,
+            "stars": [],
+            "constellation_lines": [],
+            "selected_cluster_index": None
+        }
+
+async def process_image_batch(items, output="image"):
+    """
+    複数の画像から星座を並列に生成する
+    画像処理はワーカープールで並列に実行し、同じキーワードのテキスト生成は1回にまとめる
+    1つの画像の失敗はその項目のエラーとして返し、バッチ全体は失敗させない
+    
+    Args:
+        items: 各項目の番号（index）、ファイル名（filename）、キーワード（keyword）、
+            画像のバイト内容（content）、画像検証のエラー（error）を含む辞書のリスト
+        output: パイプラインの出力（"image", "svg", "vectors"）
+        
+    Returns:
+        項目ごとの結果のリスト（入力と同じ順序）
+        
+    Raises:
+        PipelineBusyError: 画像処理のキューにバッチの画像の枚数ぶんの空きがない場合
+    """
+    valid_items = [item for item in items if item["error"] is None]
+    
+    # バッチ全体の枠をまとめて確保してから投入し、キューの上限を超えてジョブを積まない
+    pipeline_executor.reserve(len(valid_items))
+    detections = {}
+    remaining = len(valid_items)
+    try:
+        for item in valid_items:
+            # 確保した枠を1つ submit に渡す（投入に失敗した場合は submit がその枠を返す）
+            remaining -= 1
+            detections[item["index"]] = pipeline_executor.submit(
+                run_constellation_pipeline, item["content"], output_dir="static/images", output=output,
+                reserved=True
+            )
+    except Exception:
+        # まだ投入していない画像の枠を返し、投入済みのジョブは取り消す
+        pipeline_executor.release(remaining)
+        for detection in detections.values():
+            detection.cancel()
+        raise
+    
+    # 正規化したキーワードごとにテキスト生成を1回だけ行う
+    text_tasks = {}
+    for item in valid_items:
+        key = normalize_keyword(item["keyword"])
+        if key not in text_tasks:
+            text_tasks[key] = asyncio.ensure_future(
+                run_in_threadpool(generate_constellation_content, item["keyword"])
+            )
+    print(f"バッチ処理を開始します: 画像{len(valid_items)}枚, テキスト生成{len(text_tasks)}回")
+    
+    async def process(item):
+        result = {"index": item["index"], "filename": item["filename"], "keyword": item["keyword"]}
+        if item["error"] is not None:
+            return {**result, "status": "error", "error": item["error"]}
+        
+        try:
+            pipeline_result = await detections[item["index"]]
+        except Exception as e:
+            print(f"バッチの画像{item['index']}の処理中にエラーが発生しました: {e}")
+            return {**result, "status": "error", "error": str(e)}
+        record_detection_result(pipeline_result)
+        register_generated_image(pipeline_result["image_path"])
+        
+        try:
+            name, story, features = await text_tasks[normalize_keyword(item["keyword"])]
+            selected_cluster_index = match_constellation_with_clusters(
+                name, story, pipeline_result["star_field"].clusters, features=features
+            )
+        except Exception as openai_error:
+            print(f"OpenAI APIでのテキスト生成中にエラーが発生しました: {openai_error}")
+            name, story = fallback_constellation_text()
+            selected_cluster_index = None
+        
+        image_filename = pipeline_result["image_filename"]
+        result.update({
+            "status": "ok",
+            "constellation_name": name,
+            "story": story,
+            "image_path": f"/api/images/{image_filename}" if image_filename else None,
+            "stars": pipeline_result["stars"],
+            "constellation_lines": pipeline_result["constellation_lines"],
+            "selected_cluster_index": selected_cluster_index
+        })
+        if output != "image":
+            result["overlay"] = pipeline_result["overlay"]
+        return result
+    
+    try:
+        return await asyncio.gather(*(process(item) for item in items))
+    finally:
+        for task in text_tasks.values():
+            task.cancel()
+
+def record_detection_result(detection_result):
+    """
+    星検出キャッシュのヒット・ミスと、画像のデコードの記録、段階ごとの時間を集計する
+    キャッシュとデコーダーはワーカープロセスごとに持つため、集計はこのプロセスで行う
+    """
+    detection_cache_counts["hits" if detection_result["cache_hit"] else "misses"] += 1
+    if detection_result.get("decode") is not None:
+        decode_stats.record(DecodeRecord(**detection_result["decode"]))
+    record_stages(detection_result.get("timings"))
+
+def register_generated_image(image_path):
+    """
+    生成した画像を /api/images で配信できるようにインデックスに登録し、保存期限と容量の管理対象にする
+    
+    Args:
+        image_path: 生成した画像のパス（画像を保存しない出力の場合はNone）
+    """
+    if image_path:
+        image_name = os.path.basename(image_path)
+        image_index.register(image_name, image_path)
+        artifact_store.add(image_name, image_path)
+
+def find_unindexed_image(image_name):
+    """
+    インデックスにない画像を、従来の保存場所の候補から探してインデックスに登録する
+    サーバーの再起動前に生成された画像など、このプロセスで登録していない画像のみが対象
+    
+    Args:
+        image_name: 画像の名前
+        
+    Returns:
+        登録したエントリ、見つからない場合はNone
+    """
+    possible_paths = [
+        f"temp_{image_name}",
+        f"static/images/{image_name}",
+        os.path.join(UPLOAD_TEMP_DIR, image_name),
+        image_name if os.path.isabs(image_name) else None,
+        f"/tmp/{image_name}"
+    ]
+    
+    possible_paths = [p for p in possible_paths if p]
+    
+    for path in possible_paths:
+        if os.path.isfile(path):
+            print(f"画像が見つかりました: {path}")
+            return image_index.register(image_name, path)
+    
+    print(f"画像が見つかりません: {image_name}")
+    print(f"試行したパス: {possible_paths}")
+    return None
+
+def read_file_range(path, start, end):
+    """ファイルの start から end（末尾を含む）までを読み込む"""
+    with open(path, "rb") as f:
+        f.seek(start)
+        return f.read(end - start + 1)
+
+async def image_response(request, headers, size, media_type=None, path=None, content=None, stat_result=None):
+    """
+    条件付きリクエスト（If-None-Match）と範囲リクエスト（Range / If-Range）に対応した画像のレスポンスを作る
+    
+    Args:
+        request: リクエスト
+        headers: ETagなどのキャッシュ用のヘッダー
+        size: 画像の大きさ（バイト）
+        media_type: MIMEタイプ（Noneの場合はファイル名から判定する）
+        path: 画像ファイルのパス（content を指定しない場合）
+        content: 画像のバイト内容（メモリ上の変換済みの画像の場合）
+        stat_result: ファイルの情報（指定するとファイルの存在確認を行わない）
+        
+    Returns:
+        200、206、304、416のいずれかのレスポンス
+    """
+    etag = headers["ETag"]
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    
+    byte_range = None
+    if_range = request.headers.get("if-range")
+    if if_range is None or if_range.strip() == etag:
+        try:
+            byte_range = parse_range(request.headers.get("range"), size)
+        except ValueError:
+            return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+    
+    if byte_range is None:
+        if content is not None:
+            return Response(content, media_type=media_type, headers=headers)
+        return FileResponse(path, media_type=media_type, headers=headers, stat_result=stat_result)
+    
+    start, end = byte_range
+    if content is not None:
+        partial = content[start:end + 1]
+    else:
+        partial = await run_in_threadpool(read_file_range, path, start, end)
+    return Response(
+        partial,
+        status_code=206,
+        media_type=media_type or mimetypes.guess_type(path)[0],
+        headers={**headers, "Content-Range": f"bytes {start}-{end}/{size}"}
+    )
+
+def format_sse_event(event, data):
+    """
+    Server-Sent Events形式のメッセージを組み立てる
+    
+    Args:
+        event: イベント名
+        data: JSONに変換して送るデータ
+        
+    Returns:
+        SSEメッセージの文字列
+    """
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+async def stream_constellation_events(detection, keyword):
+    """
+    星座生成の各段階が完了するたびにSSEイベントを送出する非同期ジェネレータ
+    画像処理（星検出→描画）とテキスト生成（星座名→ストーリー）は並行して進め、
+    一方が失敗した場合やクライアントが切断した場合はもう一方を中止する
+    テキスト生成は OPENAI_GENERATION_MODE に従い、combined の場合は1回のAPI呼び出しで名前・ストーリー・特徴を生成する
+    
+    送出するイベント:
+        stars: 検出された星
+        constellation: 星座を構成する星とライン
+        image: 星座画像のURL
+        name: 星座名
+        story: ストーリーの断片（sequentialの場合はモデルの出力に合わせて複数回、combinedの場合は全文を1回）
+        match: 選択されたクラスタインデックス
+        done: 通常のエンドポイントと同じ形式の最終結果
+        error: エラー内容
+    
+    Args:
+        detection: 星検出ジョブのFuture（detect_constellation_starsの結果を返す）
+        keyword: 星座生成に使用するキーワード
+    """
+    loop = asyncio.get_running_loop()
+    events = asyncio.Queue()
+    # スレッドプールで読んでいるストーリーのストリームを止めるためのフラグ
+    cancelled = threading.Event()
+    
+    async def image_stage():
+        detection_result = await detection
+        star_field = detection_result["star_field"]
+        record_detection_result(detection_result)
+        await events.put(("stars", {
+            "stars": star_field.stars.to_dicts(fields=("x", "y", "brightness"))
+        }))
+        
+        render_result = await pipeline_executor.run(
+            render_constellation_image, detection_result["optimized"], star_field,
+            output_dir="static/images", admitted=True
+        )
+        record_stages(render_result.get("timings"))
+        register_generated_image(render_result["image_path"])
+        await events.put(("constellation", {
+            "stars": render_result["stars"],
+            "constellation_lines": render_result["constellation_lines"]
+        }))
+        await events.put(("image", {"image_path": f"/api/images/{render_result['image_filename']}"}))
+        return star_field, render_result
+    
+    async def text_stage():
+        if OPENAI_GENERATION_MODE == "combined":
+            with timed_stage("llm_profile"):
+                profile = await run_in_threadpool(generate_constellation_profile, keyword)
+            name, story, features = split_constellation_profile(profile)
+            await events.put(("name", {"constellation_name": name}))
+            await events.put(("story", {"token": story}))
+            return name, story, features
+        
+        with timed_stage("llm_name"):
+            name = await run_in_threadpool(generate_constellation_name, keyword)
+        await events.put(("name", {"constellation_name": name}))
+        
+        story_chunks = []
+        
+        def produce_story():
+            story_stream = stream_constellation_story(name, keyword)
+            try:
+                for token in story_stream:
+                    if cancelled.is_set():
+                        break
+                    story_chunks.append(token)
+                    loop.call_soon_threadsafe(events.put_nowait, ("story", {"token": token}))
+            finally:
+                # 途中で止めた場合もAPIのストリームを閉じる
+                story_stream.close()
+        
+        with timed_stage("llm_story"):
+            await run_in_threadpool(produce_story)
+        return name, "".join(story_chunks), None
+    
+    async def run_stages():
+        image_task = asyncio.ensure_future(image_stage())
+        text_task = asyncio.ensure_future(text_stage())
+        try:
+            (star_field, render_result), (name, story, features) = await asyncio.gather(image_task, text_task)
+            
+            if features is None:
+                with timed_stage("llm_features"):
+                    features = await run_in_threadpool(extract_constellation_features, name, story)
+            selected_cluster_index = match_constellation_with_clusters(
+                name, story, star_field.clusters, features=features
+            )
+            await events.put(("match", {"selected_cluster_index": selected_cluster_index}))
+            
+            await events.put(("done", {
+                "constellation_name": name,
+                "story": story,
+                "image_path": f"/api/images/{render_result['image_filename']}",
+                "stars": render_result["stars"],
+                "constellation_lines": render_result["constellation_lines"],
+                "selected_cluster_index": selected_cluster_index
+            }))
+        except Exception as e:
+            print(f"ストリーミングでの星座生成中にエラーが発生しました: {e}")
+            await events.put(("error", {"detail": str(e)}))
+        finally:
+            # 失敗・切断で残った段階を中止し、LLMの呼び出しを続けない
+            cancelled.set()
+            for task in (image_task, text_task):
+                if not task.done():
+                    task.cancel()
+            events.put_nowait(None)
+    
+    stages = asyncio.ensure_future(run_stages())
+    try:
+        while True:
+            item = await events.get()
+            if item is None:
+                break
+            yield format_sse_event(*item)
+    finally:
+        if not stages.done():
+            stages.cancel()
+
 
 # 環境変数の読み込み
 load_dotenv()
 
+# 画像をメモリ上で処理するかどうか（falseの場合は一時ファイルを経由する従来の処理）
+IN_MEMORY_PIPELINE = os.getenv("IN_MEMORY_PIPELINE", "true").lower() == "true"
+
+# テキスト生成モード（combined: 1回のAPI呼び出しで名前・ストーリー・特徴を生成、sequential: 個別に生成）
+OPENAI_GENERATION_MODE = os.getenv("OPENAI_GENERATION_MODE", "combined").lower()
+
+# 画像処理のワーカープール設定
+PIPELINE_WORKERS = int(os.getenv("PIPELINE_WORKERS", str(os.cpu_count() or 1)))
+PIPELINE_MAX_QUEUE = int(os.getenv("PIPELINE_MAX_QUEUE", str(PIPELINE_WORKERS * 2)))
+PIPELINE_RETRY_AFTER = int(os.getenv("PIPELINE_RETRY_AFTER", "2"))
+PIPELINE_USE_PROCESSES = os.getenv("PIPELINE_USE_PROCESSES", "true").lower() == "true"
+
+# バッチエンドポイントで一度に受け付ける画像の最大数
+BATCH_MAX_IMAGES = int(os.getenv("BATCH_MAX_IMAGES", "50"))
+
+# 星検出キャッシュのヒット・ミス数と、フォーマットごとのデコードの記録
+# （ワーカーから返された結果と、一時ファイルを経由する従来の処理でのデコードを集計する）
+detection_cache_counts = {"hits": 0, "misses": 0}
+decode_stats = DecodeStats()
+
+# 配信時にフォーマット・画質を変換した画像のキャッシュ
+IMAGE_VARIANT_QUALITY = os.getenv("IMAGE_VARIANT_QUALITY", "standard").lower()
+IMAGE_VARIANT_CACHE_MAX_BYTES = int(os.getenv("IMAGE_VARIANT_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+image_variant_cache = ImageVariantCache(max_bytes=IMAGE_VARIANT_CACHE_MAX_BYTES)
+
+# 生成した画像の名前から保存場所を引くインデックス（配信時にファイルの存在確認を行わない）
+image_index = ImageIndex(max_entries=int(os.getenv("IMAGE_INDEX_MAX_ENTRIES", "10000")))
+
+# 従来の処理でアップロード画像・最適化画像を書き出す、このアプリ専用の一時ディレクトリ
+UPLOAD_TEMP_DIR = os.getenv("UPLOAD_TEMP_DIR") or os.path.join(tempfile.gettempdir(), "constellation_creator")
+os.makedirs(UPLOAD_TEMP_DIR, exist_ok=True)
+
+# 生成した画像の保存期限と合計バイト数の上限（定期的に期限切れのものと残った一時ファイルを削除する）
+# 残った一時ファイルはこのアプリ専用の一時ディレクトリだけで探し、共有の /tmp は掃除しない
+ARTIFACT_SWEEP_INTERVAL_SECONDS = float(os.getenv("ARTIFACT_SWEEP_INTERVAL_SECONDS", "300"))
+artifact_store = ArtifactStore(
+    max_bytes=int(os.getenv("ARTIFACT_MAX_BYTES", str(128 * 1024 * 1024))),
+    ttl_seconds=float(os.getenv("ARTIFACT_TTL_SECONDS", "86400")),
+    managed_dirs=["static/images"],
+    temp_dirs=[d for d in os.getenv("ARTIFACT_TEMP_DIRS", UPLOAD_TEMP_DIR).split(",") if d],
+    orphan_grace_seconds=float(os.getenv("ARTIFACT_ORPHAN_GRACE_SECONDS", "600")),
+    on_evict=lambda image_name: image_index.discard(image_name)
+)
+artifact_sweeper = None
+
+# 拡張子から保存されている画像のフォーマットを判定する
+IMAGE_EXTENSION_FORMATS = {".jpg": "jpeg", ".jpeg": "jpeg", ".webp": "webp", ".avif": "avif"}
+
+pipeline_executor = PipelineExecutor(
+    max_workers=PIPELINE_WORKERS,
+    max_queue=PIPELINE_MAX_QUEUE,
+    retry_after=PIPELINE_RETRY_AFTER,
+    use_processes=PIPELINE_USE_PROCESSES
+)
+
+# /metrics で公開するメトリクス（段階ごとの処理時間のヒストグラムと、既存の統計値）
+metrics_registry = MetricsRegistry()
+request_metrics = RequestMetrics(metrics_registry)
+
+def cache_stats():
+    """キャッシュごとのヒット数・ミス数を含む統計値"""
+    return {
+        "detection": detection_cache_counts,
+        "llm": llm_cache.stats(),
+        "image_variants": image_variant_cache.stats(),
+        "image_index": image_index.stats()
+    }
+
+def cache_hit_ratios():
+    ratios = {}
+    for cache, stats in cache_stats().items():
+        lookups = stats["hits"] + stats["misses"]
+        ratios[cache] = stats["hits"] / lookups if lookups else 0.0
+    return ratios
+
+metrics_registry.callback(
+    "pipeline_queue_depth", "画像処理のワーカーの空きを待っているジョブ数", lambda: pipeline_executor.queue_depth
+)
+metrics_registry.callback(
+    "pipeline_jobs_in_flight", "画像処理の実行中と待機中のジョブ数", lambda: pipeline_executor.in_flight
+)
+metrics_registry.callback(
+    "pipeline_jobs_total", "画像処理のジョブ数（結果ごと）",
+    lambda: {result: pipeline_executor.stats()[result] for result in ("completed", "failed", "rejected")},
+    metric_type="counter", label_names=("result",)
+)
+metrics_registry.callback(
+    "cache_hits_total", "キャッシュのヒット数",
+    lambda: {cache: stats["hits"] for cache, stats in cache_stats().items()},
+    metric_type="counter", label_names=("cache",)
+)
+metrics_registry.callback(
+    "cache_misses_total", "キャッシュのミス数",
+    lambda: {cache: stats["misses"] for cache, stats in cache_stats().items()},
+    metric_type="counter", label_names=("cache",)
+)
+metrics_registry.callback(
+    "cache_hit_ratio", "キャッシュのヒット率（起動してからの累計）", cache_hit_ratios, label_names=("cache",)
+)
+metrics_registry.callback(
+    "artifact_store_bytes", "保存している生成物の合計バイト数", lambda: artifact_store.stats()["bytes"]
+)
+
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -126,8 +689,12 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing"],
 )
 
+# 段階ごとの処理時間をServer-Timingヘッダーと /metrics のヒストグラムに出力する
+app.add_middleware(MetricsMiddleware, metrics=request_metrics)
+
 os.makedirs("static/images", exist_ok=True)
 
 # 静的ファイルの設定
@@ -135,6 +702,34 @@ app.mount("/static", StaticFiles(directory="static"), name="static")
 app.mount("/assets", StaticFiles(directory="static/assets"), name="assets")
 
 
+async def sweep_artifacts_periodically():
+    """生成物の保存領域を一定間隔で掃除する（ファイルの走査と削除はスレッドプールで行う）"""
+    while True:
+        try:
+            stats = await run_in_threadpool(artifact_store.sweep)
+            logger.info(
+                f"生成物の保存領域を掃除しました: {stats['artifacts']}個, {stats['bytes']} バイト"
+                f"（上限の{stats['occupancy']:.0%}）"
+            )
+        except Exception as e:
+            logger.error(f"生成物の保存領域の掃除中にエラーが発生しました: {e}")
+        await asyncio.sleep(ARTIFACT_SWEEP_INTERVAL_SECONDS)
+
+
+@app.on_event("startup")
+async def start_artifact_sweeper():
+    global artifact_sweeper
+    if ARTIFACT_SWEEP_INTERVAL_SECONDS > 0:
+        artifact_sweeper = asyncio.ensure_future(sweep_artifacts_periodically())
+
+
+@app.on_event("shutdown")
+async def shutdown_pipeline_executor():
+    if artifact_sweeper is not None:
+        artifact_sweeper.cancel()
+    pipeline_executor.shutdown()
+
+
 class ConstellationRequest(BaseModel):
     keyword: str
 
@@ -154,76 +749,167 @@ async def health_check():
     return {"status": "healthy"}
 
 
+@app.get("/api/pipeline/stats")
+async def get_pipeline_stats():
+    """
+    画像処理ワーカープールのキュー状態、キュー待ち時間、実行時間、各キャッシュのヒット率、
+    フォーマットごとのデコーダーとデコード時間を返すエンドポイント
+    """
+    lookups = detection_cache_counts["hits"] + detection_cache_counts["misses"]
+    return {
+        **pipeline_executor.stats(),
+        "detection_cache": {
+            **detection_cache_counts,
+            "hit_rate": detection_cache_counts["hits"] / lookups if lookups else 0.0
+        },
+        "llm_cache": llm_cache.stats(),
+        "decoders": {
+            "backends": decoder_registry.backends(),
+            "decodes": decode_stats.stats()
+        },
+        "image_variants": image_variant_cache.stats(),
+        "image_index": image_index.stats(),
+        "artifacts": artifact_store.stats()
+    }
+
+
+@app.get("/metrics")
+async def get_metrics():
+    """
+    Prometheus形式のメトリクスを返すエンドポイント
+    リクエストと段階（validate, decode, optimize, detect, cluster, draw, LLMの呼び出しなど）ごとの
+    処理時間のヒストグラム、キューの深さ、キャッシュのヒット率、処理中のリクエスト数を含む
+    """
+    return Response(content=metrics_registry.render(), media_type=PROMETHEUS_CONTENT_TYPE)
+
+
 @app.get("/api/images/{image_name}")
-async def get_image(image_name: str):
-    """画像ファイルを取得するエンドポイント"""
-    possible_paths = [
-        f"temp_{image_name}",
-        f"static/images/{image_name}",
-        image_name if os.path.isabs(image_name) else None,
-        f"/tmp/{image_name}"
-    ]
+async def get_image(image_name: str, request: Request, quality: Optional[str] = None):
+    """
+    画像ファイルを取得するエンドポイント
+    Acceptヘッダーで明示的にWebP・AVIFを受け付けるクライアントにはその形式に変換して返す
+    quality（low / standard / high）を指定すると、その画質でエンコードし直して返す
     
-    possible_paths = [p for p in possible_paths if p]
+    生成した画像は名前ごとに内容が変わらないため、強いETagと Cache-Control: immutable を付け、
+    If-None-Match には304を、Range には206を返す。保存場所はインデックスから引く
+    """
+    if quality is not None and quality.lower() not in QUALITY_TIERS:
+        raise HTTPException(status_code=400, detail=f"画質は{', '.join(QUALITY_TIERS)}のいずれかを指定してください。")
     
-    for path in possible_paths:
-        if os.path.exists(path):
-            print(f"画像が見つかりました: {path}")
-            return FileResponse(path)
+    entry = image_index.get(image_name)
+    if entry is None:
+        entry = await run_in_threadpool(find_unindexed_image, image_name)
+        if entry is None:
+            raise HTTPException(status_code=404, detail="画像が見つかりません")
+    artifact_store.touch(image_name)
     
-    print(f"画像が見つかりません: {image_name}")
-    print(f"試行したパス: {possible_paths}")
-    raise HTTPException(status_code=404, detail="画像が見つかりません")
+    headers = {"ETag": entry.etag, "Cache-Control": IMMUTABLE_CACHE_CONTROL, "Accept-Ranges": "bytes"}
+    source_format = IMAGE_EXTENSION_FORMATS.get(os.path.splitext(entry.path)[1].lower())
+    if source_format is None:
+        return await image_response(request, headers, entry.size, path=entry.path, stat_result=entry.stat)
+    headers["Vary"] = "Accept"
+    
+    image_format = negotiate_image_format(
+        request.headers.get("accept"), available_output_formats(), source_format
+    )
+    if image_format == source_format and quality is None:
+        return await image_response(request, headers, entry.size, path=entry.path, stat_result=entry.stat)
+    
+    # 変換した画像は変換元のETagにフォーマットと画質を加えたETagで区別する
+    tier = (quality or IMAGE_VARIANT_QUALITY).lower()
+    variant_headers = {**headers, "ETag": f'"{entry.etag[1:-1]}-{image_format}-{tier}"'}
+    if etag_matches(request.headers.get("if-none-match"), variant_headers["ETag"]):
+        return Response(status_code=304, headers=variant_headers)
+    
+    key = (entry.path, entry.stat.st_mtime_ns, image_format, tier)
+    content = image_variant_cache.get(key)
+    if content is None:
+        content = await run_in_threadpool(encode_image_variant, entry.path, image_format, tier)
+        if content is None:
+            print(f"画像の変換に失敗したため、元の画像を返します: {entry.path}")
+            return await image_response(request, headers, entry.size, path=entry.path, stat_result=entry.stat)
+        image_variant_cache.put(key, content)
+        print(f"画像を{image_format}（画質: {tier}）に変換しました: {len(content)} バイト")
+    return await image_response(
+        request, variant_headers, len(content), media_type=OUTPUT_FORMATS[image_format][1], content=content
+    )
 
 
 @app.post("/api/generate-constellation")
 async def generate_constellation(
     keyword: str = Form(...),
-    image: UploadFile = File(...)
+    image: UploadFile = File(...),
+    output: str = Form("image")
 ):
+    """
+    画像とキーワードから星座を生成するエンドポイント
+    output に "svg" または "vectors" を指定すると、星座画像を描画・保存せず、
+    アップロードした元画像に重ねるためのSVG（overlay.svg）と座標系の大きさ（overlay.width / height）を返す。
+    座標は元画像のEXIFの回転情報（overlay.orientation）を適用した、ブラウザで表示される向きになる
+    """
     try:
         print(f"受信したキーワード: {keyword}")
         print(f"受信した画像: {image.filename}")
 
-        # 画像を一時ファイルとして保存
         content = await image.read()
         print(f"受信した画像のサイズ: {len(content)} バイト")
         print(f"画像のMIMEタイプ: {image.content_type}")
         
-        is_valid = validate_image(content)
+        with timed_stage("validate"):
+            is_valid = validate_image(content)
         if not is_valid:
             raise HTTPException(status_code=400, detail="無効な画像形式です。JPG、PNG、AVIF、HEICなどの画像形式をお試しください。")
+        if output not in OUTPUT_MODES:
+            raise HTTPException(status_code=400, detail=f"output は{', '.join(OUTPUT_MODES)}のいずれかを指定してください。")
         
-        try:
-            temp_image_path = save_uploaded_image(content, "/tmp")
-            print(f"画像を保存しました: {temp_image_path}")
-        except Exception as save_error:
-            print(f"画像の保存中にエラーが発生しました: {save_error}")
-            temp_image_path = f"/tmp/temp_{image.filename}"
-            with open(temp_image_path, "wb") as buffer:
-                buffer.write(content)
-            print(f"フォールバック: 画像を一時ファイルに保存しました: {temp_image_path}")
-
-        # 画像処理とコンステレーション生成
-        constellation_data = process_image_and_generate_constellation(temp_image_path, keyword)
+        if IN_MEMORY_PIPELINE or output != "image":
+            # 画像処理とコンステレーション生成（デコードからエンコードまでメモリ上で処理）
+            # 描画しない出力は一時ファイルを必要としないため、常にインメモリパイプラインで処理する
+            constellation_data = await process_image_bytes_and_generate_constellation(content, keyword, output)
+            static_image_filename = (
+                os.path.basename(constellation_data["image_path"]) if constellation_data["image_path"] else None
+            )
+        else:
+            try:
+                with timed_stage("save"):
+                    temp_image_path = save_uploaded_image(content, UPLOAD_TEMP_DIR, decode_stats=decode_stats)
+                print(f"画像を保存しました: {temp_image_path}")
+            except Exception as save_error:
+                print(f"画像の保存中にエラーが発生しました: {save_error}")
+                # ファイル名はクライアントが指定するため使わず、拡張子だけを残す
+                extension = os.path.splitext(image.filename or "")[1].lower()
+                if not extension[1:].isalnum() or len(extension) > 6:
+                    extension = ".jpg"
+                temp_image_path = os.path.join(UPLOAD_TEMP_DIR, f"{uuid.uuid4()}{extension}")
+                with open(temp_image_path, "wb") as buffer:
+                    buffer.write(content)
+                print(f"フォールバック: 画像を一時ファイルに保存しました: {temp_image_path}")
+
+            # 画像処理とコンステレーション生成
+            constellation_data = await run_in_threadpool(
+                process_image_and_generate_constellation, temp_image_path, keyword
+            )
+
+            constellation_image_path = constellation_data["image_path"]
+            static_image_filename = os.path.basename(constellation_image_path)
+            static_image_path = f"static/images/{static_image_filename}"
+            
+            try:
+                with timed_stage("copy"):
+                    shutil.copy(constellation_image_path, static_image_path)
+                print(f"画像を静的ディレクトリにコピーしました: {static_image_path}")
+                register_generated_image(static_image_path)
+            except Exception as copy_error:
+                print(f"画像のコピー中にエラーが発生しました: {copy_error}")
+                register_generated_image(constellation_image_path)
         
         print("生成された星座データ:")
         print(f"- 星座名: {constellation_data['constellation_name']}")
         print(f"- ストーリー: {constellation_data['story']}")
         print(f"- 星の数: {len(constellation_data.get('stars', []))}")
         print(f"- ラインの数: {len(constellation_data.get('constellation_lines', []))}")
-
-        constellation_image_path = constellation_data["image_path"]
-        static_image_filename = os.path.basename(constellation_image_path)
-        static_image_path = f"static/images/{static_image_filename}"
         
-        try:
-            shutil.copy(constellation_image_path, static_image_path)
-            print(f"画像を静的ディレクトリにコピーしました: {static_image_path}")
-        except Exception as copy_error:
-            print(f"画像のコピー中にエラーが発生しました: {copy_error}")
-        
-        image_url = f"/api/images/{static_image_filename}"
+        image_url = f"/api/images/{static_image_filename}" if static_image_filename else None
         
         # レスポンスを返す前に形式を確認
         response_data = {
@@ -234,15 +920,121 @@ async def generate_constellation(
             "constellation_lines": constellation_data.get("constellation_lines", []),
             "selected_cluster_index": constellation_data.get("selected_cluster_index", None)
         }
+        if output != "image":
+            response_data["overlay"] = constellation_data.get("overlay")
 
         print("APIレスポンス:", response_data)
         return response_data
 
+    except PipelineBusyError as busy_error:
+        print(f"処理キューが満杯のためリクエストを拒否しました: {busy_error}")
+        raise HTTPException(
+            status_code=503,
+            detail=str(busy_error),
+            headers={"Retry-After": str(busy_error.retry_after)}
+        )
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"エラーが発生しました: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/api/generate-constellation/stream")
+async def generate_constellation_stream(
+    keyword: str = Form(...),
+    image: UploadFile = File(...)
+):
+    """
+    星座生成の進捗をServer-Sent Eventsで段階的に返すエンドポイント
+    ストリーミングに対応していないクライアントは /api/generate-constellation を使用する
+    """
+    print(f"受信したキーワード（ストリーミング）: {keyword}")
+    content = await image.read()
+    print(f"受信した画像のサイズ: {len(content)} バイト")
+    
+    with timed_stage("validate"):
+        is_valid = validate_image(content)
+    if not is_valid:
+        raise HTTPException(status_code=400, detail="無効な画像形式です。JPG、PNG、AVIF、HEICなどの画像形式をお試しください。")
+    
+    try:
+        detection = pipeline_executor.submit(detect_constellation_stars, content)
+    except PipelineBusyError as busy_error:
+        print(f"処理キューが満杯のためリクエストを拒否しました: {busy_error}")
+        raise HTTPException(
+            status_code=503,
+            detail=str(busy_error),
+            headers={"Retry-After": str(busy_error.retry_after)}
+        )
+    
+    return StreamingResponse(
+        stream_constellation_events(detection, keyword),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"
+        }
+    )
+
+@app.post("/api/generate-constellation/batch")
+async def generate_constellation_batch(
+    keywords: List[str] = Form(...),
+    images: List[UploadFile] = File(...),
+    output: str = Form("image")
+):
+    """
+    複数の画像からまとめて星座を生成するエンドポイント
+    キーワードは画像と同じ数だけ指定するか、1つだけ指定して全ての画像に使用する
+    結果は画像ごとに返し、失敗した画像は status が "error" の項目になる
+    output は /api/generate-constellation と同じ
+    """
+    print(f"バッチリクエストを受信しました: 画像{len(images)}枚, キーワード{len(keywords)}個")
+    # 画像処理のキューに一度に積めない枚数は、空くのを待っても受け付けられないため400を返す
+    max_images = min(BATCH_MAX_IMAGES, pipeline_executor.capacity)
+    if len(images) > max_images:
+        raise HTTPException(status_code=400, detail=f"一度に処理できる画像は{max_images}枚までです。")
+    if len(keywords) not in (1, len(images)):
+        raise HTTPException(status_code=400, detail="キーワードは1つ、または画像と同じ数だけ指定してください。")
+    if output not in OUTPUT_MODES:
+        raise HTTPException(status_code=400, detail=f"output は{', '.join(OUTPUT_MODES)}のいずれかを指定してください。")
+    
+    items = []
+    for index, image in enumerate(images):
+        content = await image.read()
+        keyword = keywords[0] if len(keywords) == 1 else keywords[index]
+        error = None
+        with timed_stage("validate"):
+            is_valid = validate_image(content)
+        if not is_valid:
+            error = "無効な画像形式です。JPG、PNG、AVIF、HEICなどの画像形式をお試しください。"
+        items.append({
+            "index": index,
+            "filename": image.filename,
+            "keyword": keyword,
+            "content": content,
+            "error": error
+        })
+    
+    try:
+        results = await process_image_batch(items, output)
+    except PipelineBusyError as busy_error:
+        print(f"処理キューが満杯のためバッチリクエストを拒否しました: {busy_error}")
+        raise HTTPException(
+            status_code=503,
+            detail=str(busy_error),
+            headers={"Retry-After": str(busy_error.retry_after)}
+        )
+    
+    succeeded = sum(1 for result in results if result["status"] == "ok")
+    print(f"バッチ処理が完了しました: 成功{succeeded}件, 失敗{len(results) - succeeded}件")
+    return {
+        "results": results,
+        "succeeded": succeeded,
+        "failed": len(results) - succeeded
+    }
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
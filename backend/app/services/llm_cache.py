@@ -0,0 +1,202 @@
+import json
+import time
+import random
+import sqlite3
+import hashlib
+import logging
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Tuple
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def normalize_keyword(keyword: str) -> str:
+    """
+    キャッシュキー用にキーワードを正規化する
+    全角・半角の違い、前後の空白、大文字・小文字の違いを無視する
+    """
+    return unicodedata.normalize("NFKC", keyword).strip().lower()
+
+class LLMResponseCache:
+    """
+    OpenAI APIの生成結果を保持するTTL付きLRUキャッシュ
+
+    キーは（関数名, 正規化したキーワード, 言語, モデル, プロンプトのバージョン）。
+    1つのキーに最大 variants 件の生成結果を保持し、件数が揃うまではミスとして扱って
+    新しい生成結果を追加する。揃った後はその中からランダムに1件を返す。
+    db_path を指定した場合はSQLiteにも保存し、再起動後も結果を再利用する。
+    SQLiteには書き込むたびに、期限切れの行と、キーごとに variants 件・全体で max_db_rows 行を超えた古い行を削除する。
+    """
+
+    def __init__(self, ttl_seconds: float = 7 * 24 * 3600, max_entries: int = 1024,
+                 variants: int = 1, db_path: Optional[str] = None, max_db_rows: int = 100_000):
+        """
+        Args:
+            ttl_seconds: 生成結果の有効期間（秒）
+            max_entries: メモリ上に保持するキーの最大数
+            variants: 1つのキーに保持する生成結果の数
+            db_path: 永続化に使用するSQLiteファイルのパス（Noneの場合はメモリのみ）
+            max_db_rows: SQLiteに保持する行の最大数
+        """
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max(1, max_entries)
+        self.variants = max(1, variants)
+        self.db_path = db_path
+        self.max_db_rows = max(1, max_db_rows)
+        self._entries: "OrderedDict[str, List[Tuple[Any, float]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._counts = {"hits": 0, "misses": 0, "evictions": 0, "db_rows_deleted": 0}
+        self._db: Optional[sqlite3.Connection] = None
+        if db_path:
+            self._open_db(db_path)
+
+    def _open_db(self, db_path: str) -> None:
+        try:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache ("
+                "key TEXT NOT NULL, value TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS llm_cache_key ON llm_cache (key)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS llm_cache_created_at ON llm_cache (created_at)")
+            self._db.execute("DELETE FROM llm_cache WHERE created_at < ?", (time.time() - self.ttl_seconds,))
+            self._db.commit()
+            logger.info(f"LLMキャッシュのデータベースを開きました: {db_path}")
+        except sqlite3.Error as db_error:
+            logger.error(f"LLMキャッシュのデータベースを開けませんでした。メモリのみで動作します: {db_error}")
+            self._db = None
+
+    @staticmethod
+    def make_key(function: str, keyword: str, language: str, model: str, prompt_version: str) -> str:
+        """
+        キャッシュキーを作成する
+
+        Args:
+            function: 生成を行う関数名
+            keyword: 生成のベースとなるキーワード（複数の入力がある場合は連結したもの）
+            language: 生成する言語
+            model: 使用するモデル
+            prompt_version: プロンプトのバージョン
+
+        Returns:
+            キャッシュキー
+        """
+        raw = "\x1f".join([function, normalize_keyword(keyword), language, model, prompt_version])
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _load_from_db(self, key: str, now: float) -> List[Tuple[Any, float]]:
+        if self._db is None:
+            return []
+        try:
+            rows = self._db.execute(
+                "SELECT value, created_at FROM llm_cache WHERE key = ? AND created_at >= ? "
+                "ORDER BY created_at DESC LIMIT ?",
+                (key, now - self.ttl_seconds, self.variants)
+            ).fetchall()
+            return [(json.loads(value), created_at) for value, created_at in rows]
+        except (sqlite3.Error, ValueError) as db_error:
+            logger.warning(f"LLMキャッシュのデータベースからの読み込みに失敗しました: {db_error}")
+            return []
+
+    def get(self, key: str) -> Optional[Any]:
+        """
+        キャッシュから生成結果を取得する
+
+        Args:
+            key: キャッシュキー
+
+        Returns:
+            生成結果、有効な結果が variants 件揃っていない場合はNone
+        """
+        now = time.time()
+        with self._lock:
+            variants = self._entries.get(key)
+            if variants is None:
+                variants = self._load_from_db(key, now)
+                if variants:
+                    self._store(key, variants)
+
+            variants = [(value, created_at) for value, created_at in variants
+                        if now - created_at < self.ttl_seconds]
+            if variants:
+                self._store(key, variants)
+            else:
+                self._entries.pop(key, None)
+
+            if len(variants) < self.variants:
+                self._counts["misses"] += 1
+                return None
+
+            self._counts["hits"] += 1
+            return random.choice(variants)[0]
+
+    def put(self, key: str, value: Any) -> None:
+        """
+        生成結果をキャッシュに追加する
+
+        Args:
+            key: キャッシュキー
+            value: JSONに変換可能な生成結果
+        """
+        now = time.time()
+        with self._lock:
+            variants = list(self._entries.get(key, []))
+            variants.append((value, now))
+            self._store(key, variants[-self.variants:])
+
+            if self._db is not None:
+                try:
+                    self._db.execute(
+                        "INSERT INTO llm_cache (key, value, created_at) VALUES (?, ?, ?)",
+                        (key, json.dumps(value, ensure_ascii=False), now)
+                    )
+                    self._prune_db(key, now)
+                    self._db.commit()
+                except sqlite3.Error as db_error:
+                    logger.warning(f"LLMキャッシュのデータベースへの書き込みに失敗しました: {db_error}")
+
+    def _prune_db(self, key: str, now: float) -> None:
+        """期限切れの行と、キーごと・全体の上限を超えた古い行を削除する（コミットは呼び出し側で行う）"""
+        deleted = self._db.execute(
+            "DELETE FROM llm_cache WHERE created_at < ?", (now - self.ttl_seconds,)
+        ).rowcount
+        # get() が読むのはキーごとに新しい variants 件だけなので、それより古い行は不要
+        deleted += self._db.execute(
+            "DELETE FROM llm_cache WHERE key = ? AND rowid NOT IN "
+            "(SELECT rowid FROM llm_cache WHERE key = ? ORDER BY created_at DESC LIMIT ?)",
+            (key, key, self.variants)
+        ).rowcount
+        deleted += self._db.execute(
+            "DELETE FROM llm_cache WHERE rowid IN "
+            "(SELECT rowid FROM llm_cache ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_db_rows,)
+        ).rowcount
+        self._counts["db_rows_deleted"] += deleted
+
+    def _store(self, key: str, variants: List[Tuple[Any, float]]) -> None:
+        self._entries[key] = variants
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._counts["evictions"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        キャッシュの使用状況とヒット数を返す
+
+        Returns:
+            キー数、ヒット・ミス数、ヒット率を含む辞書
+        """
+        with self._lock:
+            lookups = self._counts["hits"] + self._counts["misses"]
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "variants": self.variants,
+                "persistent": self._db is not None,
+                "max_db_rows": self.max_db_rows,
+                **self._counts,
+                "hit_rate": self._counts["hits"] / lookups if lookups else 0.0
+            }
@@ -1,8 +1,13 @@
 import os
+import re
+import json
 import logging
-from typing import Dict, Any, List, Tuple
+from typing import Dict, Any, List, Tuple, Literal, Iterator
 from openai import OpenAI
 from dotenv import load_dotenv
+from pydantic import BaseModel, Field, ValidationError
+
+from app.services.llm_cache import LLMResponseCache
 
 load_dotenv()
 
@@ -20,6 +25,22 @@ if OPENAI_API_KEY:
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+NAME_MODEL = "gpt-4.1-2025-04-14"
+STORY_MODEL = "gpt-4"
+FEATURES_MODEL = "gpt-4"
+PROFILE_MODEL = "gpt-4.1-2025-04-14"
+
+# プロンプトを変更した場合はバージョンを上げ、古い生成結果をキャッシュから使わないようにする
+PROMPT_VERSION = "1"
+
+llm_cache = LLMResponseCache(
+    ttl_seconds=float(os.getenv("LLM_CACHE_TTL_SECONDS", str(7 * 24 * 3600))),
+    max_entries=int(os.getenv("LLM_CACHE_MAX_ENTRIES", "1024")),
+    variants=int(os.getenv("LLM_CACHE_VARIANTS", "1")),
+    db_path=os.getenv("LLM_CACHE_DB_PATH") or None,
+    max_db_rows=int(os.getenv("LLM_CACHE_DB_MAX_ROWS", "100000"))
+)
+
 def generate_constellation_name(keyword: str, language: str = "ja") -> str:
     """
     キーワードに基づいて星座名を生成する
@@ -58,11 +79,17 @@ def generate_constellation_name(keyword: str, language: str = "ja") -> str:
         
         return f"{keyword}の星座"
     
+    cache_key = llm_cache.make_key("name", keyword, language, NAME_MODEL, PROMPT_VERSION)
+    cached_name = llm_cache.get(cache_key)
+    if cached_name is not None:
+        logger.info(f"星座名をキャッシュから取得しました: {cached_name}")
+        return cached_name
+    
     try:
         prompt = f"以下のキーワードに基づいて、新しい星座の名前を考えてください。名前は短く魅力的で、{language}で表現してください。キーワード: {keyword}"
         
         response = client.chat.completions.create(
-            model="gpt-4.1-2025-04-14",
+            model=NAME_MODEL,
             messages=[
                 {"role": "system", "content": "あなたは創造的な星座命名AIアシスタントです。与えられたキーワードを元に、新しい星座の名前を生成します。"},
                 {"role": "user", "content": prompt}
@@ -72,12 +99,33 @@ def generate_constellation_name(keyword: str, language: str = "ja") -> str:
         
         constellation_name = response.choices[0].message.content.strip()
         logger.info(f"星座名を生成しました: {constellation_name}")
+        llm_cache.put(cache_key, constellation_name)
         
         return constellation_name
     except Exception as e:
         logger.error(f"星座名の生成中にエラーが発生しました: {e}")
         return "未知の星座"
 
+def _story_messages(name: str, keyword: str, language: str) -> List[Dict[str, str]]:
+    """星座ストーリー生成用のメッセージを組み立てる"""
+    prompt = f"""
+        以下の星座名とキーワードに基づいて、星座にまつわる物語を創作してください。
+        
+        星座名: {name}
+        キーワード: {keyword}
+        
+        物語は200-300文字程度で、{language}で書いてください。
+        神話的な要素や感動的なストーリーを含めると良いでしょう。
+        """
+    return [
+        {"role": "system", "content": "あなたは創造的な星座物語作家AIです。与えられた星座名とキーワードを元に、魅力的な星座のストーリーを創作します。"},
+        {"role": "user", "content": prompt}
+    ]
+
+def _story_cache_key(name: str, keyword: str, language: str) -> str:
+    """星座ストーリーのキャッシュキーを作成する（ストーリーは星座名にも依存する）"""
+    return llm_cache.make_key("story", f"{name}\n{keyword}", language, STORY_MODEL, PROMPT_VERSION)
+
 def generate_constellation_story(name: str, keyword: str, language: str = "ja") -> str:
     """
     星座名とキーワードに基づいて星座のストーリーを生成する
@@ -105,34 +153,79 @@ def generate_constellation_story(name: str, keyword: str, language: str = "ja")
         
         return f"{name}に関する伝説は古来より語り継がれてきました。星々の配置は、{keyword}にまつわる物語を表しているとされています。詳細は時間の流れとともに変化してきましたが、今でも多くの人々がこの星座に特別な意味を見出し、夜空を見上げては思いを馳せています。"
     
+    cache_key = _story_cache_key(name, keyword, language)
+    cached_story = llm_cache.get(cache_key)
+    if cached_story is not None:
+        logger.info("星座ストーリーをキャッシュから取得しました")
+        return cached_story
+    
     try:
-        prompt = f"""
-        以下の星座名とキーワードに基づいて、星座にまつわる物語を創作してください。
-        
-        星座名: {name}
-        キーワード: {keyword}
-        
-        物語は200-300文字程度で、{language}で書いてください。
-        神話的な要素や感動的なストーリーを含めると良いでしょう。
-        """
-        
         response = client.chat.completions.create(
-            model="gpt-4",
-            messages=[
-                {"role": "system", "content": "あなたは創造的な星座物語作家AIです。与えられた星座名とキーワードを元に、魅力的な星座のストーリーを創作します。"},
-                {"role": "user", "content": prompt}
-            ],
+            model=STORY_MODEL,
+            messages=_story_messages(name, keyword, language),
             max_tokens=500
         )
         
         story = response.choices[0].message.content.strip()
         logger.info(f"星座ストーリーを生成しました（長さ: {len(story)}文字）")
+        llm_cache.put(cache_key, story)
         
         return story
     except Exception as e:
         logger.error(f"星座ストーリーの生成中にエラーが発生しました: {e}")
         return f"{name}に関する伝説は古来より語り継がれてきましたが、詳細は時間の流れとともに失われてしまいました。"
 
+def stream_constellation_story(name: str, keyword: str, language: str = "ja") -> Iterator[str]:
+    """
+    星座名とキーワードに基づいて星座のストーリーを生成し、トークンごとに返す
+    
+    Args:
+        name: 星座の名前
+        keyword: ストーリー生成のベースとなるキーワード
+        language: 生成する言語 (jaは日本語、enは英語)
+        
+    Yields:
+        生成されたストーリーの断片
+    """
+    if not OPENAI_API_KEY or not client or (OPENAI_API_KEY and OPENAI_API_KEY.startswith("sk-dummy")):
+        story = generate_constellation_story(name, keyword, language)
+        for sentence in re.findall(r"[^。]+。?", story):
+            yield sentence
+        return
+    
+    cache_key = _story_cache_key(name, keyword, language)
+    cached_story = llm_cache.get(cache_key)
+    if cached_story is not None:
+        logger.info("星座ストーリーをキャッシュから取得しました")
+        for sentence in re.findall(r"[^。]+。?", cached_story):
+            yield sentence
+        return
+    
+    streamed = False
+    try:
+        stream = client.chat.completions.create(
+            model=STORY_MODEL,
+            messages=_story_messages(name, keyword, language),
+            max_tokens=500,
+            stream=True
+        )
+        
+        tokens = []
+        for chunk in stream:
+            if not chunk.choices:
+                continue
+            token = chunk.choices[0].delta.content
+            if token:
+                streamed = True
+                tokens.append(token)
+                yield token
+        logger.info("星座ストーリーのストリーミング生成が完了しました")
+        llm_cache.put(cache_key, "".join(tokens).strip())
+    except Exception as e:
+        logger.error(f"星座ストーリーのストリーミング生成中にエラーが発生しました: {e}")
+        if not streamed:
+            yield f"{name}に関する伝説は古来より語り継がれてきましたが、詳細は時間の流れとともに失われてしまいました。"
+
 def extract_constellation_features(name: str, story: str) -> dict:
     """
     星座名とストーリーから特徴を抽出する
@@ -153,6 +246,12 @@ def extract_constellation_features(name: str, story: str) -> dict:
             "pattern": "scattered"
         }
     
+    cache_key = llm_cache.make_key("features", f"{name}\n{story}", "ja", FEATURES_MODEL, PROMPT_VERSION)
+    cached_features = llm_cache.get(cache_key)
+    if cached_features is not None:
+        logger.info(f"星座の特徴をキャッシュから取得しました: {cached_features}")
+        return dict(cached_features)
+    
     try:
         prompt = f"""
         以下の星座名とストーリーから、星座の特徴を抽出してください。
@@ -168,7 +267,7 @@ def extract_constellation_features(name: str, story: str) -> dict:
         """
         
         response = client.chat.completions.create(
-            model="gpt-4",
+            model=FEATURES_MODEL,
             messages=[
                 {"role": "system", "content": "あなたは星座の特徴を抽出するAIアシスタントです。与えられた星座名とストーリーから、星座の形状、星の数、明るさ、パターンなどの特徴を抽出します。"},
                 {"role": "user", "content": prompt}
@@ -213,6 +312,7 @@ def extract_constellation_features(name: str, story: str) -> dict:
                     break
                     
         logger.info(f"解析された特徴: {features}")
+        llm_cache.put(cache_key, features)
         return features
     except Exception as e:
         logger.error(f"星座特徴の抽出中にエラーが発生しました: {e}")
@@ -222,3 +322,79 @@ def extract_constellation_features(name: str, story: str) -> dict:
             "brightness": "high",
             "pattern": "scattered"
         }
+
+
+class ConstellationProfile(BaseModel):
+    """星座名・ストーリー・マッチング用特徴をまとめた構造化レスポンスのスキーマ"""
+    name: str = Field(min_length=1, max_length=50)
+    story: str = Field(min_length=1)
+    shape: Literal["regular", "irregular", "animal", "object"]
+    star_count: int = Field(ge=3, le=20)
+    brightness: Literal["high", "medium", "low"]
+    pattern: Literal["scattered", "dense", "linear"]
+
+def generate_constellation_profile(keyword: str, language: str = "ja") -> dict:
+    """
+    キーワードに基づいて星座名・ストーリー・特徴を1回のAPI呼び出しでまとめて生成する
+    レスポンスはJSONとして受け取り、ConstellationProfileのスキーマで検証する
+    
+    Args:
+        keyword: 生成のベースとなるキーワード
+        language: 生成する言語 (jaは日本語、enは英語)
+        
+    Returns:
+        name, story, shape, star_count, brightness, pattern を含む辞書
+    """
+    if not OPENAI_API_KEY or not client or (OPENAI_API_KEY and OPENAI_API_KEY.startswith("sk-dummy")):
+        logger.warning("APIキーが設定されていないか、ダミーのAPIキーが使用されています。モックの星座プロフィールを返します。")
+        name = generate_constellation_name(keyword, language)
+        story = generate_constellation_story(name, keyword, language)
+        return {"name": name, "story": story, **extract_constellation_features(name, story)}
+    
+    cache_key = llm_cache.make_key("profile", keyword, language, PROFILE_MODEL, PROMPT_VERSION)
+    cached_profile = llm_cache.get(cache_key)
+    if cached_profile is not None:
+        logger.info(f"星座プロフィールをキャッシュから取得しました: {cached_profile['name']}")
+        return dict(cached_profile)
+    
+    try:
+        prompt = f"""
+        以下のキーワードに基づいて、新しい星座を創作してください。
+        
+        キーワード: {keyword}
+        
+        次のキーを持つJSONオブジェクトのみを返してください：
+        - name: 短く魅力的な星座名（{language}で表現）
+        - story: 星座にまつわる200-300文字程度の物語（{language}で記述、神話的な要素や感動的なストーリーを含める）
+        - shape: 星座の形状。"regular", "irregular", "animal", "object" のいずれか
+        - star_count: 星座を構成する星のおおよその数（3-20の整数）
+        - brightness: 星の明るさ。"high", "medium", "low" のいずれか
+        - pattern: 星の配置パターン。"scattered", "dense", "linear" のいずれか
+        """
+        
+        response = client.chat.completions.create(
+            model=PROFILE_MODEL,
+            messages=[
+                {"role": "system", "content": "あなたは創造的な星座命名・物語作家AIです。与えられたキーワードを元に、星座の名前、物語、形状の特徴を考え、指定されたJSON形式で出力します。"},
+                {"role": "user", "content": prompt}
+            ],
+            response_format={"type": "json_object"},
+            max_tokens=800
+        )
+        
+        content = response.choices[0].message.content
+        profile = ConstellationProfile.model_validate(json.loads(content))
+        logger.info(f"星座プロフィールを生成しました: {profile.name}（ストーリー長: {len(profile.story)}文字）")
+        
+        llm_cache.put(cache_key, profile.model_dump())
+        
+        return profile.model_dump()
+    except (json.JSONDecodeError, ValidationError) as parse_error:
+        logger.error(f"星座プロフィールのレスポンスがスキーマに一致しませんでした: {parse_error}")
+    except Exception as e:
+        logger.error(f"星座プロフィールの生成中にエラーが発生しました: {e}")
+    
+    logger.warning("個別のAPI呼び出しで星座名・ストーリー・特徴を生成します")
+    name = generate_constellation_name(keyword, language)
+    story = generate_constellation_story(name, keyword, language)
+    return {"name": name, "story": story, **extract_constellation_features(name, story)}
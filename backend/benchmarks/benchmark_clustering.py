@@ -0,0 +1,82 @@
+import os
+import sys
+import time
+import argparse
+import logging
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.core.star_detection import cluster_stars
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+# 計測中はクラスタリングのログを抑制する
+logging.getLogger("app").setLevel(logging.WARNING)
+
+def create_star_field(count, density=200 / (800 * 600), seed=0):
+    """
+    星の密度を一定に保ったランダムな星のリストを作成する
+
+    Args:
+        count: 星の数
+        density: 1ピクセルあたりの星の数（デフォルトは800x600に200個）
+        seed: 乱数シード
+
+    Returns:
+        星のリスト
+    """
+    rng = np.random.default_rng(seed)
+    scale = np.sqrt(count / density / (4 * 3))
+    width, height = int(scale * 4), int(scale * 3)
+    return [
+        {
+            "x": int(rng.integers(0, width)),
+            "y": int(rng.integers(0, height)),
+            "brightness": float(rng.integers(50, 256)),
+            "area": float(rng.integers(3, 30))
+        }
+        for _ in range(count)
+    ]
+
+def benchmark(stars, engine, repeat):
+    """
+    指定したエンジンでクラスタリングを repeat 回実行し、最短の実行時間を返す
+
+    Args:
+        stars: 星のリスト
+        engine: クラスタリングの実装
+        repeat: 繰り返し回数
+
+    Returns:
+        最短の実行時間（秒）とクラスタ数のタプル
+    """
+    best = float("inf")
+    clusters = []
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        clusters = cluster_stars(stars, engine=engine)
+        best = min(best, time.perf_counter() - started_at)
+    return best, len(clusters)
+
+def main():
+    parser = argparse.ArgumentParser(description="クラスタリングエンジンの実行時間を比較する")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--engines", nargs="+", default=["greedy", "grid", "union_find"])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--greedy-limit", type=int, default=1000,
+                        help="greedyエンジンを実行する最大の星数（総当たりのため大きい値では非常に遅い）")
+    args = parser.parse_args()
+
+    print(f"{'stars':>8} {'engine':>12} {'seconds':>10} {'clusters':>9}")
+    for size in args.sizes:
+        stars = create_star_field(size)
+        for engine in args.engines:
+            if engine == "greedy" and size > args.greedy_limit:
+                print(f"{size:>8} {engine:>12} {'skipped':>10} {'-':>9}")
+                continue
+            seconds, cluster_count = benchmark(stars, engine, args.repeat)
+            print(f"{size:>8} {engine:>12} {seconds:>10.4f} {cluster_count:>9}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,269 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import logging
+import platform
+import statistics
+import tempfile
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List
+
+import cv2
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.benchmark_clustering import create_star_field
+from app.core.star_detection import (
+    detect_stars, detect_stars_with_blob, detect_stars_with_threshold, cluster_stars, calculate_matching_score
+)
+from app.core.constellation import draw_constellation_lines
+from app.core.image_processing import optimize_image, validate_image
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+# 計測中は各処理のログを抑制する
+logging.getLogger("app").setLevel(logging.WARNING)
+
+# 画像の大きさ（メガピクセル）を入力にする処理と、星の数を入力にする処理
+IMAGE_BENCHMARKS = ("detect_stars", "detect_stars_with_blob", "detect_stars_with_threshold",
+                    "optimize_image", "validate_image")
+STAR_BENCHMARKS = ("cluster_stars", "calculate_matching_score", "draw_constellation_lines")
+
+# calculate_matching_score に渡す星座の特徴（全ての分岐を通る "linear" を使う）
+MATCHING_FEATURES = {"shape": "line", "star_count": 7, "brightness": "high", "pattern": "linear"}
+
+def create_sky_image(megapixels: float, stars_per_megapixel: int = 400, seed: int = 0) -> np.ndarray:
+    """
+    指定した画素数の4:3の星空画像（BGR）を作成する
+
+    Args:
+        megapixels: 画素数（メガピクセル）
+        stars_per_megapixel: 1メガピクセルあたりの星の数
+        seed: 乱数シード
+
+    Returns:
+        BGR形式の画像
+    """
+    rng = np.random.default_rng(seed)
+    width = int(round(np.sqrt(megapixels * 1e6 * 4 / 3)))
+    height = int(round(width * 3 / 4))
+    gray = rng.normal(20, 6, (height, width)).clip(0, 255).astype(np.uint8)
+    for _ in range(int(megapixels * stars_per_megapixel)):
+        center = (int(rng.integers(0, width)), int(rng.integers(0, height)))
+        cv2.circle(gray, center, int(rng.integers(1, 5)), int(rng.integers(120, 256)), -1)
+    gray = cv2.GaussianBlur(gray, (3, 3), 0)
+    return cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR)
+
+def measure(function: Callable[[], Any], repeat: int) -> List[float]:
+    """
+    関数を repeat 回実行し、それぞれの実行時間を返す
+
+    Args:
+        function: 計測する関数
+        repeat: 繰り返し回数
+
+    Returns:
+        実行時間（秒）のリスト
+    """
+    timings = []
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - started_at)
+    return timings
+
+def make_result(name: str, parameter: str, timings: List[float]) -> Dict[str, Any]:
+    """計測結果を1件の辞書にまとめる"""
+    return {
+        "benchmark": f"{name}[{parameter}]",
+        "function": name,
+        "parameter": parameter,
+        "median_seconds": statistics.median(timings),
+        "min_seconds": min(timings),
+        "max_seconds": max(timings),
+        "runs": len(timings)
+    }
+
+def run_image_benchmarks(megapixels_list: List[float], functions: List[str], repeat: int,
+                         work_dir: str) -> List[Dict[str, Any]]:
+    """
+    画像の大きさごとに、星検出・最適化・検証の実行時間を計測する
+
+    Args:
+        megapixels_list: 画像の画素数（メガピクセル）のリスト
+        functions: 計測する関数名
+        repeat: 繰り返し回数
+        work_dir: 画像ファイルを書き出す作業ディレクトリ
+
+    Returns:
+        計測結果のリスト
+    """
+    results = []
+    for megapixels in megapixels_list:
+        image = create_sky_image(megapixels)
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        content = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, 90])[1].tobytes()
+        image_path = os.path.join(work_dir, f"sky_{megapixels}mp.jpg")
+        with open(image_path, "wb") as f:
+            f.write(content)
+        parameter = f"{megapixels:g}MP"
+        logger.info(f"{parameter}の画像で計測します: {image.shape[1]}x{image.shape[0]}, {len(content)} バイト")
+
+        cases = {
+            "detect_stars": lambda: detect_stars(image_path),
+            "detect_stars_with_blob": lambda: detect_stars_with_blob(gray),
+            "detect_stars_with_threshold": lambda: detect_stars_with_threshold(gray),
+            "optimize_image": lambda: optimize_image(image_path),
+            "validate_image": lambda: validate_image(content)
+        }
+        for name in IMAGE_BENCHMARKS:
+            if name in functions:
+                results.append(make_result(name, parameter, measure(cases[name], repeat)))
+                print_result(results[-1])
+    return results
+
+def run_star_benchmarks(star_counts: List[int], functions: List[str], repeat: int,
+                        work_dir: str) -> List[Dict[str, Any]]:
+    """
+    星の数ごとに、クラスタリング・マッチング・星座の描画の実行時間を計測する
+
+    Args:
+        star_counts: 星の数のリスト
+        functions: 計測する関数名
+        repeat: 繰り返し回数
+        work_dir: 描画先の画像を書き出す作業ディレクトリ
+
+    Returns:
+        計測結果のリスト
+    """
+    results = []
+    background_path = os.path.join(work_dir, "background.jpg")
+    cv2.imwrite(background_path, create_sky_image(0.48))
+    output_path = os.path.join(work_dir, "background_constellation.jpg")
+
+    for count in star_counts:
+        stars = create_star_field(count)
+        # 描画する星座は800x600の座標に収め、12個ずつのクラスタにする
+        points = [
+            [(star["x"] % 800, star["y"] % 600) for star in stars[start:start + 12]]
+            for start in range(0, count, 12)
+        ]
+        parameter = f"{count}stars"
+
+        cases = {
+            "cluster_stars": lambda: cluster_stars(stars),
+            "calculate_matching_score": lambda: calculate_matching_score(MATCHING_FEATURES, stars),
+            "draw_constellation_lines": lambda: draw_constellation_lines(background_path, points, output_path)
+        }
+        for name in STAR_BENCHMARKS:
+            if name in functions:
+                results.append(make_result(name, parameter, measure(cases[name], repeat)))
+                print_result(results[-1])
+    return results
+
+def print_result(result: Dict[str, Any]) -> None:
+    print(f"{result['benchmark']:>44} {result['median_seconds']:>12.6f} {result['min_seconds']:>12.6f}")
+
+def environment_info() -> Dict[str, Any]:
+    """計測した環境（結果を比較する際の参考）"""
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+        "opencv": cv2.__version__
+    }
+
+def compare_with_baseline(results: List[Dict[str, Any]], baseline: Dict[str, Any],
+                          tolerance: float = 0.2, min_seconds: float = 0.001) -> List[Dict[str, Any]]:
+    """
+    計測結果を保存済みのベースラインと比較し、中央値の変化率を求める
+
+    Args:
+        results: 今回の計測結果
+        baseline: 保存済みのベースライン（このスクリプトが出力したJSON）
+        tolerance: 遅くなったと判定する変化率（0.2の場合は20%以上遅い場合）
+        min_seconds: これより短い処理は計測誤差が大きいため、差がこの値未満なら遅くなったと判定しない
+
+    Returns:
+        ベンチマークごとの比較結果（regression が True のものは遅くなった処理）
+    """
+    previous = {result["benchmark"]: result for result in baseline.get("results", [])}
+    comparisons = []
+    for result in results:
+        before = previous.get(result["benchmark"])
+        if before is None:
+            continue
+        current, reference = result["median_seconds"], before["median_seconds"]
+        change = (current - reference) / reference if reference > 0 else 0.0
+        comparisons.append({
+            "benchmark": result["benchmark"],
+            "baseline_seconds": reference,
+            "median_seconds": current,
+            "change": change,
+            "regression": change > tolerance and current - reference >= min_seconds
+        })
+    return comparisons
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="星検出・描画の主要な処理の実行時間を計測し、JSONに保存してベースラインと比較する"
+    )
+    parser.add_argument("--megapixels", type=float, nargs="+", default=[0.5, 2, 12, 24])
+    parser.add_argument("--stars", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--functions", nargs="+", default=list(IMAGE_BENCHMARKS + STAR_BENCHMARKS),
+                        choices=IMAGE_BENCHMARKS + STAR_BENCHMARKS)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", help="計測結果を保存するJSONファイル")
+    parser.add_argument("--baseline", help="比較するベースラインのJSONファイル（以前の --output）")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="ベースラインより遅くなったと判定する中央値の変化率")
+    parser.add_argument("--fail-on-regression", action="store_true",
+                        help="遅くなった処理がある場合に終了コード1で終了する（CI用）")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp()
+    print(f"{'benchmark':>44} {'median':>12} {'min':>12}")
+    try:
+        results = run_image_benchmarks(args.megapixels, args.functions, args.repeat, work_dir)
+        results += run_star_benchmarks(args.stars, args.functions, args.repeat, work_dir)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "environment": environment_info(),
+        "repeat": args.repeat,
+        "results": results
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        logger.info(f"計測結果を保存しました: {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline.get("environment") != report["environment"]:
+            logger.warning("ベースラインと計測環境が異なるため、比較結果は参考値です")
+        comparisons = compare_with_baseline(results, baseline, args.tolerance)
+        print(f"\n{'benchmark':>44} {'baseline':>12} {'median':>12} {'change':>8}")
+        for comparison in comparisons:
+            flag = "  REGRESSION" if comparison["regression"] else ""
+            print(
+                f"{comparison['benchmark']:>44} {comparison['baseline_seconds']:>12.6f} "
+                f"{comparison['median_seconds']:>12.6f} {comparison['change']:>+8.1%}{flag}"
+            )
+        regressions = [comparison for comparison in comparisons if comparison["regression"]]
+        if regressions:
+            logger.warning(f"ベースラインより遅くなった処理が{len(regressions)}件あります")
+            if args.fail_on_regression:
+                sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,284 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import logging
+import statistics
+import tempfile
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.synthetic_sky import SyntheticSkyConfig, generate_synthetic_sky, save_synthetic_sky
+from benchmarks.benchmark_hot_paths import environment_info
+from app.core.star_detection import detect_stars
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+# 評価中は各処理のログを抑制する
+logging.getLogger("app").setLevel(logging.WARNING)
+
+DETECTION_MODES = ("single", "tiled", "pyramid")
+
+# ベースラインと比較する精度の指標
+ACCURACY_METRICS = ("precision", "recall")
+
+def star_position(star: Dict[str, Any]) -> tuple:
+    """検出結果の座標（サブピクセルの重心があればそれを使う）"""
+    return (float(star.get("centroid_x", star["x"])), float(star.get("centroid_y", star["y"])))
+
+def match_stars(detected: Sequence[Dict[str, Any]], truth: Sequence[Dict[str, Any]],
+                radius: float) -> List[tuple]:
+    """
+    検出結果と正解の星を、距離が近い組から順に1対1で対応付ける
+
+    Args:
+        detected: 検出された星のリスト
+        truth: 正解の星のリスト（x, y）
+        radius: 同じ星とみなす最大の距離（ピクセル）
+
+    Returns:
+        (検出結果の番号, 正解の番号, 距離) のリスト
+    """
+    # 正解の星を radius 四方の格子に分け、近くの格子だけを調べる
+    grid: Dict[tuple, List[int]] = {}
+    for index, star in enumerate(truth):
+        grid.setdefault((int(star["x"] // radius), int(star["y"] // radius)), []).append(index)
+
+    pairs = []
+    for detected_index, star in enumerate(detected):
+        x, y = star_position(star)
+        cell_x, cell_y = int(x // radius), int(y // radius)
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                for truth_index in grid.get((cell_x + dx, cell_y + dy), ()):
+                    distance = float(np.hypot(x - truth[truth_index]["x"], y - truth[truth_index]["y"]))
+                    if distance <= radius:
+                        pairs.append((distance, detected_index, truth_index))
+
+    pairs.sort()
+    used_detected, used_truth, matches = set(), set(), []
+    for distance, detected_index, truth_index in pairs:
+        if detected_index in used_detected or truth_index in used_truth:
+            continue
+        used_detected.add(detected_index)
+        used_truth.add(truth_index)
+        matches.append((detected_index, truth_index, distance))
+    return matches
+
+def summarize_errors(errors: Sequence[float]) -> Dict[str, Optional[float]]:
+    """重心の誤差（ピクセル）の平均・中央値・二乗平均平方根（対応した星がない場合はNone）"""
+    if not errors:
+        return {"centroid_error_mean": None, "centroid_error_median": None, "centroid_error_rms": None}
+    return {
+        "centroid_error_mean": statistics.fmean(errors),
+        "centroid_error_median": statistics.median(errors),
+        "centroid_error_rms": float(np.sqrt(np.mean(np.square(errors))))
+    }
+
+def score_detection(detected: Sequence[Dict[str, Any]], truth: Sequence[Dict[str, Any]],
+                    radius: float = 3.0, min_snr: float = 5.0) -> Dict[str, Any]:
+    """
+    検出結果を正解と比較し、適合率・再現率・重心の誤差を求める
+
+    適合率は正解のいずれかの星に対応した検出の割合、再現率は SN比が min_snr 以上の
+    （検出できるはずの）正解の星のうち検出された割合。
+
+    Args:
+        detected: 検出された星のリスト
+        truth: 正解の星のリスト（x, y, snr）
+        radius: 同じ星とみなす最大の距離（ピクセル）
+        min_snr: 再現率の対象にする正解の星のSN比の下限
+
+    Returns:
+        検出数、対応した数、適合率、再現率、重心の誤差（平均・中央値・二乗平均平方根）と、
+        対応した組ごとの距離のリスト（errors）を含む辞書
+    """
+    matches = match_stars(detected, truth, radius)
+    matched_truth = {truth_index for _, truth_index, _ in matches}
+    detectable = [index for index, star in enumerate(truth) if star["snr"] >= min_snr]
+    recalled = sum(1 for index in detectable if index in matched_truth)
+    errors = [distance for _, _, distance in matches]
+    return {
+        "detected": len(detected),
+        "truth": len(truth),
+        "detectable": len(detectable),
+        "matched": len(matches),
+        "recalled": recalled,
+        "precision": len(matches) / len(detected) if detected else 0.0,
+        "recall": recalled / len(detectable) if detectable else 1.0,
+        **summarize_errors(errors),
+        "errors": errors
+    }
+
+def evaluate_modes(image_paths: Sequence[str], truths: Sequence[Sequence[Dict[str, Any]]],
+                   modes: Sequence[str] = DETECTION_MODES, repeat: int = 1, radius: float = 3.0,
+                   min_snr: float = 5.0, max_detected: int = 100000) -> List[Dict[str, Any]]:
+    """
+    detect_stars の検出方法ごとに、精度と実行時間を評価する
+
+    Args:
+        image_paths: 評価に使う画像のパス
+        truths: 画像ごとの正解の星のリスト
+        modes: 評価する検出方法
+        repeat: 実行時間を計測する繰り返し回数（精度は1回目の結果で評価する）
+        radius: 同じ星とみなす最大の距離（ピクセル）
+        min_snr: 再現率の対象にする正解の星のSN比の下限
+        max_detected: detect_stars に渡す検出数の上限（上限で精度が変わらないよう十分大きくする）
+
+    Returns:
+        検出方法ごとの評価結果（画像全体で合計した適合率・再現率、重心の誤差、実行時間の中央値）
+    """
+    results = []
+    for mode in modes:
+        timings, scores = [], []
+        for image_path, truth in zip(image_paths, truths):
+            detected = None
+            for _ in range(repeat):
+                started_at = time.perf_counter()
+                stars = detect_stars(image_path, mode=mode, max_detected=max_detected)
+                timings.append(time.perf_counter() - started_at)
+                detected = stars if detected is None else detected
+            scores.append(score_detection(detected, truth, radius, min_snr))
+
+        # 画像ごとの値を平均せず、画像全体の数を合計してから割合を求める
+        detected_total = sum(score["detected"] for score in scores)
+        matched_total = sum(score["matched"] for score in scores)
+        detectable_total = sum(score["detectable"] for score in scores)
+        recalled_total = sum(score["recalled"] for score in scores)
+        result = {
+            "mode": mode,
+            "images": len(scores),
+            "detected": detected_total,
+            "matched": matched_total,
+            "detectable": detectable_total,
+            "precision": matched_total / detected_total if detected_total else 0.0,
+            "recall": recalled_total / detectable_total if detectable_total else 1.0,
+            **summarize_errors([error for score in scores for error in score["errors"]]),
+            "median_seconds": statistics.median(timings)
+        }
+        results.append(result)
+        print_result(result)
+    return results
+
+def print_result(result: Dict[str, Any]) -> None:
+    error = result["centroid_error_rms"]
+    print(
+        f"{result['mode']:>10} {result['precision']:>10.3f} {result['recall']:>10.3f} "
+        f"{(error if error is not None else float('nan')):>12.3f} {result['median_seconds']:>12.4f}"
+    )
+
+def compare_accuracy(results: List[Dict[str, Any]], baseline: Dict[str, Any],
+                     tolerance: float = 0.02) -> List[Dict[str, Any]]:
+    """
+    精度を保存済みのベースラインと比較し、下がった指標を求める
+
+    Args:
+        results: 今回の評価結果
+        baseline: 保存済みのベースライン（このスクリプトが出力したJSON）
+        tolerance: 精度が下がったと判定する差（0.02の場合は2ポイント以上の低下）
+
+    Returns:
+        検出方法と指標ごとの比較結果（regression が True のものは精度が下がった指標）
+    """
+    previous = {result["mode"]: result for result in baseline.get("results", [])}
+    comparisons = []
+    for result in results:
+        before = previous.get(result["mode"])
+        if before is None:
+            continue
+        for metric in ACCURACY_METRICS:
+            change = result[metric] - before[metric]
+            comparisons.append({
+                "mode": result["mode"],
+                "metric": metric,
+                "baseline": before[metric],
+                "value": result[metric],
+                "change": change,
+                "regression": change < -tolerance
+            })
+    return comparisons
+
+def create_evaluation_set(work_dir: str, count: int, config: SyntheticSkyConfig) -> tuple:
+    """
+    評価用の夜空画像をシードを1ずつ変えて合成し、保存する
+
+    Returns:
+        画像のパスのリストと、画像ごとの正解の星のリストのタプル
+    """
+    image_paths, truths = [], []
+    for index in range(count):
+        sky = generate_synthetic_sky(SyntheticSkyConfig(**{**config.__dict__, "seed": config.seed + index}))
+        image_path, _ = save_synthetic_sky(sky, os.path.join(work_dir, f"synthetic_{index:04d}"))
+        image_paths.append(image_path)
+        truths.append(sky.stars)
+    return image_paths, truths
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="正解の分かっている合成画像で、detect_stars の検出方法ごとの精度と実行時間を評価する"
+    )
+    parser.add_argument("--modes", nargs="+", default=list(DETECTION_MODES), choices=DETECTION_MODES)
+    parser.add_argument("--images", type=int, default=3, help="評価に使う合成画像の枚数")
+    parser.add_argument("--width", type=int, default=SyntheticSkyConfig.width)
+    parser.add_argument("--height", type=int, default=SyntheticSkyConfig.height)
+    parser.add_argument("--stars", type=int, default=SyntheticSkyConfig.star_count)
+    parser.add_argument("--seed", type=int, default=SyntheticSkyConfig.seed)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--match-radius", type=float, default=3.0, help="同じ星とみなす最大の距離（ピクセル）")
+    parser.add_argument("--min-snr", type=float, default=5.0, help="再現率の対象にする星のSN比の下限")
+    parser.add_argument("--output", help="評価結果を保存するJSONファイル")
+    parser.add_argument("--baseline", help="比較するベースラインのJSONファイル（以前の --output）")
+    parser.add_argument("--tolerance", type=float, default=0.02,
+                        help="ベースラインより精度が下がったと判定する差")
+    parser.add_argument("--fail-on-regression", action="store_true",
+                        help="精度が下がった検出方法がある場合に終了コード1で終了する（CI用）")
+    args = parser.parse_args()
+
+    config = SyntheticSkyConfig(width=args.width, height=args.height, star_count=args.stars, seed=args.seed)
+    work_dir = tempfile.mkdtemp()
+    print(f"{'mode':>10} {'precision':>10} {'recall':>10} {'rms_error':>12} {'median':>12}")
+    try:
+        image_paths, truths = create_evaluation_set(work_dir, args.images, config)
+        results = evaluate_modes(image_paths, truths, args.modes, args.repeat, args.match_radius, args.min_snr)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "environment": environment_info(),
+        "config": {**config.__dict__, "images": args.images, "match_radius": args.match_radius,
+                   "min_snr": args.min_snr},
+        "results": results
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        logger.info(f"評価結果を保存しました: {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline.get("config") != report["config"]:
+            logger.warning("ベースラインと評価の設定が異なるため、比較結果は参考値です")
+        comparisons = compare_accuracy(results, baseline, args.tolerance)
+        print(f"\n{'mode':>10} {'metric':>10} {'baseline':>10} {'value':>10} {'change':>8}")
+        for comparison in comparisons:
+            flag = "  REGRESSION" if comparison["regression"] else ""
+            print(
+                f"{comparison['mode']:>10} {comparison['metric']:>10} {comparison['baseline']:>10.3f} "
+                f"{comparison['value']:>10.3f} {comparison['change']:>+8.3f}{flag}"
+            )
+        regressions = [comparison for comparison in comparisons if comparison["regression"]]
+        if regressions:
+            logger.warning(f"ベースラインより精度が下がった指標が{len(regressions)}件あります")
+            if args.fail_on_regression:
+                sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+import os
+import json
+import argparse
+import logging
+from dataclasses import dataclass, asdict, field
+from typing import Any, Dict, List, Tuple
+
+import cv2
+import numpy as np
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+@dataclass
+class SyntheticSkyConfig:
+    """
+    合成する夜空画像の設定
+
+    明るさはデジタル値（0-255、8ビットで保存する前の値）で指定する。
+    等級が1大きくなると明るさは 10^-0.4 倍になり、等級ごとの星の数は 10^magnitude_slope 倍になる。
+    """
+    width: int = 1600
+    height: int = 1200
+    star_count: int = 1000
+    # 最も明るい星と最も暗い星の等級
+    magnitude_range: Tuple[float, float] = (0.0, 6.0)
+    # 等級ごとの星の数の増え方（0.35の場合、1等級暗くなるごとに約2.2倍）
+    magnitude_slope: float = 0.35
+    # magnitude_range[0] の星のピークの明るさ（255を超える部分は飽和する）
+    brightest_peak: float = 600.0
+    # 星の像（ガウス関数）の標準偏差（ピクセル）
+    psf_sigma: float = 1.2
+    # 空の明るさと、上端から下端までの明るさの増加（地平線付近の光害）
+    sky_level: float = 25.0
+    sky_gradient: float = 20.0
+    # 読み出しノイズの標準偏差と、ショットノイズのゲイン（明るさ / gain の分散）
+    noise_sigma: float = 3.0
+    gain: float = 4.0
+    # 星ではない広がった光源（街明かり・月明かりの反射など）の数
+    glow_count: int = 3
+    # 1ピクセルだけ明るいホットピクセルの数
+    hot_pixel_count: int = 20
+    # 画像の下側を覆う地上の景色（木の稜線）の高さの割合（0の場合はなし）
+    horizon_fraction: float = 0.15
+    seed: int = 0
+
+@dataclass
+class SyntheticSky:
+    """合成した夜空画像と、画像に写っている星の正解データ"""
+    image: np.ndarray
+    stars: List[Dict[str, Any]]
+    config: SyntheticSkyConfig = field(default_factory=SyntheticSkyConfig)
+
+def _sample_magnitudes(rng: np.random.Generator, count: int, magnitude_range: Tuple[float, float],
+                       slope: float) -> np.ndarray:
+    """等級の分布（星の数が 10^(slope * 等級) に比例）から等級を生成する（逆関数法）"""
+    low, high = magnitude_range
+    u = rng.random(count)
+    if slope == 0:
+        return low + u * (high - low)
+    base = np.log(10) * slope
+    return low + np.log1p(u * np.expm1(base * (high - low))) / base
+
+def _horizon_profile(rng: np.random.Generator, width: int, height: int, fraction: float) -> np.ndarray:
+    """列ごとの地上の景色の上端のy座標（fraction が0の場合は画像の下端）"""
+    if fraction <= 0:
+        return np.full(width, height, dtype=np.float64)
+    base = height * (1 - fraction)
+    # 滑らかな起伏と、細かい木の稜線を重ねる
+    xs = np.arange(width)
+    ridge = np.zeros(width)
+    for wavelength in (width / 2, width / 5, width / 17):
+        ridge += np.sin(2 * np.pi * xs / wavelength + rng.uniform(0, 2 * np.pi)) * height * fraction * 0.15
+    treeline = np.repeat(rng.uniform(0, height * fraction * 0.4, width // 8 + 1), 8)[:width]
+    return np.clip(base + ridge - treeline, 0, height)
+
+def generate_synthetic_sky(config: SyntheticSkyConfig) -> SyntheticSky:
+    """
+    正解の星の位置が分かっている夜空画像を合成する
+
+    星はサブピクセルの位置にガウス関数の像として描き、空の明るさの勾配、広がった光源、
+    ホットピクセル、地上の景色、ノイズを加える。地上の景色に隠れた星は正解データに含めない。
+
+    Args:
+        config: 合成の設定
+
+    Returns:
+        8ビットのグレースケール画像と、星ごとの座標（x, y、ピクセルの中心が整数）、
+        等級、ピークの明るさ、SN比を含む正解データ
+    """
+    rng = np.random.default_rng(config.seed)
+    width, height = config.width, config.height
+    rows = np.arange(height, dtype=np.float64)[:, None]
+    signal = np.broadcast_to(config.sky_level + config.sky_gradient * rows / max(height - 1, 1),
+                             (height, width)).copy()
+
+    xs = rng.uniform(0, width - 1, config.star_count)
+    ys = rng.uniform(0, height - 1, config.star_count)
+    magnitudes = _sample_magnitudes(rng, config.star_count, config.magnitude_range, config.magnitude_slope)
+    peaks = config.brightest_peak * 10 ** (-0.4 * (magnitudes - config.magnitude_range[0]))
+
+    radius = int(np.ceil(4 * config.psf_sigma))
+    offsets = np.arange(-radius, radius + 1)
+    for x, y, peak in zip(xs, ys, peaks):
+        cx, cy = int(round(x)), int(round(y))
+        x0, x1 = max(0, cx - radius), min(width, cx + radius + 1)
+        y0, y1 = max(0, cy - radius), min(height, cy + radius + 1)
+        gx = np.exp(-0.5 * ((offsets[x0 - cx + radius:x1 - cx + radius] + cx - x) / config.psf_sigma) ** 2)
+        gy = np.exp(-0.5 * ((offsets[y0 - cy + radius:y1 - cy + radius] + cy - y) / config.psf_sigma) ** 2)
+        signal[y0:y1, x0:x1] += peak * gy[:, None] * gx[None, :]
+
+    for _ in range(config.glow_count):
+        gx0, gy0 = rng.uniform(0, width), rng.uniform(0, height)
+        sigma = rng.uniform(10, 40)
+        amplitude = rng.uniform(30, 120)
+        columns = np.arange(width, dtype=np.float64)[None, :]
+        signal += amplitude * np.exp(-0.5 * (((columns - gx0) ** 2 + (rows - gy0) ** 2) / sigma ** 2))
+
+    horizon = _horizon_profile(rng, width, height, config.horizon_fraction)
+    ground = rows >= horizon[None, :]
+    signal[ground] = config.sky_level * 0.2
+
+    noise_std = np.sqrt(config.noise_sigma ** 2 + np.maximum(signal, 0) / config.gain)
+    noisy = signal + rng.normal(0, 1, signal.shape) * noise_std
+
+    hot_x = rng.integers(0, width, config.hot_pixel_count)
+    hot_y = rng.integers(0, height, config.hot_pixel_count)
+    noisy[hot_y, hot_x] = rng.uniform(180, 255, config.hot_pixel_count)
+
+    image = np.clip(np.round(noisy), 0, 255).astype(np.uint8)
+
+    stars = []
+    for x, y, magnitude, peak in zip(xs, ys, magnitudes, peaks):
+        if y >= horizon[int(round(x))]:
+            continue
+        background = signal[int(round(y)), int(round(x))] - peak
+        stars.append({
+            "x": float(x),
+            "y": float(y),
+            "magnitude": float(magnitude),
+            "peak": float(peak),
+            "snr": float(peak / np.sqrt(config.noise_sigma ** 2 + max(background, 0) / config.gain))
+        })
+    stars.sort(key=lambda star: star["magnitude"])
+    return SyntheticSky(image=image, stars=stars, config=config)
+
+def save_synthetic_sky(sky: SyntheticSky, path_prefix: str) -> Tuple[str, str]:
+    """
+    合成した画像をPNGで、正解データをJSONで保存する
+
+    Args:
+        sky: 合成した夜空画像
+        path_prefix: 保存先のパス（拡張子なし）
+
+    Returns:
+        画像と正解データのパスのタプル
+    """
+    image_path, truth_path = f"{path_prefix}.png", f"{path_prefix}.json"
+    cv2.imwrite(image_path, sky.image)
+    with open(truth_path, "w", encoding="utf-8") as f:
+        json.dump({"config": asdict(sky.config), "stars": sky.stars}, f, indent=2)
+    return image_path, truth_path
+
+def load_ground_truth(truth_path: str) -> List[Dict[str, Any]]:
+    """
+    保存した正解データの星のリストを読み込む
+
+    Args:
+        truth_path: 正解データのJSONファイルのパス
+
+    Returns:
+        星のリスト
+    """
+    with open(truth_path, "r", encoding="utf-8") as f:
+        return json.load(f)["stars"]
+
+def main():
+    parser = argparse.ArgumentParser(description="正解の星の位置が分かっている夜空画像を合成して保存する")
+    parser.add_argument("output_dir")
+    parser.add_argument("--count", type=int, default=1, help="合成する画像の枚数（シードを1ずつ変える）")
+    defaults = SyntheticSkyConfig()
+    parser.add_argument("--width", type=int, default=defaults.width)
+    parser.add_argument("--height", type=int, default=defaults.height)
+    parser.add_argument("--stars", type=int, default=defaults.star_count)
+    parser.add_argument("--psf-sigma", type=float, default=defaults.psf_sigma)
+    parser.add_argument("--noise-sigma", type=float, default=defaults.noise_sigma)
+    parser.add_argument("--sky-gradient", type=float, default=defaults.sky_gradient)
+    parser.add_argument("--glows", type=int, default=defaults.glow_count)
+    parser.add_argument("--horizon", type=float, default=defaults.horizon_fraction)
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+    args = parser.parse_args()
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    for index in range(args.count):
+        config = SyntheticSkyConfig(
+            width=args.width, height=args.height, star_count=args.stars, psf_sigma=args.psf_sigma,
+            noise_sigma=args.noise_sigma, sky_gradient=args.sky_gradient, glow_count=args.glows,
+            horizon_fraction=args.horizon, seed=args.seed + index
+        )
+        sky = generate_synthetic_sky(config)
+        image_path, _ = save_synthetic_sky(sky, os.path.join(args.output_dir, f"synthetic_{config.seed:04d}"))
+        logger.info(f"夜空画像を合成しました: {image_path}（星{len(sky.stars)}個）")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,28 @@
+import os
+import sys
+import tempfile
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.core.executor import PipelineExecutor
+
+@pytest.fixture
+def app_client(monkeypatch):
+    """
+    静的ファイル用のディレクトリ（static/assets, static/images）を持つ一時ディレクトリでアプリを読み込む
+    画像処理はスレッドで実行する
+
+    Returns:
+        テストクライアントとappモジュールのタプル
+    """
+    from fastapi.testclient import TestClient
+
+    work_dir = tempfile.mkdtemp()
+    os.makedirs(os.path.join(work_dir, "static", "assets"))
+    os.makedirs(os.path.join(work_dir, "static", "images"))
+    monkeypatch.chdir(work_dir)
+
+    import app.main as main
+    monkeypatch.setattr(main, "pipeline_executor", PipelineExecutor(max_workers=2, use_processes=False))
+    return TestClient(main.app), main
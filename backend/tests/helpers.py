@@ -0,0 +1,63 @@
+import cv2
+import numpy as np
+from PIL import Image
+
+# 複数のテストで使う画像と星のデータを生成する関数
+
+def create_star_image_bytes(width=1600, height=1200, star_count=60, seed=0):
+    """
+    テスト用の星空画像を生成してPNGのバイト列として返す
+
+    Args:
+        width: 画像の幅
+        height: 画像の高さ
+        star_count: 描画する星の数
+        seed: 乱数シード
+
+    Returns:
+        PNG形式の画像バイト列
+    """
+    rng = np.random.default_rng(seed)
+    image = np.zeros((height, width, 3), dtype=np.uint8)
+    for _ in range(star_count):
+        x = int(rng.integers(20, width - 20))
+        y = int(rng.integers(20, height - 20))
+        radius = int(rng.integers(3, 7))
+        cv2.circle(image, (x, y), radius, (255, 255, 255), -1)
+    success, encoded = cv2.imencode(".png", image)
+    assert success
+    return encoded.tobytes()
+
+def create_sky_image(width=320, height=240, seed=0):
+    """テスト用に、暗い背景に星とラインを描いたPIL画像を生成する"""
+    rng = np.random.default_rng(seed)
+    image = rng.normal(15, 4, (height, width, 3)).clip(0, 255).astype(np.uint8)
+    for _ in range(60):
+        y, x = int(rng.integers(2, height - 2)), int(rng.integers(2, width - 2))
+        image[y - 1:y + 2, x - 1:x + 2] = 230
+    image[height // 2, 20:width - 20] = (255, 215, 0)
+    return Image.fromarray(image)
+
+def create_random_stars(count, width=800, height=600, seed=0):
+    """
+    テスト用にランダムな星のリストを作成する
+
+    Args:
+        count: 星の数
+        width: 画像の幅
+        height: 画像の高さ
+        seed: 乱数シード
+
+    Returns:
+        星のリスト
+    """
+    rng = np.random.default_rng(seed)
+    return [
+        {
+            "x": int(rng.integers(0, width)),
+            "y": int(rng.integers(0, height)),
+            "brightness": float(rng.integers(50, 256)),
+            "area": float(rng.integers(3, 30))
+        }
+        for _ in range(count)
+    ]
@@ -0,0 +1,170 @@
+import os
+import sys
+import time
+import uuid
+import logging
+import tempfile
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.core.artifact_store import ArtifactStore
+from helpers import create_star_image_bytes
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def write_file(directory, name, size=100, age=0):
+    """
+    テスト用のファイルを作成する
+
+    Args:
+        directory: 作成先のディレクトリ
+        name: ファイル名
+        size: ファイルの大きさ（バイト）
+        age: 更新時刻を現在から何秒前にするか
+
+    Returns:
+        作成したファイルのパス
+    """
+    path = os.path.join(directory, name)
+    with open(path, "wb") as f:
+        f.write(bytes(size))
+    if age:
+        mtime = time.time() - age
+        os.utime(path, (mtime, mtime))
+    return path
+
+def constellation_name():
+    return f"{uuid.uuid4()}_constellation.jpg"
+
+def test_ttl_expiry_removes_files_and_notifies():
+    """保存期限を過ぎた生成物がファイルごと削除され、削除が通知されるかテスト"""
+    work_dir = tempfile.mkdtemp()
+    evicted = []
+    store = ArtifactStore(ttl_seconds=60, on_evict=evicted.append)
+    now = time.time()
+    short, long = constellation_name(), constellation_name()
+    store.add(short, write_file(work_dir, short), now=now)
+    store.add(long, write_file(work_dir, long), ttl_seconds=3600, now=now)
+
+    store.sweep(now=now + 30)
+    assert evicted == []
+    stats = store.sweep(now=now + 61)
+    assert evicted == [short]
+    assert not os.path.exists(os.path.join(work_dir, short))
+    assert os.path.exists(os.path.join(work_dir, long))
+    assert (stats["artifacts"], stats["bytes"], stats["expired"]) == (1, 100, 1)
+
+def test_byte_budget_evicts_least_recently_used():
+    """合計バイト数が上限を超えた場合に、最も長く参照されていない生成物から削除するかテスト"""
+    work_dir = tempfile.mkdtemp()
+    store = ArtifactStore(max_bytes=250)
+    names = [constellation_name() for _ in range(3)]
+    store.add(names[0], write_file(work_dir, names[0]))
+    store.add(names[1], write_file(work_dir, names[1]))
+    assert store.touch(names[0])
+    store.add(names[2], write_file(work_dir, names[2]))
+
+    assert not os.path.exists(os.path.join(work_dir, names[1]))
+    assert os.path.exists(os.path.join(work_dir, names[0]))
+    stats = store.stats()
+    assert (stats["artifacts"], stats["bytes"], stats["evicted"]) == (2, 200, 1)
+    assert stats["occupancy"] == 200 / 250
+
+    # 上限より大きい生成物でも、登録した直後のものは削除しない
+    big = constellation_name()
+    store.add(big, write_file(work_dir, big, size=1000))
+    assert os.path.exists(os.path.join(work_dir, big))
+    assert store.stats()["artifacts"] == 1
+    # 次の定期的な削除では、1個で上限を超える生成物も削除する
+    store.sweep()
+    assert not os.path.exists(os.path.join(work_dir, big))
+    assert (store.stats()["artifacts"], store.stats()["bytes"]) == (0, 0)
+
+def test_byte_budget_keeps_the_artifact_just_added():
+    """登録と容量の確認の間に別の生成物が参照されても、残すのは登録した生成物であることをテスト"""
+    work_dir = tempfile.mkdtemp()
+    store = ArtifactStore(max_bytes=250)
+    names = [constellation_name() for _ in range(3)]
+    store.add(names[0], write_file(work_dir, names[0]))
+    store.add(names[1], write_file(work_dir, names[1]))
+
+    # 別のリクエストが古い生成物を参照し、最も新しく参照されたものが登録した生成物でなくなる状況を再現する
+    enforce_budget = store._enforce_budget
+    def touch_then_enforce(keep=None):
+        store.touch(names[0])
+        enforce_budget(keep=keep)
+    store._enforce_budget = touch_then_enforce
+    store.add(names[2], write_file(work_dir, names[2], size=200))
+
+    assert os.path.exists(os.path.join(work_dir, names[2]))
+    assert not any(os.path.exists(os.path.join(work_dir, name)) for name in names[:2])
+    assert (store.stats()["artifacts"], store.stats()["bytes"]) == (1, 200)
+
+def test_sweep_removes_only_old_untracked_temp_files():
+    """一時ディレクトリの未登録の古い一時ファイルだけを削除し、処理中・登録済み・無関係のファイルは残すかテスト"""
+    temp_dir = tempfile.mkdtemp()
+    upload = str(uuid.uuid4())
+    old_files = [
+        write_file(temp_dir, f"{upload}.jpg", age=3600),
+        write_file(temp_dir, f"{upload}_optimized.jpg", age=3600),
+        write_file(temp_dir, f"{upload}_optimized_constellation.jpg", age=3600),
+        write_file(temp_dir, f"{uuid.uuid4()}.heic", age=3600)
+    ]
+    recent = write_file(temp_dir, f"{uuid.uuid4()}_optimized.jpg", age=10)
+    # UUIDの名前でないファイルは、同じディレクトリを使う他のプログラムのものとして残す
+    unrelated = [
+        write_file(temp_dir, "notes.txt", age=3600),
+        write_file(temp_dir, "temp_photo.heic", age=3600),
+        write_file(temp_dir, "photo_optimized.jpg", age=3600)
+    ]
+    tracked_name = constellation_name()
+    tracked = write_file(temp_dir, tracked_name, age=3600)
+
+    store = ArtifactStore(temp_dirs=[temp_dir], orphan_grace_seconds=600)
+    store.add(tracked_name, tracked)
+    stats = store.sweep()
+
+    assert not any(os.path.exists(path) for path in old_files)
+    assert all(os.path.exists(path) for path in [recent, tracked] + unrelated)
+    assert (stats["orphans_removed"], stats["orphan_bytes_removed"]) == (4, 400)
+
+def test_sweep_adopts_untracked_images_in_managed_dirs():
+    """管理ディレクトリの未登録の星座画像を登録し、更新時刻から保存期限を判定するかテスト"""
+    managed_dir = tempfile.mkdtemp()
+    expired = write_file(managed_dir, constellation_name(), age=7200)
+    kept = write_file(managed_dir, constellation_name(), age=60)
+
+    store = ArtifactStore(ttl_seconds=3600, managed_dirs=[managed_dir])
+    stats = store.sweep()
+    assert not os.path.exists(expired) and os.path.exists(kept)
+    assert (stats["artifacts"], stats["expired"], stats["sweeps"]) == (1, 1, 1)
+    assert stats["last_sweep"] is not None
+
+def test_evicted_images_are_removed_from_index(app_client, monkeypatch):
+    """削除された生成物が画像のインデックスからも削除され、/api/pipeline/stats に使用状況が出るかテスト"""
+    from app.core.image_index import ImageIndex
+
+    client, main = app_client
+    index = ImageIndex()
+    monkeypatch.setattr(main, "image_index", index)
+    monkeypatch.setattr(main, "artifact_store", ArtifactStore(ttl_seconds=60, on_evict=index.discard))
+    monkeypatch.setattr(main, "generate_constellation_content", lambda keyword: (f"{keyword}座", "物語", None))
+
+    files = {"image": ("sky.png", create_star_image_bytes(seed=7), "image/png")}
+    image_path = client.post("/api/generate-constellation", data={"keyword": "海"}, files=files).json()["image_path"]
+    image_name = image_path.rsplit("/", 1)[1]
+    assert client.get(image_path).status_code == 200
+    assert client.get("/api/pipeline/stats").json()["artifacts"]["artifacts"] == 1
+
+    main.artifact_store.sweep(now=time.time() + 120)
+    assert index.get(image_name) is None
+    assert client.get(image_path).status_code == 404
+
+if __name__ == "__main__":
+    test_ttl_expiry_removes_files_and_notifies()
+    test_byte_budget_evicts_least_recently_used()
+    test_byte_budget_keeps_the_artifact_just_added()
+    test_sweep_removes_only_old_untracked_temp_files()
+    test_sweep_adopts_untracked_images_in_managed_dirs()
+    logger.info("すべてのテストが成功しました")
@@ -0,0 +1,128 @@
+import os
+import sys
+import asyncio
+import logging
+import threading
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.core.executor import PipelineExecutor
+from helpers import create_star_image_bytes
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def test_batch_endpoint_deduplicates_keywords_and_reports_item_errors(app_client, monkeypatch):
+    """同じキーワードのテキスト生成が1回にまとまり、無効な画像だけがエラーになることを確認する"""
+    client, main = app_client
+
+    calls = []
+    lock = threading.Lock()
+
+    def fake_generate_constellation_content(keyword):
+        with lock:
+            calls.append(keyword)
+        return f"{keyword}座", f"{keyword}の物語", None
+
+    monkeypatch.setattr(main, "generate_constellation_content", fake_generate_constellation_content)
+
+    files = [
+        ("images", ("a.png", create_star_image_bytes(seed=1), "image/png")),
+        ("images", ("b.txt", b"not an image", "text/plain")),
+        ("images", ("c.png", create_star_image_bytes(seed=2), "image/png")),
+        ("images", ("d.png", create_star_image_bytes(seed=3), "image/png")),
+    ]
+    data = {"keywords": ["海", "海", " 海 ", "森"]}
+    response = client.post("/api/generate-constellation/batch", data=data, files=files)
+
+    assert response.status_code == 200
+    body = response.json()
+    assert body["succeeded"] == 3
+    assert body["failed"] == 1
+    assert len(calls) == 2
+    assert set(calls) == {"海", "森"}
+
+    results = body["results"]
+    assert [result["index"] for result in results] == [0, 1, 2, 3]
+    assert results[1]["status"] == "error"
+    assert results[1]["filename"] == "b.txt"
+    for result in (results[0], results[2], results[3]):
+        assert result["status"] == "ok"
+        assert result["stars"]
+        assert result["image_path"].startswith("/api/images/")
+    assert results[3]["constellation_name"] == "森座"
+
+def test_batch_endpoint_rejects_mismatched_keywords(app_client):
+    """キーワードの数が1つでも画像と同じ数でもない場合は400を返すことを確認する"""
+    client, _ = app_client
+
+    files = [("images", (f"{i}.png", create_star_image_bytes(seed=i), "image/png")) for i in range(3)]
+    response = client.post("/api/generate-constellation/batch", data={"keywords": ["海", "森"]}, files=files)
+
+    assert response.status_code == 400
+
+def test_batch_endpoint_reserves_capacity_for_every_image(app_client, monkeypatch):
+    """バッチの画像がキューの上限を超える場合は400、空きが足りない場合は1件も投入せずに503を返すことを確認する"""
+    client, main = app_client
+    monkeypatch.setattr(main, "pipeline_executor", PipelineExecutor(max_workers=1, max_queue=2, use_processes=False))
+    profile = {"name": "海座", "story": "物語", "shape": "line", "star_count": 5, "brightness": "high", "pattern": "linear"}
+    monkeypatch.setattr(main, "OPENAI_GENERATION_MODE", "combined")
+    monkeypatch.setattr(main, "generate_constellation_profile", lambda keyword: profile)
+
+    files = [("images", (f"{i}.png", create_star_image_bytes(seed=i), "image/png")) for i in range(4)]
+    response = client.post("/api/generate-constellation/batch", data={"keywords": ["海"]}, files=files)
+    assert response.status_code == 400
+
+    # 他のリクエストが2件分の枠を使っている状態では、2枚のバッチは受け付けない
+    main.pipeline_executor.reserve(2)
+    response = client.post("/api/generate-constellation/batch", data={"keywords": ["海"]}, files=files[:2])
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == str(main.pipeline_executor.retry_after)
+    assert main.pipeline_executor.stats()["submitted"] == 0
+
+    main.pipeline_executor.release(2)
+    response = client.post("/api/generate-constellation/batch", data={"keywords": ["海"]}, files=files[:3])
+    assert response.status_code == 200 and response.json()["succeeded"] == 3
+    assert [result["constellation_name"] for result in response.json()["results"]] == ["海座"] * 3
+    assert main.pipeline_executor.in_flight == 0
+
+def test_batch_returns_reserved_slots_when_submit_fails(app_client, monkeypatch):
+    """バッチの途中でジョブの投入に失敗した場合に、確保した枠がすべて返ることを確認する"""
+    _, main = app_client
+    executor = PipelineExecutor(max_workers=1, max_queue=2, use_processes=False)
+    monkeypatch.setattr(main, "pipeline_executor", executor)
+    monkeypatch.setattr(main, "generate_constellation_content", lambda keyword: (f"{keyword}座", "物語", None))
+
+    pool = executor._get_pool()
+    submit = pool.submit
+    calls = []
+    def failing_submit(*args, **kwargs):
+        calls.append(args)
+        if len(calls) == 2:
+            raise RuntimeError("ワーカープールが停止しています")
+        return submit(*args, **kwargs)
+    monkeypatch.setattr(pool, "submit", failing_submit)
+
+    items = [
+        {"index": i, "filename": f"{i}.png", "keyword": "海", "content": create_star_image_bytes(seed=i), "error": None}
+        for i in range(3)
+    ]
+
+    async def scenario():
+        try:
+            await main.process_image_batch(items)
+            raise AssertionError("投入の失敗が送出されませんでした")
+        except RuntimeError:
+            pass
+        # 投入済みのジョブの枠は、ワーカーでの実行が終わるか取り消された時点で返る
+        for _ in range(100):
+            if executor.in_flight == 0:
+                break
+            await asyncio.sleep(0.02)
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        executor.shutdown()
+    assert len(calls) == 2
+    assert executor.in_flight == 0
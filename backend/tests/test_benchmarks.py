@@ -0,0 +1,41 @@
+import os
+import sys
+import logging
+import tempfile
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.benchmark_hot_paths import (
+    run_image_benchmarks, run_star_benchmarks, compare_with_baseline, IMAGE_BENCHMARKS, STAR_BENCHMARKS
+)
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def test_benchmarks_cover_every_hot_path():
+    """小さい入力で全てのベンチマークが実行でき、名前に入力の大きさが含まれるかテスト"""
+    work_dir = tempfile.mkdtemp()
+    results = run_image_benchmarks([0.1], list(IMAGE_BENCHMARKS), 1, work_dir)
+    results += run_star_benchmarks([30], list(STAR_BENCHMARKS), 1, work_dir)
+    names = [result["benchmark"] for result in results]
+    assert names == [f"{name}[0.1MP]" for name in IMAGE_BENCHMARKS] + [f"{name}[30stars]" for name in STAR_BENCHMARKS]
+    assert all(result["median_seconds"] >= 0 and result["runs"] == 1 for result in results)
+
+def test_compare_with_baseline_flags_regressions():
+    """ベースラインより許容範囲を超えて遅くなった処理だけが検出されるかテスト"""
+    def result(name, seconds):
+        return {"benchmark": name, "median_seconds": seconds}
+    baseline = {"results": [result("a", 1.0), result("b", 1.0), result("tiny", 0.0001), result("removed", 1.0)]}
+    current = [result("a", 1.5), result("b", 1.1), result("tiny", 0.0005), result("new", 1.0)]
+
+    comparisons = {c["benchmark"]: c for c in compare_with_baseline(current, baseline, tolerance=0.2)}
+    assert set(comparisons) == {"a", "b", "tiny"}
+    assert comparisons["a"]["regression"] and abs(comparisons["a"]["change"] - 0.5) < 1e-9
+    assert not comparisons["b"]["regression"]
+    # 計測誤差の範囲の短い処理は遅くなったと判定しない
+    assert not comparisons["tiny"]["regression"]
+
+if __name__ == "__main__":
+    test_benchmarks_cover_every_hot_path()
+    test_compare_with_baseline_flags_regressions()
+    logger.info("すべてのテストが成功しました")
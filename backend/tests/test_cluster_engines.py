@@ -0,0 +1,76 @@
+import os
+import sys
+import time
+import logging
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.core.star_detection import cluster_stars, _radius_pairs
+from helpers import create_random_stars
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def test_grid_engine_matches_greedy_engine():
+    """グリッドエンジンが総当たりの実装と同じクラスタを作ることを確認する"""
+    for count, seed in [(5, 1), (40, 2), (200, 3), (400, 4)]:
+        stars = create_random_stars(count, seed=seed)
+        for max_distance in (20, 50, 120):
+            greedy = cluster_stars(stars, max_distance=max_distance, engine="greedy")
+            grid = cluster_stars(stars, max_distance=max_distance, engine="grid")
+            assert grid == greedy, (count, max_distance)
+
+def test_grid_engine_scales_to_thousands_of_stars():
+    """グリッドエンジンが数千個の星でも短時間でクラスタリングできることを確認する"""
+    stars = create_random_stars(5000, width=6000, height=4000, seed=5)
+
+    started_at = time.perf_counter()
+    clusters = cluster_stars(stars, max_distance=50, engine="grid")
+    elapsed = time.perf_counter() - started_at
+
+    logger.info(f"5000個の星を{elapsed:.3f}秒で{len(clusters)}個のクラスタに分割しました")
+    assert clusters
+    assert all(len(cluster) <= 12 for cluster in clusters)
+    assert elapsed < 10
+
+def test_radius_pairs_match_brute_force():
+    """グリッドで求めた半径内のペアが総当たりの距離行列と一致することを確認する"""
+    stars = create_random_stars(600, seed=6)
+    xs = np.array([star["x"] for star in stars], dtype=np.float64)
+    ys = np.array([star["y"] for star in stars], dtype=np.float64)
+
+    lefts, rights = _radius_pairs(xs, ys, 50)
+    pairs = {(min(i, j), max(i, j)) for i, j in zip(lefts.tolist(), rights.tolist())}
+    assert len(pairs) == len(lefts)
+
+    distances = np.sqrt((xs[:, None] - xs[None, :])**2 + (ys[:, None] - ys[None, :])**2)
+    rows, cols = np.nonzero(distances <= 50)
+    expected = {(i, j) for i, j in zip(rows.tolist(), cols.tolist()) if i < j}
+    assert pairs == expected
+
+def test_union_find_engine_groups_connected_stars():
+    """union-findエンジンのクラスタが星座の大きさに収まり、離れた星を混ぜないことを確認する"""
+    # 十分に離れた3つの星の列（5個, 30個, 2個）
+    stars = []
+    for row, size in enumerate((5, 30, 2)):
+        for k in range(size):
+            stars.append({"x": 10 + k * 20, "y": 100 + row * 200, "brightness": 255.0 - len(stars), "area": 10.0})
+
+    clusters = cluster_stars(stars, max_distance=25, max_stars=12, engine="union_find")
+
+    rows = [{star["y"] for star in cluster} for cluster in clusters]
+    assert all(len(row) == 1 for row in rows)
+    assert all(len(cluster) <= 12 for cluster in clusters)
+    sizes = sorted(len(cluster) for cluster in clusters)
+    # 2個の列は最小星数に満たないため除外される
+    assert sizes == [5, 10, 10, 10]
+    for cluster in clusters:
+        brightness = [star["brightness"] for star in cluster]
+        assert brightness == sorted(brightness, reverse=True)
+
+if __name__ == "__main__":
+    test_grid_engine_matches_greedy_engine()
+    test_grid_engine_scales_to_thousands_of_stars()
+    test_radius_pairs_match_brute_force()
+    test_union_find_engine_groups_connected_stars()
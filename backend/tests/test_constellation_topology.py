@@ -0,0 +1,97 @@
+import os
+import sys
+import logging
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.core.constellation import compute_constellation_edges, render_constellation
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def nearest_neighbor_walk(cluster_points):
+    """従来のPythonループによる一筆書き（比較用）"""
+    connected = [0]
+    remaining = list(range(1, len(cluster_points)))
+    edges = []
+    while remaining:
+        last = connected[-1]
+        closest_idx = 0
+        min_distance = float('inf')
+        for i, k in enumerate(remaining):
+            distance = np.sqrt((cluster_points[last][0] - cluster_points[k][0])**2
+                               + (cluster_points[last][1] - cluster_points[k][1])**2)
+            if distance < min_distance:
+                min_distance = distance
+                closest_idx = i
+        closest = remaining.pop(closest_idx)
+        connected.append(closest)
+        edges.append((last, closest))
+    return edges
+
+def total_length(cluster_points, edges):
+    """ラインの総延長を計算する"""
+    points = np.asarray(cluster_points, dtype=np.float64)
+    return sum(np.linalg.norm(points[i] - points[j]) for i, j in edges)
+
+def random_clusters(count=50, seed=0):
+    """テスト用にランダムな星座の点群を作成する"""
+    rng = np.random.default_rng(seed)
+    clusters = []
+    for _ in range(count):
+        size = int(rng.integers(3, 13))
+        # 整数座標にして距離が同じ点の組も含める
+        clusters.append([(int(x), int(y)) for x, y in rng.integers(0, 60, size=(size, 2))])
+    return clusters
+
+def test_nearest_topology_matches_legacy_walk():
+    """nearestモードが従来の一筆書きと同じ順序で点を繋ぐことを確認する"""
+    for cluster_points in random_clusters():
+        assert compute_constellation_edges(cluster_points, "nearest") == nearest_neighbor_walk(cluster_points)
+
+def test_mst_topology_spans_cluster_with_shortest_lines():
+    """mstモードが全ての点を繋ぐ木になり、一筆書きより総延長が短いことを確認する"""
+    for cluster_points in random_clusters(seed=1):
+        edges = compute_constellation_edges(cluster_points, "mst")
+        assert len(edges) == len(cluster_points) - 1
+
+        reached = {0}
+        for i, j in edges:
+            assert i in reached
+            reached.add(j)
+        assert reached == set(range(len(cluster_points)))
+
+        mst_length = total_length(cluster_points, edges)
+        walk_length = total_length(cluster_points, nearest_neighbor_walk(cluster_points))
+        assert mst_length <= walk_length + 1e-9
+
+def test_mst_topology_with_extra_edges():
+    """extra_edgesを指定すると木に含まれない短い辺が追加されることを確認する"""
+    cluster_points = [(0, 0), (10, 0), (10, 10), (0, 10), (50, 50)]
+    tree = compute_constellation_edges(cluster_points, "mst")
+    edges = compute_constellation_edges(cluster_points, "mst", extra_edges=1)
+
+    assert edges[:len(tree)] == tree
+    assert len(edges) == len(tree) + 1
+    extra = tuple(sorted(edges[-1]))
+    assert extra not in {tuple(sorted(edge)) for edge in tree}
+    assert extra in {(0, 1), (1, 2), (2, 3), (0, 3)}
+
+def test_render_constellation_draws_all_lines():
+    """描画結果のライン数が選択した繋ぎ方と一致することを確認する"""
+    image = np.zeros((600, 800), dtype=np.uint8)
+    points = [[(100, 100), (150, 120), (200, 180), (120, 200)], [(500, 400), (550, 420), (600, 380)]]
+
+    for topology in ("mst", "nearest"):
+        rendered, constellation_data = render_constellation(image, points, topology=topology)
+        assert rendered.size == (800, 600)
+        assert len(constellation_data["stars"]) == 7
+        assert len(constellation_data["lines"]) == 5
+        assert rendered.getpixel((100, 100)) == (255, 255, 255)
+
+if __name__ == "__main__":
+    test_nearest_topology_matches_legacy_walk()
+    test_mst_topology_spans_cluster_with_shortest_lines()
+    test_mst_topology_with_extra_edges()
+    test_render_constellation_draws_all_lines()
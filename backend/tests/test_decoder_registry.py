@@ -0,0 +1,148 @@
+import io
+import os
+import sys
+import struct
+import logging
+import tempfile
+import cv2
+import numpy as np
+from PIL import Image
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.core.image_processing import (
+    DecoderRegistry, decoder_registry, decode_image, decode_image_gray, save_uploaded_image
+)
+from app.core.pipeline import detect_constellation_stars
+from app.core.star_detection import load_image
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def create_color_image(width=160, height=120, seed=0):
+    """テスト用のBGR画像を生成する"""
+    rng = np.random.default_rng(seed)
+    return rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+
+def test_registry_picks_one_in_process_backend_per_format():
+    """主要な形式にインプロセスのデコーダーが1つずつ選ばれているかテスト"""
+    backends = decoder_registry.backends()
+    logger.info(f"登録されたデコーダー: {backends}")
+    for image_format in ("jpeg", "png", "webp"):
+        assert backends[image_format] == "opencv"
+    assert backends["gif"] == "pillow"
+    # AVIF・HEICはプラグインかImageMagickがある場合だけ登録される
+    assert backends.get("avif") in (None, "pillow", "imagemagick")
+    assert backends.get("heic") in (None, "pillow", "imagemagick")
+
+def test_decode_records_backend_and_time():
+    """デコードに使ったデコーダーと所要時間が記録されるかテスト"""
+    registry = DecoderRegistry()
+    registry.register("png", "opencv")
+    registry.register("gif", "pillow")
+    image = create_color_image()
+
+    png = cv2.imencode(".png", image)[1].tobytes()
+    decoded, record = registry.decode(png)
+    assert np.array_equal(decoded, image)
+    assert (record.format, record.backend, record.success) == ("png", "opencv", True)
+    assert record.seconds >= 0
+
+    buffer = io.BytesIO()
+    Image.fromarray(image[:, :, ::-1]).convert("P").save(buffer, "GIF")
+    gray, record = registry.decode(buffer.getvalue(), grayscale=True)
+    assert gray.shape == (120, 160) and record.backend == "pillow"
+
+    stats = registry.stats.stats()
+    assert stats["png"]["backend"] == "opencv" and stats["png"]["decodes"] == 1
+    assert stats["gif"]["backend"] == "pillow"
+    assert stats["png"]["average_seconds"] == stats["png"]["total_seconds"]
+
+def test_broken_or_unsupported_images_are_tried_once():
+    """壊れた画像は1つのデコーダーで1回だけ試し、対応するデコーダーがない形式は試さないかテスト"""
+    registry = DecoderRegistry()
+    registry.register("png", "opencv")
+
+    broken = bytearray(cv2.imencode(".png", create_color_image())[1].tobytes())
+    broken[60:200] = bytes(140)
+    image, record = registry.decode(bytes(broken))
+    assert image is None and record.success is False
+    assert registry.stats.stats()["png"] == {
+        **registry.stats.stats()["png"], "decodes": 1, "failures": 1
+    }
+
+    jpeg = cv2.imencode(".jpg", create_color_image())[1].tobytes()
+    assert registry.decode(jpeg) == (None, None)
+    assert registry.decode(b"not an image at all") == (None, None)
+
+    # 画素数が上限を超える画像はデコーダーを呼び出さない
+    bomb = b"\x89PNG\r\n\x1a\n" + struct.pack(">I4sII", 13, b"IHDR", 100000, 100000) + b"\x08\x02\x00\x00\x00"
+    assert registry.decode(bomb) == (None, None)
+    assert registry.stats.stats()["png"]["decodes"] == 1
+
+    try:
+        registry.register("png", "unknown")
+        assert False, "未対応のデコーダーを登録できてしまいました"
+    except ValueError:
+        pass
+
+def test_file_functions_share_the_registry():
+    """load_image・save_uploaded_image・decode_image がレジストリのデコーダーを使うかテスト"""
+    image = create_color_image(seed=1)
+    jpeg = cv2.imencode(".jpg", image)[1].tobytes()
+    webp = cv2.imencode(".webp", image, [cv2.IMWRITE_WEBP_QUALITY, 101])[1].tobytes()
+
+    assert np.array_equal(decode_image(webp), image)
+    assert decode_image_gray(webp).shape == (120, 160)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        saved_jpeg = save_uploaded_image(jpeg, temp_dir)
+        with open(saved_jpeg, "rb") as f:
+            assert f.read() == jpeg  # JPEGは再エンコードせずにそのまま保存する
+
+        saved_webp = save_uploaded_image(webp, temp_dir)
+        assert load_image(saved_webp).shape == (120, 160, 3)
+        assert load_image(saved_webp, grayscale=True).shape == (120, 160)
+
+        try:
+            save_uploaded_image(b"not an image at all", temp_dir)
+            assert False, "画像でないデータを保存できてしまいました"
+        except ValueError:
+            pass
+
+def test_pipeline_reports_decoder():
+    """パイプラインの結果にデコードの記録が含まれるかテスト"""
+    image = np.zeros((300, 400), dtype=np.uint8)
+    for x, y in [(50, 60), (120, 200), (300, 80), (350, 250)]:
+        cv2.circle(image, (x, y), 3, 255, -1)
+    result = detect_constellation_stars(cv2.imencode(".png", image)[1].tobytes(), use_cache=False)
+    assert result["decode"]["format"] == "png"
+    assert result["decode"]["backend"] == "opencv"
+    assert result["decode"]["success"] is True
+
+def test_legacy_path_reports_decodes(app_client, monkeypatch):
+    """一時ファイルを経由する従来の処理のデコードも /api/pipeline/stats に集計されるかテスト"""
+    from helpers import create_star_image_bytes
+    from app.core.image_processing import DecodeStats
+
+    client, main = app_client
+    monkeypatch.setattr(main, "IN_MEMORY_PIPELINE", False)
+    monkeypatch.setattr(main, "decode_stats", DecodeStats())
+    monkeypatch.setattr(main, "generate_constellation_content", lambda keyword: (f"{keyword}座", "物語", None))
+
+    files = {"image": ("sky.png", create_star_image_bytes(seed=11), "image/png")}
+    response = client.post("/api/generate-constellation", data={"keyword": "海"}, files=files)
+    assert response.status_code == 200
+
+    # PNGは保存時にJPEGへ変換するためにデコードし、最適化では保存したJPEGを縮小デコードする
+    decodes = client.get("/api/pipeline/stats").json()["decoders"]["decodes"]
+    assert decodes["png"]["decodes"] == 1 and decodes["png"]["failures"] == 0
+    assert decodes["jpeg"]["decodes"] == 1
+
+if __name__ == "__main__":
+    test_registry_picks_one_in_process_backend_per_format()
+    test_decode_records_backend_and_time()
+    test_broken_or_unsupported_images_are_tried_once()
+    test_file_functions_share_the_registry()
+    test_pipeline_reports_decoder()
+    logger.info("すべてのテストが成功しました")
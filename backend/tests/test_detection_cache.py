@@ -0,0 +1,106 @@
+import os
+import sys
+import time
+import logging
+import tempfile
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.core.detection_cache import StarFieldCache
+from app.core.star_detection import StarField
+from app.core.star_table import StarTable
+from app.core.pipeline import detect_constellation_stars, DETECTION_PARAMS
+from helpers import create_star_image_bytes
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def create_entry(value):
+    """テスト用の最適化済み画像とStarFieldを作成する"""
+    optimized = np.full((100, 100), value, dtype=np.uint8)
+    stars = StarTable.from_dicts([{"x": value, "y": value, "brightness": 200.0, "area": 10.0}])
+    return optimized, StarField(stars=stars, clusters=[stars])
+
+def test_cache_key_depends_on_image_and_params():
+    """キャッシュキーが画像の内容と検出パラメータの両方に依存することを確認する"""
+    image = np.zeros((10, 10, 3), dtype=np.uint8)
+    other = image.copy()
+    other[5, 5] = 1
+
+    key = StarFieldCache.make_key(image, DETECTION_PARAMS)
+    assert key == StarFieldCache.make_key(image.copy(), dict(DETECTION_PARAMS))
+    assert key != StarFieldCache.make_key(other, DETECTION_PARAMS)
+    assert key != StarFieldCache.make_key(image, {**DETECTION_PARAMS, "max_distance": 60})
+
+def test_memory_tier_evicts_least_recently_used():
+    """メモリ層がバイト数の上限を超えたら最も古いエントリを破棄することを確認する"""
+    cache = StarFieldCache(max_bytes=25000)
+    for value in range(3):
+        cache.put(f"key{value}", *create_entry(value))
+
+    assert cache.get("key0") is None
+    assert cache.get("key1") is not None
+    cache.put("key3", *create_entry(3))
+    assert cache.get("key2") is None
+    assert cache.get("key1") is not None
+
+    stats = cache.stats()
+    logger.info(f"キャッシュの統計: {stats}")
+    assert stats["bytes"] <= stats["max_bytes"]
+    assert stats["evictions"] == 2
+    assert stats["memory_hits"] == 2
+    assert stats["misses"] == 2
+
+def test_disk_tier_survives_new_instance():
+    """ディスク層に保存した結果が別のインスタンスからも取得できることを確認する"""
+    cache_dir = tempfile.mkdtemp()
+    StarFieldCache(cache_dir=cache_dir).put("abcdef", *create_entry(7))
+
+    cache = StarFieldCache(cache_dir=cache_dir)
+    optimized, star_field = cache.get("abcdef")
+    assert optimized[0, 0] == 7
+    assert star_field.stars.x[0] == 7
+    assert cache.stats()["disk_hits"] == 1
+    assert cache.get("abcdef") is not None
+    assert cache.stats()["memory_hits"] == 1
+
+def test_disk_tier_respects_byte_budget():
+    """ディスク層の合計バイト数が上限を超えた場合に、最も長く使われていないファイルから削除されることを確認する"""
+    cache_dir = tempfile.mkdtemp()
+    writer = StarFieldCache(max_bytes=0, cache_dir=cache_dir)
+    writer.put("aa0000", *create_entry(0))
+    size = os.path.getsize(writer._disk_path("aa0000"))
+
+    cache = StarFieldCache(max_bytes=0, cache_dir=cache_dir, disk_max_bytes=size * 2 + size // 2)
+    cache.put("bb0000", *create_entry(1))
+    # 古いファイルを使うと、削除の順番が後になる
+    old = time.time() - 60
+    os.utime(cache._disk_path("aa0000"), (old - 10, old - 10))
+    os.utime(cache._disk_path("bb0000"), (old, old))
+    assert cache.get("aa0000") is not None
+    cache.put("cc0000", *create_entry(2))
+
+    assert not os.path.exists(cache._disk_path("bb0000"))
+    assert os.path.exists(cache._disk_path("aa0000")) and os.path.exists(cache._disk_path("cc0000"))
+    stats = cache.stats()
+    assert stats["disk_evictions"] == 1 and stats["disk_max_bytes"] == size * 2 + size // 2
+
+def test_pipeline_reuses_detection_for_same_image():
+    """同じ画像を再送した場合に星検出結果がキャッシュから返されることを確認する"""
+    content = create_star_image_bytes(seed=42)
+
+    first = detect_constellation_stars(content)
+    second = detect_constellation_stars(content)
+
+    assert not first["cache_hit"]
+    assert second["cache_hit"]
+    assert second["star_field"].stars.equals(first["star_field"].stars)
+    assert np.array_equal(second["optimized"], first["optimized"])
+
+if __name__ == "__main__":
+    test_cache_key_depends_on_image_and_params()
+    test_memory_tier_evicts_least_recently_used()
+    test_disk_tier_survives_new_instance()
+    test_disk_tier_respects_byte_budget()
+    test_pipeline_reuses_detection_for_same_image()
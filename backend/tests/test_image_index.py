@@ -0,0 +1,125 @@
+import os
+import sys
+import logging
+import tempfile
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.core.image_index import ImageIndex, etag_matches, parse_range
+from helpers import create_sky_image, create_star_image_bytes
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def test_parse_range():
+    """Rangeヘッダーの解析で、単一の範囲だけを返し、範囲外は例外になるかテスト"""
+    assert parse_range(None, 1000) is None
+    assert parse_range("bytes=0-99", 1000) == (0, 99)
+    assert parse_range("bytes=900-", 1000) == (900, 999)
+    assert parse_range("bytes=-100", 1000) == (900, 999)
+    assert parse_range("bytes=-5000", 1000) == (0, 999)
+    assert parse_range("bytes=500-5000", 1000) == (500, 999)
+    # 複数の範囲や解釈できない指定は無視して全体を返す
+    assert parse_range("bytes=0-1,5-9", 1000) is None
+    assert parse_range("items=0-1", 1000) is None
+    assert parse_range("bytes=a-b", 1000) is None
+    for header in ("bytes=1000-", "bytes=-0"):
+        try:
+            parse_range(header, 1000)
+            assert False, f"範囲外の指定でValueErrorが発生しませんでした: {header}"
+        except ValueError:
+            pass
+
+def test_etag_matches():
+    """If-None-MatchのETagの比較（複数指定、弱いETag、*）をテスト"""
+    assert etag_matches('"abc"', '"abc"')
+    assert etag_matches('"x", W/"abc"', '"abc"')
+    assert etag_matches("*", '"abc"')
+    assert not etag_matches('"abcd"', '"abc"')
+    assert not etag_matches(None, '"abc"')
+
+def test_index_lru_and_missing_files():
+    """インデックスがエントリ数の上限を守り、存在しないファイルは登録しないかテスト"""
+    work_dir = tempfile.mkdtemp()
+    index = ImageIndex(max_entries=2)
+    for name in ("a.jpg", "b.jpg", "c.jpg"):
+        path = os.path.join(work_dir, name)
+        with open(path, "wb") as f:
+            f.write(name.encode())
+        entry = index.register(name, path)
+        assert entry.size == 5 and entry.etag.startswith('"')
+    assert index.get("a.jpg") is None
+    assert index.get("c.jpg").path == os.path.join(work_dir, "c.jpg")
+    assert index.register("d.jpg", os.path.join(work_dir, "d.jpg")) is None
+    stats = index.stats()
+    assert (stats["entries"], stats["hits"], stats["misses"], stats["evictions"]) == (2, 1, 1, 1)
+
+def test_image_endpoint_caching_headers(app_client, monkeypatch):
+    """/api/images が強いETag・immutable・304・206を返し、2回目以降はファイルを探さないかテスト"""
+    client, main = app_client
+    path = os.path.join("static", "images", "sky_constellation.jpg")
+    create_sky_image().save(path, format="JPEG", quality=95)
+    with open(path, "rb") as f:
+        original = f.read()
+
+    from app.core.image_variants import ImageVariantCache
+    monkeypatch.setattr(main, "image_index", ImageIndex())
+    monkeypatch.setattr(main, "image_variant_cache", ImageVariantCache())
+
+    response = client.get("/api/images/sky_constellation.jpg")
+    assert response.status_code == 200 and response.content == original
+    etag = response.headers["etag"]
+    assert etag.startswith('"') and not etag.startswith('W/')
+    assert "immutable" in response.headers["cache-control"]
+    assert response.headers["accept-ranges"] == "bytes"
+
+    # 登録後はファイルの存在確認を行わない
+    monkeypatch.setattr(main.os.path, "isfile", lambda p: False)
+    monkeypatch.setattr(main.os.path, "exists", lambda p: False)
+
+    response = client.get("/api/images/sky_constellation.jpg", headers={"If-None-Match": etag})
+    assert response.status_code == 304 and response.content == b""
+    assert response.headers["etag"] == etag
+
+    response = client.get("/api/images/sky_constellation.jpg", headers={"Range": "bytes=10-109"})
+    assert response.status_code == 206
+    assert response.content == original[10:110]
+    assert response.headers["content-range"] == f"bytes 10-109/{len(original)}"
+    assert response.headers["content-type"] == "image/jpeg"
+
+    response = client.get("/api/images/sky_constellation.jpg", headers={"Range": "bytes=-10", "If-Range": '"old"'})
+    assert response.status_code == 200 and response.content == original
+
+    response = client.get("/api/images/sky_constellation.jpg", headers={"Range": f"bytes={len(original)}-"})
+    assert response.status_code == 416
+
+    # 変換した画像は別のETagを持ち、同じように304を返す
+    accept = {"Accept": "image/webp"}
+    response = client.get("/api/images/sky_constellation.jpg", headers=accept)
+    webp_etag = response.headers["etag"]
+    assert response.headers["content-type"] == "image/webp" and webp_etag != etag
+    response = client.get("/api/images/sky_constellation.jpg", headers={**accept, "If-None-Match": webp_etag})
+    assert response.status_code == 304
+
+    assert client.get("/api/images/missing.jpg").status_code == 404
+
+def test_generated_images_are_indexed(app_client, monkeypatch):
+    """星座の生成時に画像がインデックスに登録されるかテスト"""
+    client, main = app_client
+    monkeypatch.setattr(main, "image_index", ImageIndex())
+    monkeypatch.setattr(main, "generate_constellation_content", lambda keyword: (f"{keyword}座", "物語", None))
+
+    files = {"image": ("sky.png", create_star_image_bytes(seed=6), "image/png")}
+    response = client.post("/api/generate-constellation", data={"keyword": "海"}, files=files)
+    image_name = response.json()["image_path"].rsplit("/", 1)[1]
+    assert main.image_index.get(image_name) is not None
+
+    monkeypatch.setattr(main.os.path, "isfile", lambda p: False)
+    response = client.get(f"/api/images/{image_name}")
+    assert response.status_code == 200 and response.headers["etag"]
+
+if __name__ == "__main__":
+    test_parse_range()
+    test_etag_matches()
+    test_index_lru_and_missing_files()
+    logger.info("すべてのテストが成功しました")
@@ -0,0 +1,119 @@
+import io
+import os
+import sys
+import time
+import struct
+import logging
+import cv2
+import numpy as np
+from PIL import Image
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.core.image_processing import read_image_header, sniff_image_format, validate_image
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def encode_with_pil(image_format, size=(321, 123), mode="RGB", **options):
+    """
+    テスト用の画像をPILで指定した形式にエンコードする
+
+    Args:
+        image_format: PILの保存形式
+        size: 画像の（幅, 高さ）
+        mode: 画像のモード
+        options: 保存時のオプション
+
+    Returns:
+        エンコードされた画像のバイト内容
+    """
+    buffer = io.BytesIO()
+    Image.new(mode, size, (10, 20, 30, 255)[:len(mode)]).save(buffer, image_format, **options)
+    return buffer.getvalue()
+
+def isobmff_image(brand, width, height):
+    """
+    テスト用に、ftypとmetaボックス（ispeを含む）とmdatだけを持つAVIF/HEICのデータを作成する
+
+    Args:
+        brand: メジャーブランド（b"avif"、b"heic"など）
+        width: 画像の幅
+        height: 画像の高さ
+
+    Returns:
+        ISO BMFF形式のバイト内容
+    """
+    def box(box_type, payload):
+        return struct.pack(">I4s", 8 + len(payload), box_type) + payload
+    ftyp = box(b"ftyp", brand + b"\x00\x00\x00\x00" + brand + b"mif1")
+    ispe = box(b"ispe", b"\x00\x00\x00\x00" + struct.pack(">II", width, height))
+    meta = box(b"meta", b"\x00\x00\x00\x00" + box(b"iprp", box(b"ipco", ispe)))
+    # 画像データの中に偶然 "ispe" が現れても、metaボックスの外は読まない
+    mdat = box(b"mdat", b"ispe" + b"\x00\x00\x00\x00" + struct.pack(">II", 10**6, 10**6))
+    return ftyp + meta + mdat
+
+def test_header_dimensions_for_each_format():
+    """各形式のヘッダーからフォーマットと幅・高さを読み取れるかテスト"""
+    exif = Image.Exif()
+    exif[0x010E] = "x" * 20000  # SOFの前に大きなAPP1セグメントを置く
+    samples = {
+        "jpeg": encode_with_pil("JPEG", exif=exif.tobytes()),
+        "png": encode_with_pil("PNG"),
+        "gif": encode_with_pil("GIF"),
+        "bmp": encode_with_pil("BMP"),
+        "tiff": encode_with_pil("TIFF"),
+    }
+    webp_samples = [
+        encode_with_pil("WEBP"),                               # VP8（非可逆）
+        encode_with_pil("WEBP", lossless=True),                # VP8L（可逆）
+        encode_with_pil("WEBP", mode="RGBA", exif=exif.tobytes()),  # VP8X（拡張形式）
+        cv2.imencode(".webp", np.zeros((123, 321, 3), dtype=np.uint8))[1].tobytes(),
+    ]
+    progressive = cv2.imencode(".jpg", np.zeros((123, 321), dtype=np.uint8), [cv2.IMWRITE_JPEG_PROGRESSIVE, 1])[1]
+
+    for expected_format, data in list(samples.items()) + [("webp", data) for data in webp_samples] + [("jpeg", progressive.tobytes())]:
+        header = read_image_header(data)
+        assert header is not None, expected_format
+        assert (header.format, header.width, header.height) == (expected_format, 321, 123)
+        assert validate_image(data)
+
+    assert read_image_header(isobmff_image(b"avif", 4032, 3024)).format == "avif"
+    assert read_image_header(isobmff_image(b"heic", 4032, 3024)).pixels == 4032 * 3024
+    sample_path = os.path.join(os.path.dirname(__file__), "../../frontend/public/sample.jpg")
+    if os.path.exists(sample_path):
+        with open(sample_path, "rb") as f:
+            header = read_image_header(f.read())
+        logger.info(f"サンプル画像のヘッダー: {header}")
+        assert header.format == "avif" and header.pixels > 0
+
+def test_rejects_garbage_and_truncated_headers():
+    """画像でないデータや壊れたヘッダーを拒否するかテスト"""
+    rng = np.random.default_rng(0)
+    png = encode_with_pil("PNG")
+    for data in [b"", b"hello world" * 200, rng.bytes(5000), png[:20], b"\xff\xd8\xff\xda" + bytes(100),
+                 b"RIFF\x00\x00\x00\x00WEBPVP8 " + bytes(4), b"\x00\x00\x00\x10ftypmp42" + bytes(8)]:
+        assert not validate_image(data)
+    assert sniff_image_format(b"<html><body>not an image</body></html>") is None
+
+def test_rejects_decompression_bombs_without_decoding():
+    """画素数が上限を超える画像を、デコードせずに拒否するかテスト"""
+    # IHDRだけを持つ 100000x100000 のPNG（デコードすると30GB）
+    bomb = b"\x89PNG\r\n\x1a\n" + struct.pack(">I4sII", 13, b"IHDR", 100000, 100000) + b"\x08\x02\x00\x00\x00"
+    assert read_image_header(bomb).pixels == 10**10
+    assert not validate_image(bomb)
+    assert not validate_image(isobmff_image(b"avif", 60000, 60000))
+    assert not validate_image(encode_with_pil("PNG", size=(200, 100)), max_pixels=10000)
+    assert validate_image(encode_with_pil("PNG", size=(100, 100)), max_pixels=10000)
+
+    start = time.perf_counter()
+    for _ in range(1000):
+        validate_image(bomb)
+    elapsed = (time.perf_counter() - start) / 1000
+    logger.info(f"ヘッダーの検証時間: {elapsed * 1e6:.1f}マイクロ秒/回")
+
+if __name__ == "__main__":
+    test_header_dimensions_for_each_format()
+    test_rejects_garbage_and_truncated_headers()
+    test_rejects_decompression_bombs_without_decoding()
+    logger.info("すべてのテストが成功しました")
@@ -0,0 +1,99 @@
+import io
+import os
+import sys
+import logging
+import tempfile
+from PIL import Image
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.core.constellation import encode_constellation_image, available_output_formats
+from app.core.image_variants import ImageVariantCache, negotiate_image_format, encode_image_variant
+from app.core.image_index import ImageIndex
+from helpers import create_sky_image
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def test_negotiate_image_format():
+    """明示的に受け付ける形式のうち、品質値が高く小さくなる形式が選ばれるかテスト"""
+    available = ["jpeg", "webp", "avif"]
+    assert negotiate_image_format(None, available, "jpeg") == "jpeg"
+    assert negotiate_image_format("*/*", available, "jpeg") == "jpeg"
+    assert negotiate_image_format("image/webp,image/*,*/*;q=0.8", available, "jpeg") == "webp"
+    assert negotiate_image_format("image/avif,image/webp,*/*", available, "jpeg") == "avif"
+    assert negotiate_image_format("image/avif,image/webp,*/*", ["jpeg", "webp"], "jpeg") == "webp"
+    assert negotiate_image_format("image/avif;q=0.5,image/webp", available, "jpeg") == "webp"
+    assert negotiate_image_format("image/webp;q=0", available, "jpeg") == "jpeg"
+    # 保存されている形式を明示的により高い品質値で受け付ける場合はそのまま返す
+    assert negotiate_image_format("image/jpeg,image/webp;q=0.9", available, "jpeg") == "jpeg"
+
+def test_encode_quality_tiers_and_formats():
+    """WebPはJPEGより小さく、画質の段階が低いほど小さくなるかテスト"""
+    image = create_sky_image()
+    jpeg = encode_constellation_image(image, "jpeg", "standard")
+    webp = encode_constellation_image(image, "webp", "standard")
+    logger.info(f"JPEG: {len(jpeg)} バイト, WebP: {len(webp)} バイト")
+    assert Image.open(io.BytesIO(webp)).format == "WEBP"
+    assert len(webp) < len(jpeg)
+    sizes = [len(encode_constellation_image(image, "jpeg", tier)) for tier in ("low", "standard", "high")]
+    assert sizes == sorted(sizes)
+
+    for image_format, quality in (("gif", "standard"), ("jpeg", "best")):
+        try:
+            encode_constellation_image(image, image_format, quality)
+            assert False, "未対応のフォーマット・画質でValueErrorが発生しませんでした"
+        except ValueError:
+            pass
+    assert {"jpeg", "webp"} <= set(available_output_formats())
+
+def test_variant_cache_respects_byte_budget():
+    """変換した画像のキャッシュが合計バイト数の上限を超えないよう古いものから削除するかテスト"""
+    cache = ImageVariantCache(max_bytes=250)
+    for i in range(3):
+        cache.put(("a.jpg", 0, "webp", str(i)), bytes(100))
+    assert cache.get(("a.jpg", 0, "webp", "0")) is None
+    assert cache.get(("a.jpg", 0, "webp", "2")) is not None
+    cache.put(("big.jpg", 0, "webp", "standard"), bytes(1000))
+    stats = cache.stats()
+    assert stats["entries"] == 2 and stats["bytes"] == 200
+    assert (stats["hits"], stats["misses"], stats["evictions"]) == (1, 1, 1)
+
+def test_image_endpoint_negotiates_format(app_client, monkeypatch):
+    """/api/images がAcceptヘッダーに応じて変換した画像を返し、変換結果をキャッシュするかテスト"""
+    client, main = app_client
+    create_sky_image().save(os.path.join("static", "images", "sky_constellation.jpg"), format="JPEG", quality=95)
+    monkeypatch.setattr(main, "image_variant_cache", ImageVariantCache())
+    monkeypatch.setattr(main, "image_index", ImageIndex())
+
+    response = client.get("/api/images/sky_constellation.jpg")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "image/jpeg"
+    assert response.headers["vary"] == "Accept"
+
+    accept = {"Accept": "image/webp,image/*,*/*;q=0.8"}
+    for _ in range(2):
+        response = client.get("/api/images/sky_constellation.jpg", headers=accept)
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "image/webp"
+        assert Image.open(io.BytesIO(response.content)).format == "WEBP"
+    assert main.image_variant_cache.stats()["hits"] == 1
+
+    low = client.get("/api/images/sky_constellation.jpg?quality=low")
+    assert low.headers["content-type"] == "image/jpeg"
+    assert len(low.content) < os.path.getsize(os.path.join("static", "images", "sky_constellation.jpg"))
+    assert client.get("/api/images/sky_constellation.jpg?quality=best").status_code == 400
+
+def test_encode_image_variant_from_file():
+    """保存されている画像ファイルを別の形式に変換できるかテスト"""
+    path = os.path.join(tempfile.mkdtemp(), "sky.jpg")
+    create_sky_image().save(path, format="JPEG", quality=95)
+    encoded = encode_image_variant(path, "webp", "low")
+    assert Image.open(io.BytesIO(encoded)).size == (320, 240)
+
+if __name__ == "__main__":
+    test_negotiate_image_format()
+    test_encode_quality_tiers_and_formats()
+    test_variant_cache_respects_byte_budget()
+    test_encode_image_variant_from_file()
+    logger.info("すべてのテストが成功しました")
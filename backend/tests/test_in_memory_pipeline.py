@@ -0,0 +1,61 @@
+import os
+import sys
+import logging
+import tempfile
+import cv2
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.core.image_processing import decode_image, optimize_image_array
+from app.core.pipeline import run_constellation_pipeline
+from helpers import create_star_image_bytes
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def test_decode_and_optimize_in_memory():
+    """バイト列のデコードと最適化がメモリ上で完結することを確認する"""
+    content = create_star_image_bytes()
+
+    image = decode_image(content)
+    assert image is not None
+    assert image.shape == (1200, 1600, 3)
+
+    optimized = optimize_image_array(image)
+    assert optimized.ndim == 2
+    assert optimized.shape[1] <= 800 and optimized.shape[0] <= 600
+    logger.info(f"最適化後のサイズ: {optimized.shape}")
+
+    assert decode_image(b"not an image") is None
+
+def test_run_constellation_pipeline():
+    """インメモリパイプラインが最終画像のみを書き出すことを確認する"""
+    content = create_star_image_bytes()
+    output_dir = tempfile.mkdtemp()
+
+    result = run_constellation_pipeline(content, output_dir=output_dir)
+
+    assert os.path.exists(result["image_path"])
+    assert os.listdir(output_dir) == [result["image_filename"]]
+    assert result["stars"]
+    assert result["constellation_lines"]
+
+    star_field = result["star_field"]
+    assert star_field.stars
+    assert star_field.clusters
+    assert star_field.image_size == (800, 600)
+    drawn_points = {(star["x"], star["y"]) for star in result["stars"]}
+    field_points = {point for cluster in star_field.constellation_points for point in cluster}
+    assert drawn_points == field_points
+
+    rendered = cv2.imread(result["image_path"])
+    assert rendered is not None
+    assert rendered.shape[1] <= 800 and rendered.shape[0] <= 600
+    logger.info(f"生成された星座画像: {result['image_path']}")
+
+    os.remove(result["image_path"])
+    os.rmdir(output_dir)
+
+if __name__ == "__main__":
+    test_decode_and_optimize_in_memory()
+    test_run_constellation_pipeline()
@@ -0,0 +1,110 @@
+import os
+import sys
+import logging
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.core.metrics import MetricsRegistry, RequestTimings, timed_stage
+from helpers import create_star_image_bytes
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def server_timing_stages(header):
+    """Server-Timingヘッダーの値から段階名と時間（ミリ秒）の辞書を作る"""
+    stages = {}
+    for entry in header.split(","):
+        name, duration = entry.strip().split(";dur=")
+        stages[name] = float(duration)
+    return stages
+
+def test_histogram_and_callback_rendering():
+    """ヒストグラムが累積のバケット数・合計・件数を、コールバックのメトリクスがラベル付きの値を出力するかテスト"""
+    registry = MetricsRegistry()
+    histogram = registry.histogram("stage_seconds", "段階の時間", ("stage",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.5, 3.0):
+        histogram.observe(value, ("detect",))
+    registry.callback("hits_total", "ヒット数", lambda: {"llm": 3, "image_index": 5},
+                      metric_type="counter", label_names=("cache",))
+    registry.callback("queue_depth", "キューの深さ", lambda: 2)
+    registry.callback("broken", "取得に失敗する値", lambda: 1 / 0)
+
+    snapshot = histogram.snapshot(("detect",))
+    assert snapshot["buckets"] == {0.1: 1, 1.0: 3, float("inf"): 4}
+    assert (snapshot["sum"], snapshot["count"]) == (4.05, 4)
+    assert histogram.snapshot(("draw",)) is None
+
+    text = registry.render()
+    assert "# TYPE stage_seconds histogram" in text
+    assert 'stage_seconds_bucket{stage="detect",le="1.0"} 3' in text
+    assert 'stage_seconds_bucket{stage="detect",le="+Inf"} 4' in text
+    assert 'stage_seconds_count{stage="detect"} 4' in text
+    assert "# TYPE hits_total counter" in text and 'hits_total{cache="image_index"} 5' in text
+    assert "queue_depth 2" in text
+    # 取得に失敗したメトリクスは値を出力せず、他のメトリクスの出力は続ける
+    assert "# TYPE broken gauge" in text and "\nbroken " not in text
+
+    try:
+        registry.callback("queue_depth", "重複", lambda: 0)
+        assert False, "同じ名前のメトリクスを登録できてしまいました"
+    except ValueError:
+        pass
+
+def test_request_timings_server_timing():
+    """同じ段階の時間が合計され、段階名がServer-Timingで使える文字に置き換えられるかテスト"""
+    timings = RequestTimings()
+    timings.add("detect", 0.010)
+    timings.add("llm name", 0.5)
+    timings.add("detect", 0.005)
+    stages = server_timing_stages(timings.server_timing(total_seconds=1.0))
+    assert list(stages) == ["detect", "llm_name", "total"]
+    assert stages == {"detect": 15.0, "llm_name": 500.0, "total": 1000.0}
+
+    worker_timings = {}
+    with timed_stage("decode", worker_timings):
+        pass
+    assert list(worker_timings) == ["decode"] and worker_timings["decode"] >= 0
+    # リクエストの外で辞書を指定しない場合は何も記録しない
+    with timed_stage("decode"):
+        pass
+
+def test_generate_endpoint_reports_stage_timings(app_client, monkeypatch):
+    """星座生成のレスポンスに段階ごとのServer-Timingが付き、/metrics にヒストグラムと統計値が出るかテスト"""
+    client, main = app_client
+    profile = {"name": "海座", "story": "物語", "shape": "line", "star_count": 5, "brightness": "high", "pattern": "linear"}
+    monkeypatch.setattr(main, "OPENAI_GENERATION_MODE", "combined")
+    monkeypatch.setattr(main, "generate_constellation_profile", lambda keyword: profile)
+
+    files = {"image": ("sky.png", create_star_image_bytes(seed=8), "image/png")}
+    response = client.post("/api/generate-constellation", data={"keyword": "海"}, files=files)
+    assert response.status_code == 200
+    assert response.json()["constellation_name"] == "海座"
+    stages = server_timing_stages(response.headers["server-timing"])
+    for stage in ("validate", "queue", "decode", "optimize", "detect", "cluster", "draw", "encode", "save",
+                  "llm_profile", "total"):
+        assert stage in stages, f"Server-Timingに{stage}がありません: {stages}"
+    assert stages["total"] >= stages["detect"]
+
+    # 一時ファイルを経由する従来の処理では、保存とコピーの時間も記録する
+    monkeypatch.setattr(main, "IN_MEMORY_PIPELINE", False)
+    response = client.post("/api/generate-constellation", data={"keyword": "海"}, files=files)
+    stages = server_timing_stages(response.headers["server-timing"])
+    for stage in ("validate", "save", "optimize", "detect", "cluster", "draw", "llm_profile", "copy"):
+        assert stage in stages, f"Server-Timingに{stage}がありません: {stages}"
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    text = response.text
+    assert 'pipeline_stage_duration_seconds_count{stage="detect"}' in text
+    assert 'pipeline_stage_duration_seconds_bucket{stage="llm_profile",le="+Inf"}' in text
+    assert 'http_request_duration_seconds_count{method="POST",route="/api/generate-constellation",status="200"}' in text
+    assert "pipeline_queue_depth 0" in text
+    assert "http_requests_in_flight 1" in text
+    assert 'cache_hit_ratio{cache="detection"}' in text
+    assert 'cache_misses_total{cache="detection"}' in text
+
+if __name__ == "__main__":
+    test_histogram_and_callback_rendering()
+    test_request_timings_server_timing()
+    logger.info("すべてのテストが成功しました")
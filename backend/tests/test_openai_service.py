@@ -0,0 +1,177 @@
+import os
+import sys
+import json
+import logging
+import tempfile
+from types import SimpleNamespace
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services import openai_service
+from app.services.llm_cache import LLMResponseCache
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class FakeCompletions:
+    """OpenAIのchat.completionsを模したテスト用クラス"""
+
+    def __init__(self, json_content, text_content="テストの星座"):
+        self.json_content = json_content
+        self.text_content = text_content
+        self.calls = []
+
+    def create(self, **kwargs):
+        self.calls.append(kwargs)
+        content = self.json_content if "response_format" in kwargs else self.text_content
+        message = SimpleNamespace(content=content)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+def use_fake_client(monkeypatch, completions, cache=None):
+    monkeypatch.setattr(openai_service, "llm_cache", cache or LLMResponseCache())
+    monkeypatch.setattr(openai_service, "OPENAI_API_KEY", "sk-test")
+    monkeypatch.setattr(openai_service, "client", SimpleNamespace(chat=SimpleNamespace(completions=completions)))
+
+def test_generate_constellation_profile_single_call(monkeypatch):
+    """1回のAPI呼び出しで名前・ストーリー・特徴が取得できることを確認する"""
+    completions = FakeCompletions(json.dumps({
+        "name": "光明の星座",
+        "story": "希望を灯す星々の物語",
+        "shape": "animal",
+        "star_count": 7,
+        "brightness": "medium",
+        "pattern": "linear"
+    }, ensure_ascii=False))
+    use_fake_client(monkeypatch, completions)
+
+    profile = openai_service.generate_constellation_profile("希望")
+
+    assert len(completions.calls) == 1
+    assert completions.calls[0]["response_format"] == {"type": "json_object"}
+    assert profile == {
+        "name": "光明の星座",
+        "story": "希望を灯す星々の物語",
+        "shape": "animal",
+        "star_count": 7,
+        "brightness": "medium",
+        "pattern": "linear"
+    }
+
+def test_endpoints_use_combined_profile(app_client, monkeypatch):
+    """combinedモードで、1回の呼び出しで得た名前・ストーリー・特徴が通常とバッチのレスポンスとクラスタの選択に使われることを確認する"""
+    from helpers import create_star_image_bytes
+
+    client, main = app_client
+    profile = {"name": "光明の星座", "story": "希望を灯す星々の物語", "shape": "animal",
+               "star_count": 7, "brightness": "medium", "pattern": "linear"}
+    completions = FakeCompletions(json.dumps(profile, ensure_ascii=False))
+    use_fake_client(monkeypatch, completions)
+    monkeypatch.setattr(main, "OPENAI_GENERATION_MODE", "combined")
+
+    matched = []
+    match_constellation_with_clusters = main.match_constellation_with_clusters
+    def record_match(name, story, clusters, features=None):
+        matched.append((name, story, features))
+        return match_constellation_with_clusters(name, story, clusters, features=features)
+    monkeypatch.setattr(main, "match_constellation_with_clusters", record_match)
+
+    files = {"image": ("sky.png", create_star_image_bytes(seed=3), "image/png")}
+    body = client.post("/api/generate-constellation", data={"keyword": "希望"}, files=files).json()
+    assert (body["constellation_name"], body["story"]) == ("光明の星座", "希望を灯す星々の物語")
+
+    files = [("images", (f"{i}.png", create_star_image_bytes(seed=i), "image/png")) for i in range(2)]
+    results = client.post("/api/generate-constellation/batch", data={"keywords": ["希望"]}, files=files).json()["results"]
+    assert [(r["constellation_name"], r["story"]) for r in results] == [("光明の星座", "希望を灯す星々の物語")] * 2
+
+    features = {key: profile[key] for key in ("shape", "star_count", "brightness", "pattern")}
+    assert matched and all(match == ("光明の星座", "希望を灯す星々の物語", features) for match in matched)
+    # 個別の生成（名前・ストーリー・特徴）は呼び出さない
+    assert completions.calls and all("response_format" in call for call in completions.calls)
+
+def test_generate_constellation_profile_falls_back_on_invalid_schema(monkeypatch):
+    """スキーマに一致しないレスポンスの場合は個別の生成にフォールバックすることを確認する"""
+    completions = FakeCompletions(json.dumps({"name": "星座", "story": "物語", "shape": "circle"}))
+    use_fake_client(monkeypatch, completions)
+
+    profile = openai_service.generate_constellation_profile("希望")
+
+    assert len(completions.calls) == 4
+    assert profile["name"] == "テストの星座"
+    assert set(profile) == {"name", "story", "shape", "star_count", "brightness", "pattern"}
+    logger.info(f"フォールバック時のプロフィール: {profile}")
+
+def test_stream_constellation_story_yields_tokens(monkeypatch):
+    """ストーリーがモデルの出力に合わせてトークンごとに返されることを確認する"""
+    tokens = ["昔々、", None, "星々が", "輝いていました。"]
+
+    class FakeStreamingCompletions:
+        def create(self, **kwargs):
+            assert kwargs["stream"] is True
+            return [
+                SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=token))])
+                for token in tokens
+            ]
+
+    use_fake_client(monkeypatch, FakeStreamingCompletions())
+
+    streamed = list(openai_service.stream_constellation_story("光明の星座", "希望"))
+
+    assert streamed == ["昔々、", "星々が", "輝いていました。"]
+
+def test_generations_are_cached_per_keyword(monkeypatch):
+    """同じキーワードの星座名とストーリーがキャッシュから返されることを確認する"""
+    completions = FakeCompletions("{}", text_content="光明の星座")
+    use_fake_client(monkeypatch, completions)
+
+    assert openai_service.generate_constellation_name("希望") == "光明の星座"
+    assert openai_service.generate_constellation_name(" 希望 ") == "光明の星座"
+    assert openai_service.generate_constellation_story("光明の星座", "希望") == "光明の星座"
+    assert openai_service.generate_constellation_story("光明の星座", "希望") == "光明の星座"
+    assert openai_service.generate_constellation_name("愛") == "光明の星座"
+    assert len(completions.calls) == 3
+
+def test_llm_cache_ttl_variants_and_persistence():
+    """TTL切れ、バリエーション数、SQLiteによる永続化を確認する"""
+    db_path = os.path.join(tempfile.mkdtemp(), "llm_cache.sqlite3")
+    key = LLMResponseCache.make_key("name", "希望", "ja", "model", "1")
+
+    cache = LLMResponseCache(variants=2, db_path=db_path)
+    cache.put(key, "光明の星座")
+    assert cache.get(key) is None  # バリエーションが揃うまではミス
+    cache.put(key, "希望の灯火座")
+    assert cache.get(key) in ("光明の星座", "希望の灯火座")
+
+    restarted = LLMResponseCache(variants=2, db_path=db_path)
+    assert restarted.get(key) in ("光明の星座", "希望の灯火座")
+
+    expired = LLMResponseCache(ttl_seconds=0, db_path=db_path)
+    assert expired.get(key) is None
+
+    stats = restarted.stats()
+    logger.info(f"LLMキャッシュの統計: {stats}")
+    assert stats["persistent"]
+    assert stats["hits"] == 1
+
+def test_llm_cache_prunes_database_rows():
+    """SQLiteへの書き込み時に、期限切れの行と、キーごと・全体の上限を超えた古い行が削除されることを確認する"""
+    import time
+
+    db_path = os.path.join(tempfile.mkdtemp(), "llm_cache.sqlite3")
+    cache = LLMResponseCache(ttl_seconds=3600, variants=2, db_path=db_path, max_db_rows=3)
+    cache._db.execute(
+        "INSERT INTO llm_cache (key, value, created_at) VALUES (?, ?, ?)",
+        ("old", json.dumps("期限切れ"), time.time() - 7200)
+    )
+    cache._db.commit()
+
+    for value in ("一", "二", "三"):
+        cache.put("a", value)
+    rows = cache._db.execute("SELECT key, value FROM llm_cache ORDER BY created_at").fetchall()
+    assert [(key, json.loads(value)) for key, value in rows] == [("a", "二"), ("a", "三")]
+
+    cache.put("b", "四")
+    cache.put("c", "五")
+    keys = [key for (key,) in cache._db.execute("SELECT key FROM llm_cache ORDER BY created_at")]
+    assert keys == ["a", "b", "c"]
+    assert cache.stats()["db_rows_deleted"] == 3
+    assert cache.get("c") is None and LLMResponseCache(variants=1, db_path=db_path).get("c") == "五"
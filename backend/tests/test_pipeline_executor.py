@@ -0,0 +1,136 @@
+import os
+import sys
+import time
+import asyncio
+import logging
+import tempfile
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.core.executor import PipelineExecutor, PipelineBusyError
+from app.core.pipeline import run_constellation_pipeline
+from helpers import create_star_image_bytes
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def slow_job(seconds):
+    """指定秒数だけ待機してから秒数を返すテスト用のジョブ"""
+    time.sleep(seconds)
+    return seconds
+
+def test_admission_control_rejects_when_queue_is_full():
+    """実行中と待機中のジョブが上限に達したら即座に拒否されることを確認する"""
+    executor = PipelineExecutor(max_workers=1, max_queue=1, retry_after=3, use_processes=False)
+
+    async def scenario():
+        jobs = [asyncio.ensure_future(executor.run(slow_job, 0.2)) for _ in range(2)]
+        await asyncio.sleep(0.05)
+        assert executor.in_flight == 2
+        assert executor.queue_depth == 1
+
+        try:
+            await executor.run(slow_job, 0.0)
+            raise AssertionError("PipelineBusyErrorが送出されませんでした")
+        except PipelineBusyError as busy_error:
+            assert busy_error.retry_after == 3
+
+        return await asyncio.gather(*jobs)
+
+    try:
+        assert asyncio.run(scenario()) == [0.2, 0.2]
+    finally:
+        executor.shutdown()
+
+    stats = executor.stats()
+    logger.info(f"ワーカープールの統計: {stats}")
+    assert stats["completed"] == 2
+    assert stats["rejected"] == 1
+    assert stats["in_flight"] == 0
+    assert stats["queue_wait_seconds_max"] >= 0.1
+    assert stats["execution_seconds_max"] >= 0.2
+
+def test_cancelled_request_keeps_slot_until_worker_finishes():
+    """待っているリクエストがキャンセルされても、実行中のジョブの枠はワーカーでの実行が終わるまで返さないことを確認する"""
+    executor = PipelineExecutor(max_workers=1, max_queue=2, use_processes=False)
+
+    async def scenario():
+        running = executor.submit(slow_job, 0.3)
+        queued = executor.submit(slow_job, 0.3)
+        # 待つ処理が一度も動かないうちにキャンセルされたジョブも取り消される
+        executor.submit(slow_job, 0.3).cancel()
+        await asyncio.sleep(0.05)
+        running.cancel()
+        queued.cancel()
+        await asyncio.sleep(0.05)
+        # 待機中のジョブは取り消されて枠が返るが、実行中のジョブはワーカーで動き続けるため枠を使ったまま
+        assert executor.in_flight == 1
+        executor.submit(slow_job, 0.0)
+        executor.submit(slow_job, 0.0)
+        try:
+            executor.submit(slow_job, 0.0)
+            raise AssertionError("PipelineBusyErrorが送出されませんでした")
+        except PipelineBusyError:
+            pass
+        await asyncio.sleep(0.4)
+        assert executor.in_flight == 0
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        executor.shutdown()
+    assert executor.stats()["rejected"] == 1
+
+def test_reserve_admits_whole_batch_or_nothing():
+    """複数のジョブの枠をまとめて確保し、全てが収まらない場合は1件も受け付けないことを確認する"""
+    executor = PipelineExecutor(max_workers=1, max_queue=2, use_processes=False)
+
+    async def scenario():
+        executor.reserve(2)
+        assert executor.in_flight == 2
+        try:
+            executor.reserve(2)
+            raise AssertionError("PipelineBusyErrorが送出されませんでした")
+        except PipelineBusyError:
+            pass
+        assert executor.in_flight == 2
+
+        jobs = [executor.submit(slow_job, 0.0, reserved=True), executor.submit(slow_job, 0.0, reserved=True)]
+        assert executor.in_flight == 2
+        results = await asyncio.gather(*jobs)
+        executor.reserve(3)
+        executor.release(3)
+        return results
+
+    try:
+        assert asyncio.run(scenario()) == [0.0, 0.0]
+    finally:
+        executor.shutdown()
+
+    stats = executor.stats()
+    assert (stats["completed"], stats["rejected"], stats["in_flight"]) == (2, 1, 0)
+
+def test_pipeline_runs_in_process_pool():
+    """インメモリパイプラインがプロセスプール上で実行できることを確認する"""
+    executor = PipelineExecutor(max_workers=1, max_queue=0, use_processes=True)
+    output_dir = tempfile.mkdtemp()
+
+    try:
+        result = asyncio.run(executor.run(
+            run_constellation_pipeline, create_star_image_bytes(), output_dir=output_dir
+        ))
+    finally:
+        executor.shutdown()
+
+    assert os.path.exists(result["image_path"])
+    assert result["star_field"].clusters
+    assert executor.stats()["completed"] == 1
+
+    os.remove(result["image_path"])
+    os.rmdir(output_dir)
+
+if __name__ == "__main__":
+    test_admission_control_rejects_when_queue_is_full()
+    test_cancelled_request_keeps_slot_until_worker_finishes()
+    test_reserve_admits_whole_batch_or_nothing()
+    test_pipeline_runs_in_process_pool()
@@ -0,0 +1,75 @@
+import os
+import sys
+import time
+import logging
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.core.star_detection import detect_stars_in_image, detect_stars_with_pyramid, scale_stars
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def create_gaussian_star_field(width=6000, height=4000, star_count=150, seed=0):
+    """
+    テスト用に、サブピクセルの位置にガウス分布の星を描いた画像を生成する
+
+    Args:
+        width: 画像の幅
+        height: 画像の高さ
+        star_count: 星の数
+        seed: 乱数シード
+
+    Returns:
+        グレースケール画像と、星の正解座標（x, y）の配列のタプル
+    """
+    rng = np.random.default_rng(seed)
+    image = rng.normal(15, 3, (height, width)).astype(np.float32)
+    positions = np.column_stack([
+        rng.uniform(40, width - 40, star_count),
+        rng.uniform(40, height - 40, star_count)
+    ])
+    for x, y in positions:
+        sigma = rng.uniform(2.0, 4.0)
+        peak = rng.uniform(120, 230)
+        x0, y0 = int(x) - 15, int(y) - 15
+        yy, xx = np.mgrid[y0:y0 + 31, x0:x0 + 31]
+        image[y0:y0 + 31, x0:x0 + 31] += peak * np.exp(-((xx - x)**2 + (yy - y)**2) / (2 * sigma**2))
+    return image.clip(0, 255).astype(np.uint8), positions
+
+def test_pyramid_detection_finds_stars_with_subpixel_centroids():
+    """縮小画像で見つけた星の重心が元の解像度でサブピクセル精度になることを確認する"""
+    image, positions = create_gaussian_star_field()
+
+    started_at = time.perf_counter()
+    stars = detect_stars_with_pyramid(image, pyramid_size=1000)
+    elapsed = time.perf_counter() - started_at
+
+    centroids = np.array([(star["centroid_x"], star["centroid_y"]) for star in stars])
+    distances = np.sqrt(((positions[:, None, :] - centroids[None, :, :])**2).sum(axis=-1))
+    nearest = distances.min(axis=1)
+    recall = float((nearest < 1.0).mean())
+    error = float(nearest[nearest < 1.0].mean())
+    logger.info(f"ピラミッド検出: {len(stars)}個, 再現率={recall:.2f}, 平均誤差={error:.3f}px, {elapsed:.2f}秒")
+
+    assert recall >= 0.95
+    assert error < 0.3
+    for star in stars:
+        assert star["x"] == int(star["centroid_x"]) and star["y"] == int(star["centroid_y"])
+
+def test_pyramid_mode_in_detect_stars_in_image():
+    """detect_stars_in_imageのpyramidモードで明るい順に上限数の星が返ることを確認する"""
+    image, _ = create_gaussian_star_field(width=3000, height=2000, star_count=80, seed=1)
+
+    stars = detect_stars_in_image(image, mode="pyramid", pyramid_size=800, max_detected=50)
+    assert len(stars) == 50
+    brightness = [star["brightness"] for star in stars]
+    assert brightness == sorted(brightness, reverse=True)
+
+    scaled = scale_stars(stars, 0.25, 0.25)
+    assert scaled[0]["centroid_x"] == stars[0]["centroid_x"] * 0.25
+
+if __name__ == "__main__":
+    test_pyramid_detection_finds_stars_with_subpixel_centroids()
+    test_pyramid_mode_in_detect_stars_in_image()
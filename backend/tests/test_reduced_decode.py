@@ -0,0 +1,96 @@
+import os
+import sys
+import logging
+import tempfile
+import tracemalloc
+import cv2
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.core.image_processing import (
+    decode_image, decode_image_gray, optimize_image, optimize_image_array, reduced_decode_scale
+)
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def create_photo(width=4000, height=3000, seed=0):
+    """
+    テスト用に、なだらかな背景に星を散らした12MPのカラー画像を生成する
+
+    Args:
+        width: 画像の幅
+        height: 画像の高さ
+        seed: 乱数シード
+
+    Returns:
+        BGR形式の画像
+    """
+    rng = np.random.default_rng(seed)
+    gradient = np.linspace(10, 60, width, dtype=np.float32)[None, :] + np.linspace(0, 30, height, dtype=np.float32)[:, None]
+    image = np.repeat(gradient[:, :, None], 3, axis=2).astype(np.uint8)
+    for _ in range(300):
+        center = (int(rng.integers(0, width)), int(rng.integers(0, height)))
+        cv2.circle(image, center, int(rng.integers(3, 12)), (255, 240, 230), -1)
+    return image
+
+def peak_memory(function):
+    """関数の実行中にNumPyなどが確保したメモリのピーク（バイト）と戻り値を返す"""
+    tracemalloc.start()
+    try:
+        result = function()
+        return tracemalloc.get_traced_memory()[1], result
+    finally:
+        tracemalloc.stop()
+
+def test_reduced_decode_scale():
+    """縮小後の大きさを下回らない最大の倍率を選ぶかテスト"""
+    assert reduced_decode_scale(4000, 3000, (800, 600)) == 4
+    assert reduced_decode_scale(6400, 4800, (800, 600)) == 8
+    assert reduced_decode_scale(12000, 3000, (800, 600)) == 8
+    assert reduced_decode_scale(1600, 1200, (800, 600)) == 2
+    assert reduced_decode_scale(1000, 750, (800, 600)) == 1
+    assert reduced_decode_scale(640, 480, (800, 600)) == 1
+
+def test_jpeg_is_decoded_reduced_and_grayscale():
+    """12MPのJPEGを目標サイズに近い解像度のグレースケールでデコードし、メモリ使用量が1桁以上減るかテスト"""
+    photo = create_photo()
+    content = cv2.imencode(".jpg", photo, [cv2.IMWRITE_JPEG_QUALITY, 92])[1].tobytes()
+
+    full_peak, full = peak_memory(lambda: optimize_image_array(decode_image(content)))
+    reduced_peak, gray = peak_memory(lambda: decode_image_gray(content, (800, 600)))
+    logger.info(f"ピークメモリ: フル解像度のカラー={full_peak / 1e6:.1f}MB, 縮小グレースケール={reduced_peak / 1e6:.1f}MB")
+
+    assert gray.ndim == 2 and gray.shape == (750, 1000)
+    assert reduced_peak * 10 < full_peak
+
+    optimized = optimize_image_array(gray)
+    assert optimized.shape == full.shape == (600, 800)
+    assert np.abs(optimized.astype(np.int16) - full.astype(np.int16)).mean() < 3
+
+def test_lossless_formats_decode_to_same_grayscale():
+    """縮小できない形式でもグレースケールで直接デコードし、カラーからの変換と同じ値になるかテスト"""
+    photo = create_photo(640, 480, seed=1)
+    content = cv2.imencode(".png", photo)[1].tobytes()
+    gray = decode_image_gray(content, (800, 600))
+    expected = cv2.cvtColor(decode_image(content), cv2.COLOR_BGR2GRAY)
+    assert gray.shape == expected.shape
+    assert np.abs(gray.astype(np.int16) - expected.astype(np.int16)).max() <= 1
+
+def test_optimize_image_uses_reduced_decode():
+    """ファイルを経由する optimize_image でも縮小デコードした結果を保存するかテスト"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, "photo.jpg")
+        cv2.imwrite(path, create_photo(2400, 1800, seed=2))
+        optimized_path = optimize_image(path)
+        assert optimized_path != path
+        optimized = cv2.imread(optimized_path, cv2.IMREAD_UNCHANGED)
+        assert optimized.shape == (600, 800)
+
+if __name__ == "__main__":
+    test_reduced_decode_scale()
+    test_jpeg_is_decoded_reduced_and_grayscale()
+    test_lossless_formats_decode_to_same_grayscale()
+    test_optimize_image_uses_reduced_decode()
+    logger.info("すべてのテストが成功しました")
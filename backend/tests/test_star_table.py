@@ -0,0 +1,67 @@
+import os
+import sys
+import pickle
+import logging
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.core.star_table import StarTable, group_clusters
+from app.core.star_detection import cluster_stars, cluster_star_table, calculate_matching_score
+from helpers import create_random_stars
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def test_round_trip_between_dicts_and_table():
+    """辞書形式とテーブルを相互に変換しても内容が変わらないことを確認する"""
+    stars = create_random_stars(50, seed=10)
+    table = StarTable.from_dicts(stars)
+
+    assert len(table) == 50
+    assert table.to_dicts() == stars
+    assert table.x.tolist() == [star["x"] for star in stars]
+    logger.info(f"50個の星: テーブル={table.nbytes}バイト")
+
+    subpixel = StarTable.from_dicts([{**stars[0], "centroid_x": 1.25, "centroid_y": 2.5}])
+    assert subpixel.to_dicts()[0]["centroid_x"] == 1.25
+
+    restored = pickle.loads(pickle.dumps(table))
+    assert restored.equals(table)
+    assert StarTable.concatenate([table[:10], table[10:]]).equals(table)
+
+    # 値が分からない任意の列は、その星の辞書には出力しない
+    mixed = StarTable.concatenate([subpixel, StarTable.from_dicts([{**stars[1], "peak": 250.0}])])
+    assert [sorted(star) for star in mixed.to_dicts()] == [
+        sorted(["x", "y", "brightness", "area", "centroid_x", "centroid_y"]),
+        sorted(["x", "y", "brightness", "area", "peak"])
+    ]
+
+    # 列が少ない古い形式のテーブルも読み込める
+    legacy = StarTable()
+    legacy.__setstate__((table.data[["x", "y", "brightness", "area"]].copy(),))
+    assert legacy.to_dicts() == stars
+
+def test_clusters_are_views_of_one_table():
+    """クラスタが1つのテーブルのビューになり、並び順が保たれることを確認する"""
+    table = StarTable.from_dicts(create_random_stars(20, seed=11))
+    clusters = group_clusters(table, [[3, 1, 2], [0, 5]])
+
+    assert [cluster.x.tolist() for cluster in clusters] == [table.take([3, 1, 2]).x.tolist(), table.take([0, 5]).x.tolist()]
+    assert clusters[0].data.base is not None
+    assert clusters[0].data.base is clusters[1].data.base
+
+def test_table_clustering_matches_dict_clustering():
+    """テーブルのクラスタリングと辞書形式のクラスタリングが同じ結果になることを確認する"""
+    stars = create_random_stars(300, seed=12)
+
+    clusters = cluster_star_table(StarTable.from_dicts(stars))
+    assert [cluster.to_dicts() for cluster in clusters] == cluster_stars(stars)
+
+    features = {"star_count": 5, "brightness": "high", "pattern": "scattered"}
+    for cluster in clusters:
+        assert calculate_matching_score(features, cluster) == calculate_matching_score(features, cluster.to_dicts())
+
+if __name__ == "__main__":
+    test_round_trip_between_dicts_and_table()
+    test_clusters_are_views_of_one_table()
+    test_table_clustering_matches_dict_clustering()
@@ -0,0 +1,85 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import threading
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from helpers import create_star_image_bytes
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def parse_sse_events(text):
+    """SSEのレスポンス本文をイベント名とデータのタプルのリストにする"""
+    events = []
+    for block in text.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.split("\n"))
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+def test_failed_detection_cancels_story_stream(app_client, monkeypatch):
+    """星検出が失敗した場合に、並行して進めているストーリーの生成が中止されることを確認する"""
+    _, main = app_client
+
+    story_state = {"tokens": 0, "closed": threading.Event()}
+
+    def slow_story(name, keyword):
+        try:
+            for _ in range(100):
+                time.sleep(0.02)
+                story_state["tokens"] += 1
+                yield "星"
+        finally:
+            story_state["closed"].set()
+
+    monkeypatch.setattr(main, "OPENAI_GENERATION_MODE", "sequential")
+    monkeypatch.setattr(main, "generate_constellation_name", lambda keyword: "海座")
+    monkeypatch.setattr(main, "stream_constellation_story", slow_story)
+
+    async def scenario():
+        async def failing_detection():
+            await asyncio.sleep(0.1)
+            raise ValueError("画像のデコードに失敗しました")
+
+        detection = asyncio.ensure_future(failing_detection())
+        return [event async for event in main.stream_constellation_events(detection, "海")]
+
+    events = asyncio.run(scenario())
+    assert events[-1].startswith("event: error")
+    assert story_state["closed"].wait(timeout=2)
+    assert story_state["tokens"] < 100
+
+def test_stream_uses_combined_profile(app_client, monkeypatch):
+    """combinedモードのストリーミングでは、名前・ストーリー・特徴を1回のAPI呼び出しで生成することを確認する"""
+    client, main = app_client
+
+    calls = []
+
+    def fake_profile(keyword):
+        calls.append(keyword)
+        return {"name": "海座", "story": "海の物語", "shape": "regular", "star_count": 5,
+                "brightness": "high", "pattern": "scattered"}
+
+    def unexpected(*args):
+        raise AssertionError("combinedモードで個別のAPI呼び出しが行われました")
+
+    monkeypatch.setattr(main, "OPENAI_GENERATION_MODE", "combined")
+    monkeypatch.setattr(main, "generate_constellation_profile", fake_profile)
+    for name in ("generate_constellation_name", "stream_constellation_story", "extract_constellation_features"):
+        monkeypatch.setattr(main, name, unexpected)
+
+    files = {"image": ("sky.png", create_star_image_bytes(seed=9), "image/png")}
+    response = client.post("/api/generate-constellation/stream", data={"keyword": "海"}, files=files)
+    assert response.status_code == 200
+
+    events = parse_sse_events(response.text)
+    names = [event for event, _ in events]
+    assert names[-1] == "done" and "error" not in names
+    assert ("story", {"token": "海の物語"}) in events
+    done = events[-1][1]
+    assert (done["constellation_name"], done["story"]) == ("海座", "海の物語")
+    assert calls == ["海"]
@@ -0,0 +1,100 @@
+import os
+import sys
+import json
+import logging
+import tempfile
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.synthetic_sky import SyntheticSkyConfig, generate_synthetic_sky, save_synthetic_sky, load_ground_truth
+from benchmarks.evaluate_detection import match_stars, score_detection, evaluate_modes, compare_accuracy
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# テストでは明るい星が数個写る小さい画像を使う
+SMALL_SKY = SyntheticSkyConfig(width=400, height=300, star_count=60, magnitude_range=(0.0, 4.0),
+                               glow_count=1, hot_pixel_count=5, seed=2)
+
+def test_generation_is_deterministic_and_consistent():
+    """同じシードで同じ画像になり、正解の星の位置が明るく、地上の景色に隠れた星は含まれないかテスト"""
+    sky = generate_synthetic_sky(SMALL_SKY)
+    again = generate_synthetic_sky(SMALL_SKY)
+    assert sky.image.shape == (300, 400) and sky.image.dtype == np.uint8
+    assert np.array_equal(sky.image, again.image) and sky.stars == again.stars
+    assert not np.array_equal(sky.image, generate_synthetic_sky(SyntheticSkyConfig(**{**SMALL_SKY.__dict__, "seed": 4})).image)
+
+    assert 0 < len(sky.stars) < SMALL_SKY.star_count
+    magnitudes = [star["magnitude"] for star in sky.stars]
+    assert magnitudes == sorted(magnitudes)
+    background = float(np.median(sky.image))
+    for star in sky.stars[:5]:
+        assert sky.image[int(round(star["y"])), int(round(star["x"]))] > background + 80
+    # 地上の景色は画像の下側にあり、正解の星はその上にある
+    assert float(sky.image[-5:].mean()) < background
+    assert max(star["y"] for star in sky.stars) < SMALL_SKY.height - 5
+
+def test_save_and_load_ground_truth():
+    """画像と正解データを保存し、正解データを読み込めるかテスト"""
+    sky = generate_synthetic_sky(SMALL_SKY)
+    image_path, truth_path = save_synthetic_sky(sky, os.path.join(tempfile.mkdtemp(), "sky"))
+    assert os.path.exists(image_path)
+    assert load_ground_truth(truth_path) == sky.stars
+    with open(truth_path, "r", encoding="utf-8") as f:
+        assert json.load(f)["config"]["seed"] == SMALL_SKY.seed
+
+def test_match_and_score():
+    """1対1の対応付けと、適合率・再現率・重心の誤差の計算をテスト"""
+    truth = [
+        {"x": 10.0, "y": 10.0, "snr": 20.0},
+        {"x": 50.0, "y": 50.0, "snr": 20.0},
+        {"x": 90.0, "y": 90.0, "snr": 1.0}
+    ]
+    detected = [
+        {"x": 11, "y": 10},
+        {"x": 10, "y": 10, "centroid_x": 10.0, "centroid_y": 10.5},
+        {"x": 200, "y": 200}
+    ]
+    # 同じ正解の星には、より近い検出結果だけが対応する
+    assert match_stars(detected, truth, 3.0) == [(1, 0, 0.5)]
+
+    score = score_detection(detected, truth, radius=3.0, min_snr=5.0)
+    assert (score["detected"], score["matched"], score["detectable"]) == (3, 1, 2)
+    assert score["precision"] == 1 / 3 and score["recall"] == 0.5
+    assert score["centroid_error_rms"] == 0.5
+
+    empty = score_detection([], truth)
+    assert empty["precision"] == 0.0 and empty["centroid_error_mean"] is None
+
+def test_evaluate_modes_reports_accuracy_and_runtime():
+    """合成画像で検出方法ごとの精度と実行時間が求まり、明るい星が検出されるかテスト"""
+    sky = generate_synthetic_sky(SMALL_SKY)
+    image_path, _ = save_synthetic_sky(sky, os.path.join(tempfile.mkdtemp(), "sky"))
+    results = evaluate_modes([image_path], [sky.stars], modes=["single", "pyramid"], min_snr=30.0)
+    assert [result["mode"] for result in results] == ["single", "pyramid"]
+    for result in results:
+        assert result["detectable"] > 0 and result["recall"] >= 0.8
+        assert result["precision"] > 0.5
+        assert result["centroid_error_rms"] < 1.5
+        assert result["median_seconds"] > 0
+
+def test_compare_accuracy_flags_drops():
+    """ベースラインより精度が許容範囲を超えて下がった指標だけが検出されるかテスト"""
+    baseline = {"results": [{"mode": "single", "precision": 0.9, "recall": 0.8}]}
+    current = [
+        {"mode": "single", "precision": 0.95, "recall": 0.7},
+        {"mode": "pyramid", "precision": 0.5, "recall": 0.5}
+    ]
+    comparisons = compare_accuracy(current, baseline, tolerance=0.02)
+    flagged = [(c["mode"], c["metric"]) for c in comparisons if c["regression"]]
+    assert len(comparisons) == 2 and flagged == [("single", "recall")]
+
+if __name__ == "__main__":
+    test_generation_is_deterministic_and_consistent()
+    test_save_and_load_ground_truth()
+    test_match_and_score()
+    test_evaluate_modes_reports_accuracy_and_runtime()
+    test_compare_accuracy_flags_drops()
+    logger.info("すべてのテストが成功しました")
@@ -0,0 +1,97 @@
+import os
+import sys
+import time
+import logging
+import cv2
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.core.star_detection import (
+    detect_stars_in_image, detect_stars_with_blob, detect_stars_with_blob_tiled,
+    detect_stars_with_threshold, detect_stars_with_threshold_tiled, compute_star_field
+)
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def create_star_field_image(width=2400, height=1800, star_count=800, noise=6.0, seed=0):
+    """
+    テスト用のフル解像度の星空画像（グレースケール）を生成する
+
+    Args:
+        width: 画像の幅
+        height: 画像の高さ
+        star_count: 描画する星の数
+        noise: 背景ノイズの標準偏差
+        seed: 乱数シード
+
+    Returns:
+        グレースケール画像
+    """
+    rng = np.random.default_rng(seed)
+    image = rng.normal(20, noise, (height, width)).clip(0, 255).astype(np.uint8)
+    for _ in range(star_count):
+        x = int(rng.integers(3, width - 3))
+        y = int(rng.integers(3, height - 3))
+        radius = int(rng.integers(1, 6))
+        cv2.circle(image, (x, y), radius, int(rng.integers(80, 256)), -1)
+    return cv2.GaussianBlur(image, (3, 3), 0)
+
+def star_keys(stars):
+    """比較用に星のリストを座標順のタプルに変換する"""
+    return sorted((star["x"], star["y"], float(star["brightness"]), float(star["area"])) for star in stars)
+
+def test_tiled_threshold_detection_matches_single_pass():
+    """タイル分割した閾値処理が画像全体を1回で処理した場合と同じ星を返すことを確認する"""
+    image = create_star_field_image(noise=0.0, seed=1)
+
+    for use_adaptive in (True, False):
+        single = detect_stars_with_threshold(image, use_adaptive=use_adaptive)
+        tiled = detect_stars_with_threshold_tiled(image, use_adaptive=use_adaptive, tile_size=500, tile_workers=3)
+        logger.info(f"閾値処理（適応的={use_adaptive}）: 1回={len(single)}個, タイル={len(tiled)}個")
+        assert single
+        assert star_keys(tiled) == star_keys(single)
+
+def test_tiled_blob_detection_matches_single_pass():
+    """タイル分割したBlob検出が画像全体を1回で処理した場合と同じ星を返すことを確認する"""
+    image = create_star_field_image(seed=2)
+
+    started_at = time.perf_counter()
+    single = detect_stars_with_blob(image)
+    single_seconds = time.perf_counter() - started_at
+    started_at = time.perf_counter()
+    tiled = detect_stars_with_blob_tiled(image, tile_size=500, tile_workers=4)
+    tiled_seconds = time.perf_counter() - started_at
+    logger.info(f"Blob検出: 1回={len(single)}個 {single_seconds:.2f}秒, タイル={len(tiled)}個 {tiled_seconds:.2f}秒")
+
+    assert single
+    assert len(tiled) == len(single)
+    # Blobの重心はfloat32で計算されるため、整数座標への切り捨てが1ピクセル異なる場合がある
+    remaining = list(single)
+    for star in tiled:
+        match = next(
+            other for other in remaining
+            if abs(other["x"] - star["x"]) <= 1 and abs(other["y"] - star["y"]) <= 1
+            and other["area"] == star["area"]
+        )
+        remaining.remove(match)
+
+def test_tiled_mode_scales_stars_to_render_size():
+    """フル解像度で検出した星が描画用の画像の座標に変換されることを確認する"""
+    image = create_star_field_image(width=3200, height=2400, star_count=300, seed=3)
+
+    single = detect_stars_in_image(image, max_detected=50)
+    tiled = detect_stars_in_image(image, max_detected=50, mode="tiled", tile_size=800)
+    assert {(star["x"], star["y"]) for star in tiled} == {(star["x"], star["y"]) for star in single}
+
+    star_field = compute_star_field(image, detection_mode="tiled", tile_size=800, render_size=(800, 600))
+    assert star_field.image_size == (800, 600)
+    assert ((star_field.stars.x >= 0) & (star_field.stars.x < 800)).all()
+    assert ((star_field.stars.y >= 0) & (star_field.stars.y < 600)).all()
+    assert star_field.clusters
+
+if __name__ == "__main__":
+    test_tiled_threshold_detection_matches_single_pass()
+    test_tiled_blob_detection_matches_single_pass()
+    test_tiled_mode_scales_stars_to_render_size()
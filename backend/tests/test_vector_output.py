@@ -0,0 +1,115 @@
+import os
+import sys
+import io
+import logging
+import tempfile
+import xml.etree.ElementTree as ET
+import numpy as np
+from PIL import Image, ImageOps
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from helpers import create_star_image_bytes
+from app.core.constellation import render_constellation, render_constellation_svg
+from app.core.pipeline import run_constellation_pipeline, orient_points
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SVG_NAMESPACE = "{http://www.w3.org/2000/svg}"
+
+def test_vector_outputs_match_raster_and_write_no_files():
+    """svg・vectorsの出力が画像を保存せず、描画する場合と同じ星と星座ラインを返すかテスト"""
+    content = create_star_image_bytes(seed=4)
+    output_dir = tempfile.mkdtemp()
+    raster = run_constellation_pipeline(content, output_dir=output_dir)
+    written = set(os.listdir(output_dir))
+
+    for output in ("svg", "vectors"):
+        result = run_constellation_pipeline(content, output_dir=output_dir, output=output)
+        assert result["image_path"] is None and result["image_filename"] is None
+        assert result["stars"] == raster["stars"]
+        assert result["constellation_lines"] == raster["constellation_lines"]
+        assert (result["overlay"]["width"], result["overlay"]["height"]) == (800, 600)
+        assert ("svg" in result["overlay"]) == (output == "svg")
+    assert set(os.listdir(output_dir)) == written
+
+    try:
+        run_constellation_pipeline(content, output_dir=output_dir, output="pdf")
+        assert False, "未対応の出力でValueErrorが発生しませんでした"
+    except ValueError:
+        pass
+
+def test_svg_overlay_contains_all_lines_and_stars():
+    """SVGのオーバーレイが座標系の大きさのviewBoxを持ち、全てのラインと星を含むかテスト"""
+    points = [[(10, 10), (60, 20), (40, 70), (90, 90)]]
+    _, constellation_data = render_constellation(np.zeros((120, 160), dtype=np.uint8), points)
+    root = ET.fromstring(render_constellation_svg(constellation_data, 160, 120))
+
+    assert root.get("viewBox") == "0 0 160 120"
+    lines = root.findall(f".//{SVG_NAMESPACE}line")
+    circles = root.findall(f".//{SVG_NAMESPACE}circle")
+    assert len(lines) == len(constellation_data["lines"]) == 3
+    assert [(int(c.get("cx")), int(c.get("cy"))) for c in circles] == points[0]
+    first = constellation_data["lines"][0]
+    assert (int(lines[0].get("x1")), int(lines[0].get("y2"))) == (first["start"]["x"], first["end"]["y"])
+
+def jpeg_with_orientation(content, orientation):
+    """画像をEXIFの Orientation を付けたJPEGに変換する"""
+    image = Image.open(io.BytesIO(content)).convert("RGB")
+    exif = Image.Exif()
+    exif[0x0112] = orientation
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=95, exif=exif)
+    return buffer.getvalue()
+
+def test_orient_points_matches_exif_transpose():
+    """座標の変換が、PILでEXIFの回転情報を適用した画像の画素の位置と一致するかテスト"""
+    width, height, point = 7, 4, (2, 1)
+    for orientation in range(1, 9):
+        pixels = np.zeros((height, width), dtype=np.uint8)
+        pixels[point[1], point[0]] = 255
+        image = Image.fromarray(pixels)
+        image.getexif()[0x0112] = orientation
+        transposed = np.array(ImageOps.exif_transpose(image))
+
+        oriented, oriented_width, oriented_height = orient_points([[point]], width, height, orientation)
+        assert (oriented_width, oriented_height) == (transposed.shape[1], transposed.shape[0])
+        y, x = np.argwhere(transposed == 255)[0]
+        assert oriented[0][0] == (x, y), f"orientation={orientation}"
+
+def test_vector_output_follows_exif_orientation():
+    """EXIFで90度回転して表示する画像では、座標系の幅と高さが入れ替わり、星の座標も回転するかテスト"""
+    content = create_star_image_bytes(seed=4)
+    upright = run_constellation_pipeline(jpeg_with_orientation(content, 1), output="vectors")
+    rotated = run_constellation_pipeline(jpeg_with_orientation(content, 6), output="vectors")
+
+    assert upright["stars"]
+    width, height = upright["overlay"]["width"], upright["overlay"]["height"]
+    assert (rotated["overlay"]["width"], rotated["overlay"]["height"]) == (height, width)
+    assert rotated["overlay"]["orientation"] == 6
+    assert rotated["stars"] == [{"x": height - 1 - star["y"], "y": star["x"]} for star in upright["stars"]]
+
+def test_endpoint_vector_output(app_client, monkeypatch):
+    """/api/generate-constellation が output=svg で画像のパスの代わりにオーバーレイを返すかテスト"""
+    client, main = app_client
+    monkeypatch.setattr(main, "generate_constellation_content", lambda keyword: (f"{keyword}座", "物語", None))
+
+    files = {"image": ("sky.png", create_star_image_bytes(seed=5), "image/png")}
+    response = client.post("/api/generate-constellation", data={"keyword": "海", "output": "svg"}, files=files)
+    assert response.status_code == 200
+    body = response.json()
+    assert body["image_path"] is None
+    assert body["overlay"]["svg"].startswith("<svg")
+    assert body["stars"] and body["constellation_lines"]
+    assert not os.listdir(os.path.join("static", "images"))
+
+    response = client.post("/api/generate-constellation", data={"keyword": "海", "output": "pdf"}, files=files)
+    assert response.status_code == 400
+
+if __name__ == "__main__":
+    test_vector_outputs_match_raster_and_write_no_files()
+    test_svg_overlay_contains_all_lines_and_stars()
+    test_orient_points_matches_exif_transpose()
+    test_vector_output_follows_exif_orientation()
+    logger.info("すべてのテストが成功しました")
@@ -0,0 +1,105 @@
+import os
+import sys
+import logging
+import cv2
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.core.star_detection import (
+    detect_stars_with_blob, detect_stars_with_threshold, is_close_to_existing_star,
+    _merge_distinct_stars, _threshold_stars
+)
+from app.core.star_table import StarTable
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def create_disk_field(width=640, height=480, star_count=120, seed=0):
+    """
+    テスト用に、画像の端にかかるものを含む円形の星を描いた画像を生成する
+
+    Args:
+        width: 画像の幅
+        height: 画像の高さ
+        star_count: 星の数
+        seed: 乱数シード
+
+    Returns:
+        グレースケール画像
+    """
+    rng = np.random.default_rng(seed)
+    image = rng.normal(20, 5, (height, width)).clip(0, 255).astype(np.uint8)
+    for _ in range(star_count):
+        center = (int(rng.integers(0, width)), int(rng.integers(0, height)))
+        cv2.circle(image, center, int(rng.integers(1, 6)), int(rng.integers(90, 256)), -1)
+    return cv2.GaussianBlur(image, (3, 3), 0)
+
+def window_mean(gray, x, y):
+    """従来の星ごとの明るさの計算（5x5の窓の平均）"""
+    x_min, x_max = max(0, x - 2), min(gray.shape[1] - 1, x + 2)
+    y_min, y_max = max(0, y - 2), min(gray.shape[0] - 1, y + 2)
+    return np.mean(gray[y_min:y_max + 1, x_min:x_max + 1])
+
+def test_blob_photometry_matches_per_keypoint_mean():
+    """Blob検出の明るさが、キーポイントごとに計算した従来の値と一致するかテスト"""
+    gray = create_disk_field()
+    stars = detect_stars_with_blob(gray)
+    assert len(stars) > 50
+    for star in stars:
+        assert star["brightness"] == window_mean(gray, star["x"], star["y"])
+        assert star["peak"] >= star["brightness"]
+
+def test_threshold_photometry_matches_per_component_reference():
+    """閾値処理の面積・重心・明るさが、連結成分ごとに計算した値と一致するかテスト"""
+    gray = create_disk_field(seed=1)
+    _, binary = cv2.threshold(gray, 60, 255, cv2.THRESH_BINARY)
+    table = _threshold_stars(gray, gray, 60, 5, use_adaptive=False)
+    assert len(table) > 50
+
+    _, labels = cv2.connectedComponents(binary, connectivity=8)
+    for star in table.to_dicts():
+        label = labels[int(round(star["centroid_y"])), int(round(star["centroid_x"]))]
+        ys, xs = np.nonzero(labels == label)
+        values = gray[ys, xs].astype(np.float64)
+        assert star["area"] == len(xs)
+        assert star["flux"] == values.sum()
+        assert star["peak"] == values.max()
+        assert np.isclose(star["centroid_x"], (values * xs).sum() / values.sum())
+        assert np.isclose(star["centroid_y"], (values * ys).sum() / values.sum())
+        assert (star["x"], star["y"]) == (int(star["centroid_x"]), int(star["centroid_y"]))
+        assert star["brightness"] == window_mean(gray, star["x"], star["y"])
+
+def test_threshold_min_area_uses_contour_area():
+    """最小面積によるノイズの除外が、従来どおり輪郭の面積を基準にしているかテスト"""
+    gray = np.zeros((100, 200), dtype=np.uint8)
+    for i, size in enumerate([1, 2, 3, 4]):
+        gray[20:20 + size, 20 + i * 40:20 + i * 40 + size] = 200
+    # 輪郭の面積はそれぞれ 0, 1, 4, 9（画素数は 1, 4, 9, 16）
+    stars = detect_stars_with_threshold(gray, threshold=100, min_area=4, use_adaptive=False)
+    assert sorted(star["area"] for star in stars) == [9, 16]
+
+def test_merge_distinct_stars_matches_sequential_check():
+    """重複する星の除外が、星を1個ずつ比較する従来の方法と同じ結果になるかテスト"""
+    rng = np.random.default_rng(2)
+    def random_table(count):
+        return StarTable.from_columns(
+            rng.integers(0, 300, count), rng.integers(0, 300, count), rng.uniform(0, 255, count), np.ones(count)
+        )
+    for existing_count in (0, 5):
+        existing, candidates = random_table(existing_count), random_table(400)
+
+        expected = existing.to_dicts()
+        for star in candidates.to_dicts():
+            if not any(is_close_to_existing_star(star, other, 10) for other in expected):
+                expected.append(star)
+
+        merged = _merge_distinct_stars(existing, candidates, 10)
+        assert merged.to_dicts() == expected
+
+if __name__ == "__main__":
+    test_blob_photometry_matches_per_keypoint_mean()
+    test_threshold_photometry_matches_per_component_reference()
+    test_threshold_min_area_uses_contour_area()
+    test_merge_distinct_stars_matches_sequential_check()
+    logger.info("すべてのテストが成功しました")
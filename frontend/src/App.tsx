@@ -25,6 +25,7 @@ function App() {
     stars?: Array<{x: number, y: number}>;
     constellation_lines?: Array<{start: {x: number, y: number}, end: {x: number, y: number}}>;
     selected_cluster_index?: number;
+    overlay?: {width: number, height: number, orientation?: number};
   } | null>(null)
 
   const handleSubmit = async (e: React.FormEvent) => {
@@ -47,6 +48,9 @@ function App() {
     const formData = new FormData();
     formData.append('image', image);
     formData.append('keyword', keyword);
+    // サーバーでは星座画像を描画せず、座標だけを受け取ってアップロードした画像に重ねる
+    // （座標はサーバーでEXIFの回転情報を適用済みのため、ブラウザが回転して表示する画像にそのまま重なる）
+    formData.append('output', 'vectors');
     
     try {
       console.log('Submitting constellation generation request...');
@@ -59,8 +63,8 @@ function App() {
       
       console.log('Received API response:', response.data);
       
-      if (!response.data.image_path) {
-        console.warn('No image path in response');
+      if (!response.data.image_path && !response.data.overlay) {
+        console.warn('No image path or overlay in response');
         setError('画像の生成に失敗しました');
         return;
       }
@@ -76,6 +80,7 @@ function App() {
         stars: response.data.stars || [],
         constellation_lines: response.data.constellation_lines || [],
         selected_cluster_index: response.data.selected_cluster_index,
+        overlay: response.data.overlay,
       });
       
       console.log('State updated with result:', result);
@@ -185,6 +190,7 @@ function App() {
           {result && !loading && (
             <ResultDisplay 
               result={result}
+              sourceImage={image}
             />
           )}
         </Paper>
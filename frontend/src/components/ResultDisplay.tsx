@@ -19,10 +19,18 @@ interface ResultDisplayProps {
     stars?: Star[];
     constellation_lines?: ConstellationLine[];
     selected_cluster_index?: number;
+    overlay?: {
+      // 座標はサーバーでEXIFの回転情報（orientation）を適用済みで、ブラウザが回転して表示する画像と同じ向き
+      width: number;
+      height: number;
+      orientation?: number;
+    };
   };
+  // overlay がある場合（サーバーで星座画像を描画しない場合）に背景として描画するアップロード画像
+  sourceImage?: File | null;
 }
 
-const ResultDisplay: React.FC<ResultDisplayProps> = ({ result }) => {
+const ResultDisplay: React.FC<ResultDisplayProps> = ({ result, sourceImage }) => {
   const canvasRef = useRef<HTMLCanvasElement>(null);
   const [error, setError] = useState<string | null>(null);
   const [imageLoaded, setImageLoaded] = useState(false);
@@ -34,7 +42,12 @@ const ResultDisplay: React.FC<ResultDisplayProps> = ({ result }) => {
       return;
     }
     
-    if (!result.image_path) {
+    // overlay の場合はアップロードした画像を星の座標系の大きさに合わせて描画する
+    const overlay = !result.image_path && sourceImage ? result.overlay : undefined;
+    const sourceUrl = overlay && sourceImage ? URL.createObjectURL(sourceImage) : null;
+    const imageSrc = sourceUrl || result.image_path;
+    
+    if (!imageSrc) {
       console.warn('画像パスが提供されていません');
       return;
     }
@@ -54,12 +67,12 @@ const ResultDisplay: React.FC<ResultDisplayProps> = ({ result }) => {
     const img = new Image();
     
     img.onload = () => {
-      // キャンバスのサイズを画像に合わせる
-      canvas.width = img.width || 800;
-      canvas.height = img.height || 600;
+      // キャンバスのサイズを画像（overlay の場合は星の座標系）に合わせる
+      canvas.width = overlay ? overlay.width : img.width || 800;
+      canvas.height = overlay ? overlay.height : img.height || 600;
       
       // 画像を描画
-      ctx.drawImage(img, 0, 0);
+      ctx.drawImage(img, 0, 0, canvas.width, canvas.height);
       
       if (result.constellation_lines && result.constellation_lines.length > 0) {
         ctx.strokeStyle = 'rgba(255, 215, 0, 0.4)'; // 黄色（薄く）
@@ -108,10 +121,10 @@ const ResultDisplay: React.FC<ResultDisplayProps> = ({ result }) => {
     };
     
     img.onerror = (e) => {
-      console.error('画像の読み込みエラー:', result.image_path, e);
+      console.error('画像の読み込みエラー:', imageSrc, e);
       setError('画像の読み込みに失敗しました。別のパスで再試行します...');
       
-      if (result.image_path) {
+      if (result.image_path && !sourceUrl) {
         try {
           let fallbackPath;
           
@@ -140,10 +153,15 @@ const ResultDisplay: React.FC<ResultDisplayProps> = ({ result }) => {
       }
     };
     
-    console.log('画像の読み込みを試行:', result.image_path);
-    img.src = result.image_path;
+    console.log('画像の読み込みを試行:', imageSrc);
+    img.src = imageSrc;
     
-  }, [result]);
+    return () => {
+      if (sourceUrl) {
+        URL.revokeObjectURL(sourceUrl);
+      }
+    };
+  }, [result, sourceImage]);
   
   if (!result) {
     return <div className="text-red-500">データが見つかりません</div>;
@@ -198,7 +216,7 @@ const ResultDisplay: React.FC<ResultDisplayProps> = ({ result }) => {
         />
         
         {/* 画像読み込み失敗時のフォールバック表示 */}
-        {!imageLoaded && result.image_path && (
+        {!imageLoaded && (result.image_path || result.overlay) && (
           <Box sx={{ 
             p: 2, 
             textAlign: 'center', 